@@ -2,14 +2,31 @@ import streamlit as st
 import time
 import json
 import re
-from openai import OpenAI, AuthenticationError
-import io
 import os
+import queue
+import threading
 from dotenv import load_dotenv
-from pypdf import PdfReader
-from docx import Document
-from openpyxl import load_workbook
-import httpx
+from export import ExportError, PricingSubmitter
+from fleet import FLEET_EXTRACTION_VERSION
+from instrumentation import bind_context, dossier_trace, export_trace, summarize
+from pipeline import (
+    ENRICHMENT_KEYS,
+    EXTRACTION_VERSION,
+    REQUIRED_DOCS_LIST,
+    STREAMED_KEY_INFO_ARRAYS,
+    PipelineError,
+    build_quote,
+    check_completeness,
+    create_clients,
+    enrich_data,
+    extract_dossier_information,
+    forget_pdf_source,
+    to_agent_data,
+)
+from jobs import DONE, FAILED, PENDING, STAGES, JobRunner, JobStore
+from rules import load_rules
+from session import DossierSession, data_fingerprint
+from spool import spool_files
 
 load_dotenv() # Charge les variables du fichier .env dans l'environnement
 
@@ -23,205 +40,181 @@ if PERPLEXITY_API_KEY:
     PERPLEXITY_API_KEY = PERPLEXITY_API_KEY.strip()
 
 # --- Configuration & Constantes ---
+# La logique métier et ses paramètres sont définis dans pipeline.py
 
 st.set_page_config(layout="wide")
 
-REQUIRED_DOCS_LIST = [
-    "Formulaire de demande / questionnaire dûment rempli",
-    "Liste détaillée des véhicules de la flotte (Excel ou structuré)",
-    "Historique de sinistralité sur les 3 à 5 dernières années",
-    "Relevé d'informations / Attestation du précédent assureur",
-    "Extrait Kbis récent de l'entreprise",
-    "RIB de l'entreprise",
-    "Conditions particulières souhaitées",
-    "Document non identifiable"
-]
+# Intervalle minimal entre deux rafraîchissements de l'affichage pendant l'extraction en flux
+STREAM_RENDER_INTERVAL_SECONDS = 0.5
+# Intervalle d'interrogation de l'état d'un traitement en arrière-plan
+JOB_POLL_INTERVAL_SECONDS = 2
 
 # --- Récupération des Clés API depuis l'environnement ---
 # Les clés sont maintenant chargées depuis le fichier .env
 
 
-# --- Fonctions d'Extraction de Texte ---
+@st.cache_resource(show_spinner=False)
+def get_clients(openai_api_key, perplexity_api_key):
+    """Clients OpenAI et Perplexity partagés par toutes les sessions : le pool de connexions est conservé d'une analyse à l'autre."""
+    return create_clients(openai_api_key, perplexity_api_key)
 
-def extract_text_from_file(uploaded_file):
-    """Extrait le texte de différents types de fichiers, en gérant les onglets multiples pour Excel."""
-    try:
-        if uploaded_file.type == "application/pdf":
-            pdf_reader = PdfReader(io.BytesIO(uploaded_file.getvalue()))
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() or ""
-            return text
-        elif uploaded_file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            doc = Document(io.BytesIO(uploaded_file.getvalue()))
-            return "\n".join([para.text for para in doc.paragraphs])
-        elif uploaded_file.type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet":
-            workbook = load_workbook(filename=io.BytesIO(uploaded_file.getvalue()))
-            full_text = ""
-            for sheet_name in workbook.sheetnames:
-                sheet = workbook[sheet_name]
-                full_text += f"--- DEBUT CONTENU DE L'ONGLET: '{sheet_name}' ---\n"
-                rows_data = []
-                for row in sheet.iter_rows(values_only=True):
-                    if any(cell is not None for cell in row):
-                        row_str = " | ".join([str(cell) if cell is not None else "" for cell in row])
-                        rows_data.append(row_str)
-                full_text += "\n".join(rows_data)
-                full_text += f"\n--- FIN CONTENU DE L'ONGLET: '{sheet_name}' ---\n\n"
-            return full_text
-        elif "text" in uploaded_file.type:
-            return uploaded_file.getvalue().decode("utf-8")
-        else:
-            return None
-    except Exception as e:
-        st.warning(f"Impossible de lire le fichier '{uploaded_file.name}': {e}")
-        return None
 
-# --- Fonctions des Agents ---
+@st.cache_resource(show_spinner=False)
+def get_job_store():
+    """Base des traitements en arrière-plan, partagée par toutes les sessions du processus."""
+    return JobStore()
 
-def identify_documents_in_content_with_llm(filename, content_snippet, client):
-    """Utilise l'IA pour identifier un ou plusieurs documents à partir du contenu d'un fichier."""
-    
-    prompt = f"""
-    Vous êtes un assistant expert en souscription d'assurance flotte automobile.
-    Votre tâche est d'analyser le contenu d'un fichier pour déterminer quels documents requis il contient. Un seul fichier peut contenir plusieurs types de documents (par exemple, un fichier Excel avec plusieurs onglets).
-
-    Voici la liste des types de documents possibles que nous recherchons :
-    <document_types>
-    {json.dumps(REQUIRED_DOCS_LIST, indent=2, ensure_ascii=False)}
-    </document_types>
-
-    Voici le nom du fichier et son contenu (qui peut contenir plusieurs sections/onglets) :
-    <filename>{filename}</filename>
-    <content>
-    {content_snippet[:8000]}
-    </content>
-
-    Analysez le contenu et déterminez TOUS les types de documents de la liste ci-dessus qui sont présents dans ce fichier.
-    
-    Retournez votre réponse exclusivement au format JSON, avec une seule clé "documents_identifies". La valeur de cette clé doit être une LISTE de chaînes de caractères correspondant aux types de documents trouvés.
-    Si le fichier contient une liste de véhicules ET un historique de sinistres, la liste doit contenir ces deux éléments.
-    Si le fichier ne correspond à aucun type de document ou est illisible, retournez une liste vide.
-
-    Exemple de réponse pour un fichier Excel contenant des véhicules et des sinistres:
-    {{
-      "documents_identifies": [
-        "Liste détaillée des véhicules de la flotte (Excel ou structuré)",
-        "Historique de sinistralité sur les 3 à 5 dernières années"
-      ]
-    }}
-    
-    Exemple si le document est incompréhensible:
-    {{
-      "documents_identifies": []
-    }}
+
+@st.cache_resource(show_spinner=False)
+def get_job_runner(openai_api_key, perplexity_api_key):
+    """Threads de traitement des jobs, démarrés une seule fois par processus Streamlit."""
+    openai_client, perplexity_client = get_clients(openai_api_key, perplexity_api_key)
+    return JobRunner(get_job_store(), openai_client, perplexity_client).start()
+
+
+@st.cache_resource(show_spinner=False)
+def get_pricing_submitter():
+    """Envoi au système de tarification (export.py), avec un client http partagé par toutes les sessions."""
+    return PricingSubmitter()
+
+
+def export_trace_once(trace_root, uploaded_files, dossier_session):
     """
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o", # Utilisation d'un modèle plus puissant pour cette tâche complexe
-            messages=[
-                {"role": "system", "content": "Vous êtes un expert en assurance qui identifie les documents contenus dans des fichiers."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.0,
-        )
-        result_json = response.choices[0].message.content
-        analysis_result = json.loads(result_json)
-        return analysis_result.get("documents_identifies", [])
-    except Exception as e:
-        st.error(f"Erreur lors de l'identification du fichier {filename}: {e}")
-        return []
-
-def extract_key_information_with_llm(all_content_text, client):
-    """Utilise l'IA pour extraire les informations clés de l'ensemble des documents."""
-
-    prompt = f"""
-    Vous êtes un expert en souscription d'assurance qui analyse un dossier de demande de devis complet.
-    Voici le contenu de tous les fichiers fournis, concaténés en un seul texte :
-    <dossier_complet>
-    {all_content_text[:15000]}
-    </dossier_complet>
-
-    Votre tâche est de lire attentivement l'intégralité du dossier et d'extraire les informations suivantes.
-    Retournez votre réponse exclusivement au format JSON. Si une information n'est pas trouvée, mettez la valeur `null` ou une liste vide [].
-
-    1.  **"nom_entreprise"**: Le nom légal de l'entreprise.
-    2.  **"secteur_activite"**: Le secteur d'activité de l'entreprise.
-    3.  **"region"**: La région ou le département principal de l'entreprise.
-    4.  **"nombre_vehicules"**: Le nombre total de véhicules dans la flotte. Instruction : comptez les lignes du tableau de véhicules.
-    5.  **"usage_flotte"**: L'usage principal de la flotte.
-    6.  **"type_flotte"**: Le type de véhicules majoritaire.
-    7.  **"chiffre_affaires_annuel"**: Le dernier chiffre d'affaires annuel.
-    8.  **"historique_sinistralite_resume"**: Un résumé court de l'historique de sinistralité.
-    9.  **"garanties_souhaitees"**: Une liste des garanties demandées (objets JSON avec "garantie", "incluse", "franchise_eur").
-    10. **"liste_vehicules"**: La liste détaillée des véhicules. Chaque véhicule doit être un objet JSON. Extrayez les colonnes telles que "marque", "modele", "immatriculation", "date_mise_circulation", "valeur", etc.
-
-    Exemple de format JSON de sortie attendu :
-    {{
-      "nom_entreprise": "Transport Express SARL",
-      "secteur_activite": "Transport routier de marchandises",
-      "region": "Île-de-France",
-      "nombre_vehicules": 2,
-      "usage_flotte": "Transport national de marchandises",
-      "type_flotte": "Camions de livraison",
-      "chiffre_affaires_annuel": "2.5 M€",
-      "historique_sinistralite_resume": "3 sinistres responsables sur les 36 derniers mois",
-      "garanties_souhaitees": [
-        {{"garantie": "Responsabilité civile", "incluse": "Oui", "franchise_eur": 500}}
-      ],
-      "liste_vehicules": [
-        {{ "immatriculation": "AA-123-BB", "marque_modele": "Renault Master", "valeur": 25000 }},
-        {{ "immatriculation": "CC-456-DD", "marque_modele": "Peugeot Expert", "valeur": 22000 }}
-      ]
-    }}
+    Exporte la trace d'une exécution du dossier et retourne son chemin. Les réexécutions du script qui
+    reprennent les mêmes fichiers et les mêmes points de reprise (clic sur un bouton, etc.) réutilisent
+    la trace déjà exportée au lieu d'en écrire une nouvelle.
     """
-    try:
-        with st.spinner("Extraction des données en cours..."):
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "Vous êtes un expert en extraction de données d'assurance au format JSON."},
-                    {"role": "user", "content": prompt}
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.0,
+    run_key = data_fingerprint(
+        dossier_session.id, [f.hash for f in uploaded_files],
+        {name: stage["empreinte"] for name, stage in dossier_session.stages.items()},
+    )
+    exported = st.session_state.get("trace_exportee")
+    if exported is None or exported[0] != run_key:
+        exported = (run_key, export_trace(trace_root))
+        st.session_state["trace_exportee"] = exported
+    return exported[1]
+
+
+def show_trace_summary(trace_root, trace_path):
+    """Affiche le coût et la durée du traitement, mesurés par l'instrumentation du pipeline."""
+    totals = summarize(trace_root)
+    st.caption(
+        f"⏱️ {trace_root.duration:.1f} s · {totals['appels_llm']} appel(s) LLM · "
+        f"{totals['prompt_tokens'] + totals['completion_tokens']} tokens · coût estimé {totals['cout_usd']:.4f} $ · "
+        f"cache : {totals['cache_hit']} hit(s) / {totals['cache_miss']} miss · trace : {trace_path}"
+    )
+
+def show_problems(problems):
+    """Affiche les problèmes non bloquants remontés par le pipeline, sous forme de couples (niveau, message)."""
+    for level, message in problems:
+        getattr(st, level)(message)
+
+def stream_key_information(analyses, uploaded_files, openai_client, problems):
+    """
+    Extraction des informations clés en flux : les champs et les véhicules sont affichés dès leur réception
+    (les véhicules des tableaux de flotte, lus sans LLM, apparaissent en premier).
+    L'extraction s'exécute dans un thread ; ses événements sont affichés par le thread du script Streamlit.
+    """
+    events = queue.Queue()
+    outcome = {}
+
+    def run():
+        try:
+            outcome["donnees"] = extract_dossier_information(
+                analyses, uploaded_files, openai_client, problems, on_event=lambda part, event: events.put(event)
             )
-            result_json = response.choices[0].message.content
-            return json.loads(result_json)
-    except Exception as e:
-        st.error(f"Une erreur est survenue lors de l'extraction des informations clés : {e}")
-        return None
+        except Exception as e:
+            outcome["erreur"] = e
+
+    worker = threading.Thread(target=bind_context(run), daemon=True)
+    worker.start()
+
+    fields, vehicles = {}, []
+    fields_placeholder, table_placeholder = st.empty(), st.empty()
+    last_render = 0.0
+    while worker.is_alive() or not events.empty():
+        try:
+            kind, key, value = events.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if kind == "element" and key == "liste_vehicules":
+            vehicles.append(value)
+        elif kind == "champ" and key not in STREAMED_KEY_INFO_ARRAYS and value not in (None, "", []):
+            fields.setdefault(key, value)
+        # Affichage limité à quelques rafraîchissements par seconde
+        if time.monotonic() - last_render >= STREAM_RENDER_INTERVAL_SECONDS or (events.empty() and not worker.is_alive()):
+            fields_placeholder.json(fields)
+            if vehicles:
+                table_placeholder.dataframe(vehicles, use_container_width=True)
+            last_render = time.monotonic()
+    worker.join()
+    # L'affichage provisoire est remplacé par le résultat consolidé
+    fields_placeholder.empty()
+    table_placeholder.empty()
+    if "erreur" in outcome:
+        raise outcome["erreur"]
+    return outcome["donnees"]
+
+def quote_file_name(quote_json):
+    """Nom de fichier sûr pour le téléchargement du JSON de tarification."""
+    company_name_safe = (quote_json.get("informations_client", {}).get("nom_entreprise") or "client").replace(" ", "_")
+    return f"donnees_tarification_{company_name_safe}.json"
+
+# --- Traitement en arrière-plan ---
+
+@st.experimental_fragment(run_every=JOB_POLL_INTERVAL_SECONDS)
+def poll_job(job_store, job_id):
+    """Affiche l'avancement d'un job ; la page est réexécutée dès que le job est terminé."""
+    job = job_store.get(job_id)
+    if job is None or job["statut"] in (DONE, FAILED):
+        st.rerun()
+    if job["statut"] == PENDING:
+        st.info(f"⏳ Dossier en file d'attente (position {job['position']}).")
+    else:
+        done = STAGES.index(job["etape"]) if job["etape"] in STAGES else 0
+        st.progress(done / len(STAGES), text=f"⚙️ Traitement en cours : {job['etape'] or 'démarrage'}")
+
+def show_job_result(job):
+    """Affiche le résultat d'un job terminé : complétude, problèmes et JSON de tarification."""
+    if job["statut"] == FAILED:
+        st.error(f"Le traitement du dossier a échoué : {job['erreur']}")
+        return
+    result = job["resultat"]
+    st.caption(f"⏱️ {result['duree_secondes']:.1f} s · fichiers : {', '.join(result['fichiers'])} · trace : {result['trace']}")
+    show_problems(result["problemes"])
+    if result["statut"] == "incomplet":
+        st.error("Le dossier est incomplet. Documents manquants : " + ", ".join(result["documents_manquants"]))
+    elif result["devis"] is not None:
+        quote_json = result["devis"]
+        analysis = quote_json["analyse_risque"]
+        st.info(f"**Décision :** {analysis['decision_souscription']}\n\n**Commentaires :** {analysis['commentaire_souscription']}")
+        st.code(json.dumps(quote_json, indent=4, ensure_ascii=False), language="json")
+        st.download_button(
+            label="📥 Télécharger le JSON",
+            data=json.dumps(quote_json, indent=4, ensure_ascii=False),
+            file_name=quote_file_name(quote_json),
+            mime="application/json",
+        )
 
-def smart_intake_agent(uploaded_files, openai_client):
+# --- Fonctions des Agents ---
+
+def smart_intake_agent(uploaded_files, openai_client, dossier_session):
     """
     L'agent Smart Intake analyse le contenu de chaque fichier, vérifie la complétude,
     puis extrait les informations clés.
+    Seuls les fichiers nouveaux de la session sont analysés ; l'extraction n'est refaite que si le dossier a changé.
     """
     st.write("🤖 **Agent Smart Intake en action...**")
-    
-    all_identified_doc_types = []
-    files_content = {}
 
     with st.spinner("Analyse du contenu de tous les documents en cours... Cela peut prendre un moment."):
-        for file in uploaded_files:
-            content = extract_text_from_file(file)
-            files_content[file.name] = content
-            
-            if content is None or not content.strip():
-                continue
-            
-            doc_types_found = identify_documents_in_content_with_llm(file.name, content, openai_client)
-            
-            if doc_types_found:
-                all_identified_doc_types.extend(doc_types_found)
+        analyses = dossier_session.analyze_files(uploaded_files, openai_client)
+    for analysis in analyses:
+        show_problems(analysis["problemes"])
 
     st.write("---")
     st.write("### ✅ Bilan de complétude du dossier")
     
-    present_docs = sorted(list(set(all_identified_doc_types)))
-    all_required = [doc for doc in REQUIRED_DOCS_LIST if doc != "Document non identifiable"]
-    missing_docs = sorted(list(set(all_required) - set(present_docs)))
+    present_docs, missing_docs = check_completeness(analyses)
     
     st.write("#### Documents Fournis (consolidés sur tous les fichiers) :")
     if present_docs:
@@ -241,8 +234,18 @@ def smart_intake_agent(uploaded_files, openai_client):
     st.markdown("---")
 
     # Nouvelle étape: Extraction des informations clés
-    full_content_string = "\n\n".join([f"--- DEBUT FICHIER: {name} ---\n{content}" for name, content in files_content.items() if content])
-    extracted_data = extract_key_information_with_llm(full_content_string, openai_client)
+    problems = []
+    try:
+        with st.spinner("Extraction des données en cours..."):
+            # Le texte complet des PDF n'est extrait que si l'étape doit être recalculée
+            extracted_data, problems = dossier_session.run_stage(
+                "extraction", [EXTRACTION_VERSION, FLEET_EXTRACTION_VERSION] + [[a["empreinte"], a["nom"], bool(a["texte"])] for a in analyses],
+                lambda stage_problems: stream_key_information(analyses, uploaded_files, openai_client, stage_problems),
+            )
+    except PipelineError as e:
+        st.error(str(e))
+        extracted_data = None
+    show_problems(problems)
 
     if extracted_data:
         st.write("### 📝 Informations Clés Extraites par l'IA")
@@ -262,167 +265,77 @@ def smart_intake_agent(uploaded_files, openai_client):
         other_info = {k: v for k, v in extracted_data.items() if k not in ['garanties_souhaitees', 'liste_vehicules']}
         st.json(other_info)
         
-        # Mapper les clés extraites vers le format attendu par les agents suivants
-        final_data_for_agents = {
-            "Nom de l'entreprise": extracted_data.get("nom_entreprise"),
-            "Secteur d'activité": extracted_data.get("secteur_activite"),
-            "Région": extracted_data.get("region"),
-            "Nombre de véhicules": extracted_data.get("nombre_vehicules"),
-            "Usage": extracted_data.get("usage_flotte"),
-            "Type de flotte": extracted_data.get("type_flotte"),
-            "Chiffre d'affaires": extracted_data.get("chiffre_affaires_annuel"),
-            "Historique de sinistralité": extracted_data.get("historique_sinistralite_resume"),
-            "Liste des véhicules": extracted_data.get("liste_vehicules", [])
-        }
-        return True, final_data_for_agents
+        return True, to_agent_data(extracted_data)
     else:
         st.error("L'extraction des informations clés a échoué.")
         return False, None
 
-def enrichment_layer_agent(data, perplexity_client, openai_client):
+def enrichment_layer_agent(data, perplexity_client, openai_client, dossier_session):
     """
     Agent qui utilise Perplexity pour la recherche web et OpenAI pour l'extraction.
     """
     st.write("🤖 **Agent Enrichment Layer en action...**")
-    
-    # 1. Définir les questions de recherche
-    company_name = data["Nom de l'entreprise"]
-    activity_sector = data["Secteur d'activité"]
-    region = data["Région"]
-    
-    search_queries = {
-        "sector_claim_rate": f"Quel est le taux de sinistralité moyen dans le secteur d'activité '{activity_sector}' en France ?",
-        "geo_risk": f"Quels sont les risques de vol, vandalisme et d'accident pour les véhicules d'entreprise dans la région '{region}' en France ?",
-        "telematics_risk_score_info": f"Comment un score de risque télématique influence-t-il l'assurance pour une flotte de '{data['Type de flotte']}' ?"
-    }
-    
-    # 2. Effectuer les recherches avec Perplexity
-    search_results = {}
 
     try:
-        for key, query in search_queries.items():
-            with st.spinner(f"Recherche en cours : {query}"):
-                response = perplexity_client.chat.completions.create(
-                    model="llama-3.1-sonar-small-128k-online",
-                    messages=[
-                        {"role": "system", "content": "Vous êtes un assistant de recherche. Fournissez des réponses factuelles et concises basées sur les informations disponibles sur Internet."},
-                        {"role": "user", "content": query},
-                    ],
-                )
-                search_results[key] = response.choices[0].message.content
-    except AuthenticationError:
-        st.error("Erreur d'authentification Perplexity. Veuillez vérifier votre clé API.")
-        return data
-    except Exception as e:
-        st.error(f"Une erreur est survenue lors de la recherche Perplexity : {e}")
+        with st.spinner("Recherche et extraction des données d'enrichissement en cours..."):
+            (enriched_data, search_results), _ = dossier_session.run_stage(
+                "enrichissement", data, lambda stage_problems: enrich_data(data, perplexity_client, openai_client)
+            )
+    except PipelineError as e:
+        st.error(str(e))
         return data
 
     with st.expander("Voir les résultats bruts de la recherche"):
         st.json(search_results)
-        
-    # 3. Extraire les informations structurées avec OpenAI
-    
-    extraction_prompt = f"""
-    Vous êtes un expert en analyse de données pour l'assurance.
-    Voici des informations brutes provenant d'une recherche sur Internet :
-    <search_results>
-    {json.dumps(search_results, indent=2, ensure_ascii=False)}
-    </search_results>
-
-    Votre tâche est d'extraire les informations clés suivantes et de les retourner dans un format JSON strict.
-    Si une information n'est pas clairement trouvable, mettez "Non trouvé".
-
-    Format JSON attendu :
-    {{
-        "taux_sinistralite_secteur": "Ex: 12%",
-        "analyse_risque_geo": "Un résumé court des risques de la région.",
-        "facteur_risque_telematique": "Un résumé court de l'influence de la télématique."
-    }}
-
-    Ne retournez que le JSON.
-    """
-    
-    try:
-        with st.spinner("Extraction des données structurées..."):
-            response = openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "Vous êtes un expert en extraction de données JSON."},
-                    {"role": "user", "content": extraction_prompt}
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.0,
-            )
-            extracted_info_json = response.choices[0].message.content
-            extracted_info = json.loads(extracted_info_json)
-    except Exception as e:
-        st.error(f"Une erreur est survenue lors de l'extraction par OpenAI : {e}")
-        return data
-
-    # 4. Fusionner les données
-    enriched_data = data.copy()
-    new_keys = [
-        "Taux de sinistralité du secteur", 
-        "Analyse du risque géographique", 
-        "Info sur le score télématique"
-    ]
-    enriched_data[new_keys[0]] = extracted_info.get("taux_sinistralite_secteur", "Non trouvé")
-    enriched_data[new_keys[1]] = extracted_info.get("analyse_risque_geo", "Non trouvé")
-    enriched_data[new_keys[2]] = extracted_info.get("facteur_risque_telematique", "Non trouvé")
     
     st.write("Données enrichies par l'IA :")
-    st.json({k: v for k, v in enriched_data.items() if k in new_keys})
+    st.json({k: v for k, v in enriched_data.items() if k in ENRICHMENT_KEYS})
     return enriched_data
 
-def rule_engine_agent(data):
+def rule_engine_agent(data, dossier_session):
     """
-    Simulates the Rule Engine agent.
-    - Helps with underwriting analysis.
+    Agent Rule Engine.
+    - Applique les règles de souscription à l'ensemble de la flotte.
     - Returns a JSON (in French) with all information for the quoting system.
     """
     st.write("🤖 **Agent Rule Engine en action...**")
     with st.spinner("Analyse du dossier pour la souscription et génération du JSON..."):
-        time.sleep(2)
-        
-        # Simulate underwriting rules
-        decision = "Favorable"
-        commentaires = "Le profil de l'entreprise est bon. Les données enrichies par l'IA confirment un risque modéré pour le secteur et la géographie."
+        quote_system_json, _ = dossier_session.run_stage(
+            "devis", [data, load_rules().version], lambda stage_problems: build_quote(data)
+        )
+        analysis = quote_system_json["analyse_risque"]
         
         st.write("Analyse de souscription :")
-        st.info(f"**Décision :** {decision}\n\n**Commentaires :** {commentaires}")
-
-        # Generate JSON for the quoting system (in French)
-        quote_system_json = {
-            "informations_client": {
-                "nom_entreprise": data.get("Nom de l'entreprise"),
-                "siren": data.get("SIREN", "N/A"), # Enrichi plus tard
-                "sante_financiere": data.get("Santé financière (fictif)", "N/A") # Enrichi plus tard
-            },
-            "informations_flotte": {
-                "nombre_vehicules": data.get("Nombre de véhicules"),
-                "type_flotte": data.get("Type de flotte"),
-                "usage": data.get("Usage"),
-                "liste_vehicules": data.get("Liste des véhicules", [])
-            },
-            "analyse_risque": {
-                "historique_sinistralite": data.get("Historique de sinistralité"),
-                "taux_sinistralite_secteur": data.get("Taux de sinistralité du secteur"),
-                "risque_geographique": data.get("Analyse du risque géographique"),
-                "info_score_telematique": data.get("Info sur le score télématique"),
-                "decision_souscription": decision,
-                "commentaire_souscription": commentaires
-            },
-            "parametres_tarification": {
-                "niveau_risque": "Moyen",
-                "segment": "Transport Logistique"
-            }
-        }
+        st.info(f"**Décision :** {analysis['decision_souscription']}\n\n**Commentaires :** {analysis['commentaire_souscription']}")
         
         st.write("JSON (en français) pour le système de tarification :")
         st.code(json.dumps(quote_system_json, indent=4, ensure_ascii=False), language="json")
         return quote_system_json
 
 
+def get_intake_files(uploaded_files):
+    """
+    Fichiers du dossier préparés pour l'analyse (spool.py) : les fichiers volumineux sont recopiés sur disque
+    une seule fois par chargement, puis conservés entre les réexécutions du script.
+    """
+    spooled = st.session_state.get("fichiers_prepares", {})
+    intake_files = spool_files([spooled.get(f.file_id, f) for f in uploaded_files])
+    st.session_state["fichiers_prepares"] = {f.file_id: intake for f, intake in zip(uploaded_files, intake_files)}
+    return intake_files
+
+
+def get_dossier_session():
+    """
+    Session du dossier en cours : conservée entre les réexécutions du script (st.session_state)
+    et retrouvée après un rechargement de la page grâce à son identifiant dans l'URL (?dossier=...).
+    """
+    if "dossier_session" not in st.session_state:
+        st.session_state["dossier_session"] = DossierSession.load(st.query_params.get("dossier"))
+    dossier_session = st.session_state["dossier_session"]
+    st.query_params["dossier"] = dossier_session.id
+    return dossier_session
+
+
 # --- Interface Principale ---
 
 st.title("Automatisation du Traitement des Devis Flotte Auto")
@@ -434,67 +347,121 @@ with st.expander("Voir la liste des documents requis", expanded=False):
     for doc in REQUIRED_DOCS_LIST:
         st.write(f"- {doc}")
 
+dossier_session = get_dossier_session()
+
 uploaded_files = st.file_uploader(
     "Veuillez charger tous les documents du dossier de demande de devis.",
     type=['pdf', 'xlsx', 'docx', 'csv', 'txt'],
-    accept_multiple_files=True
+    accept_multiple_files=True,
+    key=f"fichiers_{dossier_session.id}"
 )
 
+if st.button("Nouveau dossier"):
+    st.session_state.pop("dossier_session", None)
+    st.session_state.pop("fichiers_analyses", None)
+    st.query_params.clear()
+    st.rerun()
+
+upload_signature = [(f.name, f.size) for f in uploaded_files or []]
+uploaded_files = get_intake_files(uploaded_files or [])
+
 if uploaded_files:
-    if st.button("Lancer l'analyse du dossier", type="primary"):
+    # Les deux boutons sont affichés côte à côte à chaque exécution du script
+    analyze_col, background_col = st.columns(2)
+    analyze_clicked = analyze_col.button("Lancer l'analyse du dossier", type="primary")
+    background_clicked = background_col.button("Traiter en arrière-plan", help="Le dossier est traité sans bloquer la page ; le résultat reste disponible après un rechargement.")
+    if analyze_clicked:
+        st.session_state["fichiers_analyses"] = upload_signature
+    if background_clicked:
+        if not OPENAI_API_KEY or not PERPLEXITY_API_KEY:
+            st.error("🛑 Clés API non trouvées. Assurez-vous d'avoir un fichier .env correctement configuré, ou si l'application est déployée, que les secrets sont bien configurés dans Streamlit Cloud.")
+        else:
+            get_job_runner(OPENAI_API_KEY, PERPLEXITY_API_KEY)
+            st.query_params["job"] = get_job_store().submit(uploaded_files, name=dossier_session.id)
+    elif not analyze_clicked and st.session_state.get("fichiers_analyses") and st.session_state["fichiers_analyses"] != upload_signature:
+        st.info("Les fichiers du dossier ont changé : relancez l'analyse pour traiter les nouveaux fichiers.")
+
+    # L'analyse reste affichée lors des réexécutions du script (par exemple après un clic sur
+    # « Envoyer au tarificateur ») : les résultats sont alors repris des points de reprise de la session.
+    if st.session_state.get("fichiers_analyses") == upload_signature:
         # La vérification se fait maintenant sur les variables chargées depuis l'environnement
         if not OPENAI_API_KEY or not PERPLEXITY_API_KEY:
             st.error("🛑 Clés API non trouvées. Assurez-vous d'avoir un fichier .env correctement configuré, ou si l'application est déployée, que les secrets sont bien configurés dans Streamlit Cloud.")
         else:
-            # Création d'un client http qui ignore les proxys de l'environnement
-            http_client = httpx.Client(proxies={})
-
-            # Initialisation des clients, en passant le client http configuré
-            openai_client = OpenAI(api_key=str(OPENAI_API_KEY), http_client=http_client)
-            perplexity_client = OpenAI(api_key=str(PERPLEXITY_API_KEY), base_url="https://api.perplexity.ai", http_client=http_client)
-
-            # --- Smart Intake ---
-            is_complete, extracted_data = smart_intake_agent(uploaded_files, openai_client)
-            
-            # --- Processus conditionnel ---
-            if is_complete:
-                st.markdown("---")
-                
-                # --- Enrichment Layer ---
-                st.header("Étape 2: Enrichment Layer")
-                enriched_data = enrichment_layer_agent(extracted_data, perplexity_client, openai_client)
-                
-                st.markdown("---")
-
-                # --- Rule Engine ---
-                st.header("Étape 3: Rule Engine & Souscription")
-                quote_json = rule_engine_agent(enriched_data)
+            # Clients partagés par le processus (client http qui ignore les proxys de l'environnement)
+            openai_client, perplexity_client = get_clients(OPENAI_API_KEY, PERPLEXITY_API_KEY)
 
+            quote_json = None
+            with dossier_trace("dossier", source="streamlit", nombre_fichiers=len(uploaded_files)) as trace_root:
+                # --- Smart Intake ---
+                is_complete, extracted_data = smart_intake_agent(uploaded_files, openai_client, dossier_session)
+                
+                # --- Processus conditionnel ---
+                if is_complete:
+                    st.markdown("---")
+                    
+                    # --- Enrichment Layer ---
+                    st.header("Étape 2: Enrichment Layer")
+                    enriched_data = enrichment_layer_agent(extracted_data, perplexity_client, openai_client, dossier_session)
+                    
+                    st.markdown("---")
+
+                    # --- Rule Engine ---
+                    st.header("Étape 3: Rule Engine & Souscription")
+                    quote_json = rule_engine_agent(enriched_data, dossier_session)
+            show_trace_summary(trace_root, export_trace_once(trace_root, uploaded_files, dossier_session))
+            # Le dossier est traité : les PDF ouverts pendant l'analyse sont fermés
+            for uploaded_file in uploaded_files:
+                forget_pdf_source(uploaded_file.hash)
+
+            if quote_json is not None:
                 # Prépare le JSON pour le téléchargement
                 json_string_to_download = json.dumps(quote_json, indent=4, ensure_ascii=False)
                 
-                # Crée un nom de fichier sûr
-                company_name_safe = quote_json.get("informations_client", {}).get("nom_entreprise", "client").replace(" ", "_")
-
                 st.markdown("---")
 
                 col1, col2 = st.columns(2)
 
                 with col1:
                     if st.button("✅ Envoyer au tarificateur", type="primary", use_container_width=True):
-                        with st.spinner("Connexion au système de tarification..."):
-                            time.sleep(2)
-                        st.success("Les données ont été envoyées avec succès au système de tarification !")
-                        st.balloons()
+                        try:
+                            with st.spinner("Connexion au système de tarification..."):
+                                pricing_summary = get_pricing_submitter().submit([quote_json])
+                        except ExportError as e:
+                            st.error(str(e))
+                        else:
+                            if pricing_summary["echecs"]:
+                                st.error(f"Échec de l'envoi au système de tarification : {pricing_summary['echecs'][0]['erreur']}")
+                            else:
+                                st.success("Les données ont été envoyées avec succès au système de tarification !")
+                                st.balloons()
                 
                 with col2:
                     st.download_button(
                        label="📥 Télécharger le JSON",
                        data=json_string_to_download,
-                       file_name=f"donnees_tarification_{company_name_safe}.json",
+                       file_name=quote_file_name(quote_json),
                        mime="application/json",
                        use_container_width=True
                     )
 
                 st.balloons()
-                st.success("Processus de traitement du devis terminé !") 
\ No newline at end of file
+                st.success("Processus de traitement du devis terminé !") 
+
+# --- Suivi du traitement en arrière-plan ---
+# Le job est retrouvé par son identifiant dans l'URL (?job=...), y compris après un rechargement de la page.
+
+job_id = st.query_params.get("job")
+if job_id:
+    st.markdown("---")
+    st.header("Traitement en arrière-plan")
+    job = get_job_store().get(job_id)
+    if job is None:
+        st.warning("Traitement introuvable.")
+    elif job["statut"] in (DONE, FAILED):
+        show_job_result(job)
+    else:
+        if OPENAI_API_KEY and PERPLEXITY_API_KEY:
+            # Après un redémarrage du serveur, les threads de traitement reprennent les jobs en attente
+            get_job_runner(OPENAI_API_KEY, PERPLEXITY_API_KEY)
+        poll_job(get_job_store(), job_id)
@@ -0,0 +1,126 @@
+"""
+Traitement par lots des dossiers de demande de devis, sans interface Streamlit.
+
+Chaque sous-répertoire de DOSSIERS_DIR est un dossier : ses fichiers (pdf, xlsx, docx, csv, txt)
+passent par les trois étapes du pipeline (Smart Intake, Enrichment Layer, Rule Engine).
+Les dossiers sont traités en parallèle ; le résultat de chacun est écrit dans un fichier JSON
+(--output) ou sous forme d'une ligne dans un flux NDJSON (--ndjson, "-" pour la sortie standard).
+
+Usage :
+    python batch.py dossiers/ --output devis/ --workers 8
+    python batch.py dossiers/ --ndjson resultats.ndjson --processes
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+from llm import scale_rate_limits
+from pipeline import create_clients, load_dossier_files, process_dossier
+
+logger = logging.getLogger("batch")
+
+# Clients propres à chaque processus de traitement (non transmissibles d'un processus à l'autre)
+_clients = None
+
+
+def _get_clients():
+    global _clients
+    if _clients is None:
+        _clients = create_clients(os.getenv("OPENAI_API_KEY", "").strip(), os.getenv("PERPLEXITY_API_KEY", "").strip())
+    return _clients
+
+
+def run_dossier(directory):
+    """Traite un répertoire de dossier et retourne son résultat, enrichi du nom du dossier."""
+    openai_client, perplexity_client = _get_clients()
+    files = load_dossier_files(directory)
+    name = os.path.basename(os.path.normpath(directory))
+    result = {"dossier": name, "fichiers": [f.name for f in files]}
+    result.update(process_dossier(files, openai_client, perplexity_client, name=name))
+    # Les couples (niveau, message) sont exportés sous forme d'objets pour rester lisibles en JSON
+    result["problemes"] = [{"niveau": level, "message": message} for level, message in result["problemes"]]
+    return result
+
+
+def find_dossiers(root):
+    """Liste les sous-répertoires de `root`, un par dossier, triés par nom."""
+    return [
+        os.path.join(root, name)
+        for name in sorted(os.listdir(root))
+        if os.path.isdir(os.path.join(root, name)) and not name.startswith(".")
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dossiers_dir", help="Répertoire contenant un sous-répertoire par dossier.")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("--output", help="Répertoire de sortie : un fichier JSON par dossier.")
+    output.add_argument("--ndjson", help="Fichier NDJSON de sortie (une ligne par dossier), '-' pour la sortie standard.")
+    parser.add_argument("--workers", type=int, default=4, help="Nombre de dossiers traités simultanément (défaut : 4).")
+    parser.add_argument("--processes", action="store_true", help="Utiliser des processus plutôt que des threads.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s", stream=sys.stderr)
+    load_dotenv()
+    if not os.getenv("OPENAI_API_KEY") or not os.getenv("PERPLEXITY_API_KEY"):
+        logger.error("Clés API non trouvées : définissez OPENAI_API_KEY et PERPLEXITY_API_KEY (ou un fichier .env).")
+        return 2
+
+    dossiers = find_dossiers(args.dossiers_dir)
+    if not dossiers:
+        logger.error("Aucun dossier trouvé dans %s", args.dossiers_dir)
+        return 2
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        ndjson_stream = None
+    else:
+        ndjson_stream = sys.stdout if args.ndjson == "-" else open(args.ndjson, "w", encoding="utf-8")
+
+    workers = max(1, args.workers)
+    if args.processes:
+        # Chaque processus a son propre limiteur de débit : le quota des clés API est réparti entre eux
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=scale_rate_limits, initargs=(1 / workers,))
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+    start = time.perf_counter()
+    counts = {}
+    try:
+        with executor:
+            futures = {executor.submit(run_dossier, directory): directory for directory in dossiers}
+            for done, future in enumerate(as_completed(futures), start=1):
+                directory = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"dossier": os.path.basename(directory), "statut": "erreur", "problemes": [{"niveau": "error", "message": str(e)}]}
+
+                if ndjson_stream is not None:
+                    ndjson_stream.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    ndjson_stream.flush()
+                else:
+                    path = os.path.join(args.output, f"{result['dossier']}.json")
+                    with open(path, "w", encoding="utf-8") as f:
+                        json.dump(result, f, indent=4, ensure_ascii=False)
+
+                counts[result["statut"]] = counts.get(result["statut"], 0) + 1
+                logger.info("[%d/%d] %s : %s (%.1f s)", done, len(dossiers), result["dossier"], result["statut"], result.get("duree_secondes", 0.0))
+    finally:
+        if ndjson_stream is not None and ndjson_stream is not sys.stdout:
+            ndjson_stream.close()
+
+    elapsed = time.perf_counter() - start
+    summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+    logger.info("%d dossier(s) traité(s) en %.1f s (%.2f dossier(s)/s) : %s", len(dossiers), elapsed, len(dossiers) / elapsed, summary)
+    return 1 if counts.get("erreur") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+Benchmark de l'export en masse des devis (export.py).
+
+Des devis synthétiques (Rule Engine appliqué à des flottes générées) sont exportés en une passe
+(NDJSON, CSV et Parquet d'une ligne par véhicule), puis envoyés à une doublure locale du système de
+tarification (stub_pricing.PricingStubServer). L'envoi par lots est comparé à l'envoi d'un devis
+par requête, sans connexion persistante (équivalent d'un clic par devis).
+
+Usage :
+    python benchmarks/bench_export.py --quotes 2000 --vehicles 20 --latency 0.02 --error-rate 0.05
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from export import (
+    PARQUET_AVAILABLE,
+    CsvVehicleWriter,
+    ParquetVehicleWriter,
+    PricingSubmitter,
+    create_pricing_client,
+    export_quotes,
+    quote_id,
+)
+from stub_pricing import PricingStubServer
+from synthetic import fleet_rows
+
+
+def build_quotes(count, vehicles, seed=0):
+    """Devis synthétiques : une flotte évaluée par le Rule Engine, déclinée sous `count` noms d'entreprise."""
+    from pipeline import build_quote, to_agent_data
+
+    keys = ["immatriculation", "marque", "modele", "date_mise_circulation", "valeur"]
+    data = to_agent_data({
+        "nom_entreprise": "Transport Express SARL",
+        "secteur_activite": "Transport routier de marchandises",
+        "region": "Île-de-France",
+        "nombre_vehicules": vehicles,
+        "usage_flotte": "Livraison",
+        "historique_sinistralite_resume": "3 sinistres responsables sur les 36 derniers mois",
+        "liste_vehicules": [dict(zip(keys, row)) for row in fleet_rows(vehicles, seed=seed)],
+    })
+    quote = build_quote(data)
+    for index in range(count):
+        yield {**quote, "informations_client": {**quote["informations_client"], "nom_entreprise": f"Entreprise {index:06d}"}}
+
+
+def send_one_by_one(quotes, url):
+    """Référence : un devis par requête, une nouvelle connexion à chaque envoi."""
+    for quote in quotes:
+        document = {"id_devis": quote_id(quote), **quote}
+        httpx.post(url, json={"id_lot": document["id_devis"], "devis": [document]}).raise_for_status()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quotes", type=int, default=2000, help="Nombre de devis (défaut : 2000).")
+    parser.add_argument("--vehicles", type=int, default=20, help="Véhicules par devis (défaut : 20).")
+    parser.add_argument("--latency", type=float, default=0.02, help="Latence simulée du tarificateur, en secondes (défaut : 0.02).")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Proportion de réponses 503 simulées (défaut : 0).")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--baseline-quotes", type=int, default=200, help="Devis envoyés un par un pour la référence (défaut : 200).")
+    args = parser.parse_args(argv)
+
+    quotes = list(build_quotes(args.quotes, args.vehicles))
+    with tempfile.TemporaryDirectory(prefix="bench_export_") as workdir:
+        start = time.perf_counter()
+        writers = [CsvVehicleWriter.create(os.path.join(workdir, "vehicules.csv"))]
+        if PARQUET_AVAILABLE:
+            writers.append(ParquetVehicleWriter(os.path.join(workdir, "vehicules.parquet")))
+        counts = export_quotes(quotes, io.StringIO(), writers)
+        elapsed = time.perf_counter() - start
+        print(f"export     {counts['devis']} devis, {counts['vehicules']} véhicules : {elapsed:.2f} s "
+              f"(NDJSON, CSV{', Parquet' if PARQUET_AVAILABLE else ''})")
+
+    with PricingStubServer(latency=args.latency, error_rate=args.error_rate) as server:
+        submitter = PricingSubmitter(
+            url=server.url, http_client=create_pricing_client(max_concurrency=args.concurrency),
+            batch_size=args.batch_size, max_concurrency=args.concurrency,
+        )
+        start = time.perf_counter()
+        summary = submitter.submit(iter(quotes))
+        elapsed = time.perf_counter() - start
+        print(f"par lots   {summary['devis_envoyes']} devis en {summary['lots_envoyes']} lots : {elapsed:.2f} s "
+              f"({summary['devis_envoyes'] / elapsed:.0f} devis/s) ; {summary['tentatives_supplementaires']} nouvelle(s) tentative(s), "
+              f"{len(summary['echecs'])} échec(s) ; reçus : {len(server.quotes)}, doublons : {server.duplicates}, "
+              f"requêtes simultanées max : {server.max_in_flight}")
+
+    with PricingStubServer(latency=args.latency) as server:
+        baseline = quotes[:args.baseline_quotes]
+        start = time.perf_counter()
+        send_one_by_one(baseline, server.url)
+        elapsed = time.perf_counter() - start
+        print(f"un par un  {len(baseline)} devis : {elapsed:.2f} s ({len(baseline) / elapsed:.0f} devis/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+Benchmark de l'extraction de texte des classeurs de flotte (XLSX).
+
+Pour chaque nombre de lignes, un classeur synthétique est généré puis analysé dans un
+processus dédié, afin de mesurer séparément le temps de lecture et le pic de mémoire (RSS).
+L'extraction en flux (`extraction.extract_text`) est comparée à l'ancienne lecture complète.
+
+Usage :
+    python benchmarks/bench_extraction.py --rows 1000 10000 50000 --sheets 3
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openpyxl import load_workbook
+
+from extraction import XLSX_MIME, extract_text
+from synthetic import build_fleet_workbook
+
+def legacy_extract(data):
+    """Ancienne extraction : classeur chargé en entier et texte construit par concaténation."""
+    workbook = load_workbook(filename=io.BytesIO(data))
+    full_text = ""
+    for sheet_name in workbook.sheetnames:
+        sheet = workbook[sheet_name]
+        full_text += f"--- DEBUT CONTENU DE L'ONGLET: '{sheet_name}' ---\n"
+        rows_data = []
+        for row in sheet.iter_rows(values_only=True):
+            if any(cell is not None for cell in row):
+                rows_data.append(" | ".join([str(cell) if cell is not None else "" for cell in row]))
+        full_text += "\n".join(rows_data)
+        full_text += f"\n--- FIN CONTENU DE L'ONGLET: '{sheet_name}' ---\n\n"
+    return full_text
+
+
+def _peak_rss_mb():
+    # ru_maxrss est exprimé en kilo-octets sous Linux et en octets sous macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _measure(mode, path, queue):
+    with open(path, "rb") as f:
+        data = f.read()
+    baseline = _peak_rss_mb()
+    start = time.perf_counter()
+    text = legacy_extract(data) if mode == "legacy" else extract_text(data, XLSX_MIME)
+    elapsed = time.perf_counter() - start
+    queue.put((elapsed, _peak_rss_mb(), max(0.0, _peak_rss_mb() - baseline), len(text)))
+
+
+def measure(mode, path):
+    """Exécute une extraction dans un processus neuf et retourne (temps, pic RSS, surcoût RSS, taille du texte)."""
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_measure, args=(mode, path, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 50000], help="Nombre de lignes par onglet.")
+    parser.add_argument("--sheets", type=int, default=3, help="Nombre d'onglets par classeur.")
+    parser.add_argument("--skip-legacy", action="store_true", help="Ne mesure pas l'ancienne extraction.")
+    args = parser.parse_args()
+
+    modes = ["streaming"] if args.skip_legacy else ["legacy", "streaming"]
+    print(f"{'lignes':>8} {'mode':>10} {'temps (s)':>10} {'pic RSS (Mo)':>13} {'surcoût (Mo)':>13} {'caractères':>11}")
+    for rows in args.rows:
+        path = os.path.join(os.getenv("TMPDIR", "/tmp"), f"bench_flotte_{rows}x{args.sheets}.xlsx")
+        with open(path, "wb") as f:
+            f.write(build_fleet_workbook(rows, sheets=args.sheets))
+        try:
+            for mode in modes:
+                elapsed, peak, overhead, size = measure(mode, path)
+                print(f"{rows:>8} {mode:>10} {elapsed:>10.2f} {peak:>13.1f} {overhead:>13.1f} {size:>11}")
+        finally:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Benchmarks hors ligne du pipeline de souscription.
+
+Les appels OpenAI et Perplexity sont servis par une doublure locale (stub_llm.StubTransport), à
+latence configurable, et les dossiers sont générés synthétiquement (synthetic.py) : aucun appel
+réseau n'est effectué. Chaque scénario est exécuté --iterations fois ; on rapporte les latences
+p50/p95 et le pic de mémoire Python (tracemalloc) par itération.
+
+Scénarios :
+    extraction   extraction du texte des fichiers d'un dossier (PDF, DOCX, XLSX)
+    intake       Smart Intake : extraction, identification des documents et informations clés
+    enrichment   Enrichment Layer : recherches web et extraction des facteurs de risque
+    rules        Rule Engine : évaluation de flottes de 10 à 50 000 véhicules
+    dossier      pipeline complet (process_dossier)
+
+Le cache disque est désactivé par défaut pour mesurer le coût réel de chaque étape (--with-cache
+pour le conserver). Les traces sont écrites dans un répertoire temporaire.
+
+Usage :
+    python benchmarks/run.py --scenarios rules --vehicles 10 1000 50000
+    python benchmarks/run.py --latency 0.5 --iterations 10 --json resultats.json
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SCENARIOS = ["extraction", "intake", "enrichment", "rules", "dossier"]
+
+
+def percentile(values, fraction):
+    """Percentile par interpolation linéaire (values non vide)."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def measure(func, iterations, warmup=1):
+    """Exécute `func` et retourne p50/p95/moyenne (secondes) et le pic de mémoire (Mo)."""
+    for _ in range(warmup):
+        func()
+    durations = []
+    peak = 0
+    for _ in range(iterations):
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            func()
+        finally:
+            durations.append(time.perf_counter() - start)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+    return {
+        "p50_secondes": round(percentile(durations, 0.50), 4),
+        "p95_secondes": round(percentile(durations, 0.95), 4),
+        "moyenne_secondes": round(statistics.fmean(durations), 4),
+        "pic_memoire_mo": round(peak / (1024 * 1024), 2),
+    }
+
+
+def dossier_scenarios(vehicles, args, workdir):
+    """Scénarios portant sur un dossier synthétique de `vehicles` véhicules."""
+    from pipeline import (analyze_files, enrich_data, extract_dossier_information, extract_text_from_file,
+                          load_dossier_files, process_dossier, to_agent_data)
+    from stub_llm import create_stub_clients
+    from synthetic import generate_dossier
+
+    directory = os.path.join(workdir, f"dossier_{vehicles}")
+    generate_dossier(directory, vehicles=vehicles, claims_pages=args.claims_pages, seed=args.seed)
+    files = load_dossier_files(directory)
+    openai_client, perplexity_client, _ = create_stub_clients(
+        latency=args.latency, jitter=args.jitter, seconds_per_output_token=args.seconds_per_token,
+        error_rate=args.error_rate, seed=args.seed,
+    )
+
+    def intake():
+        analyses = analyze_files(files, openai_client)
+        # Même chemin que l'interface et process_dossier : tableaux de flotte lus directement, reste du dossier par le LLM
+        return extract_dossier_information(analyses, files, openai_client, [])
+
+    agent_data = to_agent_data(intake())
+    return {
+        "extraction": lambda: [extract_text_from_file(f) for f in files],
+        "intake": intake,
+        "enrichment": lambda: enrich_data(agent_data, perplexity_client, openai_client),
+        "dossier": lambda: process_dossier(files, openai_client, perplexity_client, name=f"bench_{vehicles}"),
+    }
+
+
+def rules_scenario(vehicles, args):
+    """Rule Engine seul, sur une flotte synthétique de `vehicles` véhicules."""
+    from pipeline import build_quote, to_agent_data
+    from synthetic import fleet_rows
+
+    keys = ["immatriculation", "marque", "modele", "date_mise_circulation", "valeur"]
+    data = to_agent_data({
+        "nom_entreprise": "Transport Express SARL",
+        "secteur_activite": "Transport routier de marchandises",
+        "region": "Île-de-France",
+        "nombre_vehicules": vehicles,
+        "usage_flotte": "Livraison",
+        "historique_sinistralite_resume": "3 sinistres responsables sur les 36 derniers mois",
+        "liste_vehicules": [dict(zip(keys, row)) for row in fleet_rows(vehicles, seed=args.seed)],
+    })
+    data["Taux de sinistralité du secteur"] = "12%"
+    return lambda: build_quote(data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--vehicles", type=int, nargs="+", default=[10, 500, 5000], help="Tailles de flotte (défaut : 10 500 5000).")
+    parser.add_argument("--iterations", type=int, default=5, help="Itérations mesurées par scénario (défaut : 5).")
+    parser.add_argument("--latency", type=float, default=0.2, help="Latence simulée d'un appel LLM, en secondes (défaut : 0.2).")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Variation aléatoire de la latence, en secondes (défaut : 0.05).")
+    parser.add_argument("--seconds-per-token", type=float, default=0.0, help="Latence simulée par token généré (défaut : 0).")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Proportion de réponses 429 simulées (défaut : 0).")
+    parser.add_argument("--claims-pages", type=int, default=2, help="Pages de l'historique de sinistralité PDF (défaut : 2).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--with-cache", action="store_true", help="Conserver le cache disque (désactivé par défaut).")
+    parser.add_argument("--json", help="Écrit aussi les résultats dans ce fichier JSON.")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench_souscription_")
+    # Configuration lue à l'import des modules du pipeline : à fixer avant de les importer
+    if not args.with_cache:
+        os.environ["DOSSIER_CACHE_ENABLED"] = "0"
+    os.environ.setdefault("TRACE_DIR", os.path.join(workdir, "traces"))
+
+    results = []
+    try:
+        print(f"{'scénario':<12} {'véhicules':>9} {'p50 (s)':>9} {'p95 (s)':>9} {'moy. (s)':>9} {'pic mém. (Mo)':>14}")
+        for vehicles in args.vehicles:
+            scenarios = {}
+            if set(args.scenarios) - {"rules"}:
+                scenarios.update(dossier_scenarios(vehicles, args, workdir))
+            scenarios["rules"] = rules_scenario(vehicles, args)
+            for name in args.scenarios:
+                result = {"scenario": name, "vehicules": vehicles, "iterations": args.iterations}
+                result.update(measure(scenarios[name], args.iterations))
+                results.append(result)
+                print(f"{name:<12} {vehicles:>9} {result['p50_secondes']:>9.3f} {result['p95_secondes']:>9.3f} "
+                      f"{result['moyenne_secondes']:>9.3f} {result['pic_memoire_mo']:>14.1f}")
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"parametres": vars(args), "resultats": results}, f, indent=4, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
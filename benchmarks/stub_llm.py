@@ -0,0 +1,165 @@
+"""
+Doublure locale des API compatibles OpenAI (OpenAI et Perplexity) pour les benchmarks.
+
+`StubTransport` est un transport httpx : il est injecté dans le client http partagé par les deux
+clients OpenAI (pipeline.create_clients(..., http_client=...)), si bien qu'aucun appel réseau n'est
+effectué. Les réponses sont des JSON plausibles, construits à partir du prompt reçu, et la latence
+simulée est configurable (fixe, aléatoire et proportionnelle au nombre de tokens générés), ainsi
+qu'une proportion de réponses 429 pour exercer les nouvelles tentatives.
+"""
+import json
+import random
+import re
+import threading
+import time
+
+import httpx
+
+IMMATRICULATION_RE = re.compile(r"\b[A-Z]{2}-\d{3}-[A-Z]{2}\b")
+
+# Mots-clés du contenu -> types de documents renvoyés par l'identification simulée
+DOCUMENT_KEYWORDS = {
+    "questionnaire": "Formulaire de demande / questionnaire dûment rempli",
+    "immatriculation|": "Liste détaillée des véhicules de la flotte (Excel ou structuré)",
+    "historique de sinistralite": "Historique de sinistralité sur les 3 à 5 dernières années",
+    "sinistres'": "Historique de sinistralité sur les 3 à 5 dernières années",
+    "releve d'informations": "Relevé d'informations / Attestation du précédent assureur",
+    "extrait kbis": "Extrait Kbis récent de l'entreprise",
+    "iban": "RIB de l'entreprise",
+    "conditions particulières": "Conditions particulières souhaitées",
+}
+
+
+class StubTransport(httpx.BaseTransport):
+    """Transport httpx qui répond localement aux requêtes POST /chat/completions."""
+
+    def __init__(self, latency=0.2, jitter=0.0, seconds_per_output_token=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.jitter = jitter
+        self.seconds_per_output_token = seconds_per_output_token
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def handle_request(self, request):
+        if not request.url.path.endswith("/chat/completions"):
+            return httpx.Response(404, json={"error": {"message": f"Route inconnue : {request.url.path}"}})
+        with self._lock:
+            rate_limited = self.error_rate and self._rng.random() < self.error_rate
+            if rate_limited:
+                self.errors += 1
+        if rate_limited:
+            return httpx.Response(
+                429, headers={"retry-after": "0.05"},
+                json={"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+            )
+        payload = json.loads(request.read())
+        prompt = "\n".join(str(message.get("content", "")) for message in payload.get("messages", []))
+        content = self.reply(payload.get("model", ""), prompt)
+
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = max(1, len(content) // 4)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + (self._rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if payload.get("stream"):
+            time.sleep(max(0.0, delay))
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=self._sse(payload.get("model", ""), content, usage))
+        time.sleep(max(0.0, delay + completion_tokens * self.seconds_per_output_token))
+
+        return httpx.Response(200, json={
+            "id": f"chatcmpl-stub-{self.calls}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", ""),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    def _sse(self, model, content, usage, fragment_chars=16):
+        """Réponse en flux (server-sent events), par fragments d'environ 4 tokens."""
+        def event(choices, usage=None):
+            chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model, "choices": choices}
+            if usage is not None:
+                chunk["usage"] = usage
+            return b"data: " + json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n\n"
+
+        for i in range(0, len(content), fragment_chars):
+            time.sleep(fragment_chars / 4 * self.seconds_per_output_token)
+            yield event([{"index": 0, "delta": {"content": content[i:i + fragment_chars]}, "finish_reason": None}])
+        yield event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        yield event([], usage)
+        yield b"data: [DONE]\n\n"
+
+    def reply(self, model, prompt):
+        """Réponse simulée, selon la tâche reconnue dans le prompt."""
+        if "documents_identifies" in prompt:
+            content = prompt.split("<content>", 1)[-1].lower()
+            found = sorted({doc for keyword, doc in DOCUMENT_KEYWORDS.items() if keyword in content})
+            return json.dumps({"documents_identifies": found}, ensure_ascii=False)
+        if "<dossier_complet>" in prompt:
+            return json.dumps(self._key_information(prompt), ensure_ascii=False)
+        if "<tableau>" in prompt:
+            return json.dumps(self._header_mapping(prompt), ensure_ascii=False)
+        if "<search_results>" in prompt:
+            return json.dumps({
+                "taux_sinistralite_secteur": "12%",
+                "analyse_risque_geo": "Risque de vol et de vandalisme supérieur à la moyenne nationale.",
+                "facteur_risque_telematique": "Un bon score télématique peut réduire la prime de 5 à 15 %.",
+            }, ensure_ascii=False)
+        # Recherche web (Perplexity)
+        return "Selon les statistiques publiées, le taux de sinistralité moyen du secteur est d'environ 12 %."
+
+    @staticmethod
+    def _header_mapping(prompt):
+        # Association approximative d'en-têtes abrégés ("Mod.", "Val. HT", "Date 1re MEC"...)
+        header = prompt.split("<tableau>", 1)[-1].strip().splitlines()[0]
+        guesses = {"mod": "modele", "val": "valeur", "date": "date_mise_circulation", "marq": "marque"}
+        mapping = {}
+        for column in header.split("|"):
+            lowered = column.strip().lower()
+            mapping[column] = next((field for prefix, field in guesses.items() if lowered.startswith(prefix)), None)
+        return {"correspondances": mapping}
+
+    @staticmethod
+    def _key_information(prompt):
+        dossier = prompt.split("<dossier_complet>", 1)[-1].split("</dossier_complet>", 1)[0]
+        vehicles = []
+        for line in dossier.splitlines():
+            cells = [cell.strip() for cell in line.split("|")]
+            if len(cells) >= 5 and IMMATRICULATION_RE.fullmatch(cells[0]):
+                vehicles.append({
+                    "immatriculation": cells[0],
+                    "marque": cells[1],
+                    "modele": cells[2],
+                    "date_mise_circulation": cells[3],
+                    "valeur": cells[4],
+                })
+        return {
+            "nom_entreprise": "Transport Express SARL" if "Transport Express" in dossier else None,
+            "secteur_activite": "Transport routier de marchandises" if "Secteur" in dossier else None,
+            "region": "Île-de-France" if "Région" in dossier else None,
+            "nombre_vehicules": len(vehicles),
+            "usage_flotte": "Livraison" if vehicles else None,
+            "type_flotte": "Véhicules utilitaires légers" if vehicles else None,
+            "chiffre_affaires_annuel": "2,5 M€" if "Chiffre" in dossier else None,
+            "historique_sinistralite_resume": "3 sinistres responsables sur les 36 derniers mois" if "sinistres responsables" in dossier else None,
+            "garanties_souhaitees": [{"garantie": "Responsabilité civile", "incluse": "Oui", "franchise_eur": 500}] if "Conditions" in dossier else [],
+            "liste_vehicules": vehicles,
+        }
+
+
+def create_stub_clients(**transport_options):
+    """Clients OpenAI et Perplexity branchés sur un StubTransport ; retourne (openai, perplexity, transport)."""
+    from pipeline import create_clients
+
+    transport = StubTransport(**transport_options)
+    http_client = httpx.Client(transport=transport)
+    openai_client, perplexity_client = create_clients(
+        "stub", "stub", http_client=http_client,
+        openai_base_url="http://openai.stub/v1", perplexity_base_url="http://perplexity.stub",
+    )
+    return openai_client, perplexity_client, transport
@@ -0,0 +1,103 @@
+"""
+Doublure locale du système de tarification, pour exercer export.PricingSubmitter sans réseau.
+
+`PricingStubServer` est un serveur HTTP local (port choisi automatiquement) qui accepte les lots
+de devis en POST, à latence configurable, et renvoie une proportion d'erreurs 503 (avec en-tête
+Retry-After) pour exercer les nouvelles tentatives. Il applique l'idempotence comme le ferait le
+tarificateur : un lot déjà reçu (même en-tête Idempotency-Key) n'est pas enregistré une seconde fois.
+
+Usage :
+    with PricingStubServer(latency=0.05, error_rate=0.1) as server:
+        PricingSubmitter(url=server.url).submit(quotes)
+        print(len(server.quotes), server.duplicates)
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class PricingStubServer:
+    """Serveur local du système de tarification ; `quotes` contient les devis reçus, indexés par id_devis."""
+
+    def __init__(self, latency=0.05, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.quotes = {}
+        self.batches = set()
+        self.requests = 0
+        self.errors = 0
+        self.duplicates = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/devis"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def receive(self, batch_key, documents):
+        """Enregistre un lot ; retourne (statut http, réponse)."""
+        with self._lock:
+            self.requests += 1
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+            failed = self.error_rate and self._rng.random() < self.error_rate
+        try:
+            time.sleep(self.latency)
+            with self._lock:
+                if failed:
+                    self.errors += 1
+                    return 503, {"erreur": "Service momentanément indisponible"}
+                if batch_key in self.batches:
+                    self.duplicates += 1
+                    return 200, {"id_lot": batch_key, "doublon": True}
+                self.batches.add(batch_key)
+                for document in documents:
+                    self.quotes[document["id_devis"]] = document
+                return 200, {"id_lot": batch_key, "devis_recus": len(documents)}
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                try:
+                    payload = json.loads(body)
+                    status, response = server.receive(self.headers.get("Idempotency-Key") or payload["id_lot"], payload["devis"])
+                except (ValueError, KeyError):
+                    status, response = 400, {"erreur": "Lot de devis invalide"}
+                content = json.dumps(response, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                if status == 503:
+                    self.send_header("Retry-After", "0.05")
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,182 @@
+"""
+Génération de dossiers synthétiques pour les benchmarks : questionnaire et conditions (DOCX),
+Kbis, RIB, relevé d'informations et historique de sinistralité (PDF), flotte de véhicules et
+sinistres (XLSX multi-onglets). Les contenus sont déterministes pour une graine donnée.
+"""
+import io
+import os
+import random
+
+from docx import Document
+from openpyxl import Workbook
+
+FLEET_HEADERS = ["Immatriculation", "Marque", "Modèle", "Date de mise en circulation", "Valeur", "Usage", "Conducteur", "Observations"]
+CLAIMS_HEADERS = ["Date", "Immatriculation", "Nature", "Responsabilité", "Montant"]
+MAKES = [("Renault", "Master"), ("Peugeot", "Expert"), ("Citroën", "Jumpy"), ("Ford", "Transit"), ("Iveco", "Daily"), ("Mercedes", "Sprinter")]
+
+
+def immatriculation(i):
+    """Immatriculation unique et au format SIV pour l'indice `i`."""
+    letters = "ABCDEFGHJKLMNPQRSTVWXYZ"
+    return (
+        f"{letters[i // (1000 * 23 * 23) % 23]}{letters[i // (1000 * 23) % 23]}"
+        f"-{i % 1000:03d}-"
+        f"{letters[i // 1000 % 23]}{letters[(i * 7) % 23]}"
+    )
+
+
+def fleet_rows(count, seed=0):
+    """Lignes du tableau de flotte (hors en-tête)."""
+    rng = random.Random(seed)
+    for i in range(count):
+        make, model = MAKES[rng.randrange(len(MAKES))]
+        yield [
+            immatriculation(i),
+            make,
+            model,
+            f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2008, 2024)}",
+            rng.randrange(12000, 90000, 500),
+            "Livraison" if rng.random() < 0.8 else "Transport de personnes",
+            None,
+            None,
+        ]
+
+
+def build_fleet_workbook(rows, sheets=1, claims=0, seed=0):
+    """Classeur de flotte : `sheets` onglets de `rows` véhicules, plus un onglet de `claims` sinistres si demandé."""
+    workbook = Workbook(write_only=True)
+    for sheet_index in range(sheets):
+        sheet = workbook.create_sheet(f"Flotte {sheet_index + 1}" if sheets > 1 else "Flotte")
+        sheet.append(FLEET_HEADERS)
+        for row in fleet_rows(rows, seed=seed + sheet_index):
+            sheet.append(row)
+    if claims:
+        rng = random.Random(seed + 1000)
+        sheet = workbook.create_sheet("Sinistres")
+        sheet.append(CLAIMS_HEADERS)
+        for _ in range(claims):
+            sheet.append([
+                f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2020, 2024)}",
+                immatriculation(rng.randrange(max(rows, 1))),
+                rng.choice(["Bris de glace", "Accident", "Vol", "Vandalisme"]),
+                rng.choice(["Responsable", "Non responsable"]),
+                rng.randrange(300, 15000, 50),
+            ])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def _pdf_escape(text):
+    # Les PDF synthétiques utilisent la police standard Helvetica : texte limité à l'ASCII
+    ascii_text = text.encode("ascii", "replace").decode("ascii")
+    return ascii_text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def build_pdf(lines, lines_per_page=50):
+    """Construit un PDF texte minimal (une page pour `lines_per_page` lignes), lisible par pypdf."""
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+    objects = []  # contenu des objets, numérotés à partir de 1
+
+    def add(content):
+        objects.append(content)
+        return len(objects)
+
+    catalog = add(None)
+    pages_id = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_ids = []
+    for page_lines in pages:
+        stream = "BT /F1 10 Tf 14 TL 50 800 Td " + " ".join(f"({_pdf_escape(line)}) Tj T*" for line in page_lines) + " ET"
+        stream_bytes = stream.encode("ascii")
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream_bytes) + stream_bytes + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>"
+            % (pages_id, font, content)
+        ))
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % p for p in page_ids), len(page_ids))
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, content in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n" % number + content + b"\nendobj\n")
+    xref = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        output.write(b"%010d 00000 n \n" % offset)
+    output.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref))
+    return output.getvalue()
+
+
+def build_docx(paragraphs):
+    """Construit un document Word contenant un paragraphe par élément."""
+    document = Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def claims_history_lines(pages, seed=0):
+    """Lignes d'un historique de sinistralité de `pages` pages."""
+    rng = random.Random(seed)
+    lines = ["Historique de sinistralite - Releve des sinistres sur les 5 dernieres annees"]
+    for i in range(pages * 50 - 1):
+        lines.append(
+            f"Sinistre {i + 1} - {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2019, 2024)} - "
+            f"{rng.choice(['Accident', 'Bris de glace', 'Vol'])} - {rng.randrange(300, 15000, 50)} EUR"
+        )
+    return lines
+
+
+def generate_dossier(directory, vehicles=50, claims_pages=1, seed=0, company="Transport Express SARL"):
+    """Écrit un dossier complet dans `directory` et retourne la liste des chemins créés."""
+    os.makedirs(directory, exist_ok=True)
+    files = {
+        "questionnaire.docx": build_docx([
+            "Formulaire de demande de devis - Questionnaire flotte automobile",
+            f"Raison sociale : {company}",
+            "Secteur d'activité : Transport routier de marchandises",
+            "Région : Île-de-France",
+            f"Nombre de véhicules : {vehicles}",
+            "Usage : Livraison urbaine et régionale",
+            "Chiffre d'affaires annuel : 2,5 M€",
+        ]),
+        "conditions_particulieres.docx": build_docx([
+            "Conditions particulières souhaitées",
+            "Responsabilité civile : incluse, franchise 500 EUR",
+            "Bris de glace : inclus, franchise 150 EUR",
+            "Vol et incendie : inclus, franchise 1000 EUR",
+        ]),
+        "kbis.pdf": build_pdf([
+            "Extrait Kbis",
+            f"Denomination : {company}",
+            "Immatriculation au RCS de Paris B 123 456 789",
+            "Date d'immatriculation : 12/03/2008",
+        ]),
+        "rib.pdf": build_pdf([
+            "Releve d'Identite Bancaire",
+            f"Titulaire : {company}",
+            "IBAN : FR76 3000 6000 0112 3456 7890 189",
+            "BIC : AGRIFRPP",
+        ]),
+        "releve_informations.pdf": build_pdf([
+            "Releve d'informations - Attestation du precedent assureur",
+            f"Assure : {company}",
+            "Periode : 01/01/2019 - 31/12/2023",
+            "3 sinistres responsables sur les 36 derniers mois",
+        ]),
+        "historique_sinistralite.pdf": build_pdf(claims_history_lines(claims_pages, seed=seed)),
+        "flotte.xlsx": build_fleet_workbook(vehicles, sheets=1, claims=max(1, vehicles // 20), seed=seed),
+    }
+    paths = []
+    for name, content in files.items():
+        path = os.path.join(directory, name)
+        with open(path, "wb") as f:
+            f.write(content)
+        paths.append(path)
+    return paths
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+# --- Configuration du cache disque ---
+# Le cache est un fichier SQLite (mode WAL) : il peut être partagé entre plusieurs processus Streamlit.
+
+CACHE_DIR = os.getenv("DOSSIER_CACHE_DIR", ".cache")
+CACHE_MAX_BYTES = int(os.getenv("DOSSIER_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+CACHE_TTL_SECONDS = int(os.getenv("DOSSIER_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+# DOSSIER_CACHE_ENABLED=0 désactive le cache (mesures de performance à froid, diagnostic)
+CACHE_ENABLED = os.getenv("DOSSIER_CACHE_ENABLED", "1") != "0"
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(data):
+    """Empreinte SHA-256 du contenu binaire d'un fichier."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(*parts):
+    """Construit une clé de cache à partir de ses composantes (type d'entrée, empreinte, versions...)."""
+    return ":".join(str(part) for part in parts)
+
+
+def normalize_key_component(value):
+    """Forme normalisée d'un libellé libre (casse, accents, ponctuation, espaces) pour l'utiliser dans une clé de cache."""
+    text = unicodedata.normalize("NFKD", str(value or ""))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.sub(r"[\W_]+", " ", text.casefold()).split())
+
+
+class DiskCache:
+    """
+    Cache clé/valeur JSON persistant sur disque.
+    - Expiration des entrées après un TTL.
+    - Éviction LRU dès que la taille totale dépasse `max_bytes`.
+    Les erreurs SQLite ne sont jamais propagées : le cache se comporte alors comme vide.
+    """
+
+    def __init__(self, path, max_bytes=CACHE_MAX_BYTES, ttl_seconds=CACHE_TTL_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_expires_at ON entries(expires_at)")
+            # Taille totale des entrées, tenue à jour par des déclencheurs : l'éviction n'a pas à
+            # additionner la taille de toutes les entrées à chaque écriture
+            conn.execute("CREATE TABLE IF NOT EXISTS stats (id INTEGER PRIMARY KEY CHECK (id = 0), total_size INTEGER NOT NULL)")
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries "
+                "BEGIN UPDATE stats SET total_size = total_size + new.size WHERE id = 0; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries "
+                "BEGIN UPDATE stats SET total_size = total_size + new.size - old.size WHERE id = 0; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries "
+                "BEGIN UPDATE stats SET total_size = total_size - old.size WHERE id = 0; END"
+            )
+            # Créée après les déclencheurs : une écriture concurrente est comptée une fois, par la somme ou par un déclencheur
+            conn.execute("INSERT OR IGNORE INTO stats (id, total_size) SELECT 0, COALESCE(SUM(size), 0) FROM entries")
+
+    def _connection(self):
+        # Une connexion par thread : les connexions SQLite ne doivent pas être partagées entre threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Retourne la valeur associée à `key`, ou None si absente ou expirée."""
+        now = time.time()
+        try:
+            conn = self._connection()
+            row = conn.execute("SELECT value, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at < now:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            return json.loads(value)
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning("Lecture du cache impossible (%s): %s", key, e)
+            return None
+
+    def set(self, key, value, ttl_seconds=None):
+        """Enregistre `value` (sérialisable en JSON) puis applique l'éviction si nécessaire."""
+        now = time.time()
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        payload = json.dumps(value, ensure_ascii=False)
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Pas de INSERT OR REPLACE : la suppression implicite de l'ancienne entrée ne déclencherait pas entries_delete
+                conn.execute(
+                    "INSERT INTO entries (key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value, size = excluded.size, "
+                    "expires_at = excluded.expires_at, last_access = excluded.last_access",
+                    (key, payload, len(payload.encode("utf-8")), now + ttl, now),
+                )
+                self._evict(conn, now)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning("Écriture du cache impossible (%s): %s", key, e)
+
+    def _evict(self, conn, now):
+        """Supprime les entrées expirées, puis les moins récemment utilisées tant que la taille dépasse le budget."""
+        conn.execute("DELETE FROM entries WHERE expires_at < ?", (now,))
+        total = conn.execute("SELECT total_size FROM stats WHERE id = 0").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        to_delete = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_access ASC"):
+            if total <= self.max_bytes:
+                break
+            to_delete.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM entries WHERE key = ?", to_delete)
+
+
+class NullCache:
+    """Cache désactivé : aucune valeur n'est conservée."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl_seconds=None):
+        pass
+
+
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Instance partagée du cache disque pour le processus courant."""
+    global _cache_instance
+    with _cache_lock:
+        if _cache_instance is None:
+            _cache_instance = DiskCache(os.path.join(CACHE_DIR, "dossiers.sqlite3")) if CACHE_ENABLED else NullCache()
+        return _cache_instance
@@ -0,0 +1,175 @@
+import functools
+import json
+import re
+
+from tables import COMMON_VALUES_PREFIX
+
+# --- Découpage du dossier en extraits bornés en tokens ---
+
+# Approximation utilisée lorsque le tokenizer n'est pas disponible
+CHARS_PER_TOKEN = 4
+
+FILE_MARKER = "--- DEBUT FICHIER:"
+SHEET_START_MARKER = "--- DEBUT CONTENU DE L'ONGLET:"
+SHEET_END_MARKER = "--- FIN CONTENU DE L'ONGLET:"
+
+
+@functools.lru_cache(maxsize=1)
+def _get_encoding():
+    # L'encodage de tiktoken est téléchargé au premier appel, ce qui peut échouer hors ligne : le nombre de tokens est alors estimé
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text):
+    """Nombre de tokens de `text` (tokenizer des modèles gpt-4o si disponible, sinon estimation)."""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Début de `text` limité à `max_tokens` tokens."""
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * CHARS_PER_TOKEN]
+
+
+def _split_long_line(line, max_tokens):
+    """Coupe une ligne trop longue pour tenir dans un extrait en morceaux de taille approximative."""
+    step = max(1, max_tokens * CHARS_PER_TOKEN)
+    return [line[i:i + step] for i in range(0, len(line), step)]
+
+
+def split_into_chunks(text, max_tokens):
+    """
+    Découpe le texte concaténé du dossier (chaîne, ou itérable de lignes sans fin de ligne) en extraits
+    d'au plus `max_tokens` tokens, sur des fins de ligne.
+    Lorsqu'un fichier ou un onglet est coupé, l'extrait suivant reprend son en-tête (marqueur de fichier,
+    marqueur d'onglet, ligne d'en-tête du tableau et valeurs communes) pour que le modèle garde le sens des colonnes.
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+    file_line = sheet_line = header_line = common_line = None
+    expecting_header = False
+
+    for raw_line in (text.splitlines() if isinstance(text, str) else text):
+        for line in (_split_long_line(raw_line, max_tokens) if count_tokens(raw_line) > max_tokens else [raw_line]):
+            line_tokens = count_tokens(line) + 1
+            if current and current_tokens + line_tokens > max_tokens:
+                chunks.append("\n".join(current))
+                if line.startswith(FILE_MARKER):
+                    context = []
+                elif line.startswith(SHEET_START_MARKER):
+                    context = [file_line]
+                elif expecting_header and line.strip():
+                    context = [file_line, sheet_line]
+                elif line.startswith(COMMON_VALUES_PREFIX):
+                    context = [file_line, sheet_line, header_line]
+                else:
+                    context = [file_line, sheet_line, header_line, common_line]
+                current = [l for l in context if l]
+                current_tokens = sum(count_tokens(l) + 1 for l in current)
+
+            if line.startswith(FILE_MARKER):
+                file_line, sheet_line, header_line, common_line = line, None, None, None
+                expecting_header = False
+            elif line.startswith(SHEET_START_MARKER):
+                sheet_line, header_line, common_line = line, None, None
+                expecting_header = True
+            elif line.startswith(SHEET_END_MARKER):
+                sheet_line, header_line, common_line = None, None, None
+                expecting_header = False
+            elif expecting_header and line.strip():
+                header_line = line
+                expecting_header = False
+            elif sheet_line and line.startswith(COMMON_VALUES_PREFIX):
+                common_line = line
+
+            current.append(line)
+            current_tokens += line_tokens
+
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+# --- Fusion des extractions partielles ---
+
+def _is_empty(value):
+    return value is None or value == "" or value == [] or value == {}
+
+
+def normalize_immatriculation(value):
+    """Forme canonique d'une immatriculation (majuscules, sans espaces ni tirets) pour la déduplication."""
+    if value is None:
+        return ""
+    return re.sub(r"[^0-9A-Z]", "", str(value).upper())
+
+
+def merge_vehicle_lists(vehicle_lists):
+    """Concatène des listes de véhicules en supprimant les doublons, par immatriculation si elle est connue."""
+    merged = []
+    seen = set()
+    for vehicles in vehicle_lists:
+        for vehicle in vehicles or []:
+            if not isinstance(vehicle, dict):
+                continue
+            immatriculation = normalize_immatriculation(vehicle.get("immatriculation"))
+            key = ("immatriculation", immatriculation) if immatriculation else ("contenu", json.dumps(vehicle, sort_keys=True, ensure_ascii=False))
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(vehicle)
+    return merged
+
+
+def merge_guarantees(guarantee_lists):
+    """Concatène les garanties demandées en ne gardant que la première occurrence de chaque garantie."""
+    merged = []
+    seen = set()
+    for guarantees in guarantee_lists:
+        for guarantee in guarantees or []:
+            if not isinstance(guarantee, dict):
+                continue
+            key = str(guarantee.get("garantie", "")).strip().casefold() or json.dumps(guarantee, sort_keys=True, ensure_ascii=False)
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(guarantee)
+    return merged
+
+
+def merge_key_information(partial_results):
+    """
+    Fusionne les extractions réalisées sur chaque extrait, dans l'ordre du dossier.
+    - Champs simples : première valeur renseignée.
+    - Garanties et véhicules : concaténés puis dédoublonnés.
+    - "nombre_vehicules" : recalculé à partir de la liste fusionnée lorsqu'elle n'est pas vide.
+    """
+    merged = {}
+    for result in partial_results:
+        for key, value in result.items():
+            if key in ("liste_vehicules", "garanties_souhaitees", "nombre_vehicules"):
+                continue
+            if _is_empty(merged.get(key)) and not _is_empty(value):
+                merged[key] = value
+            else:
+                merged.setdefault(key, value)
+
+    merged["garanties_souhaitees"] = merge_guarantees(r.get("garanties_souhaitees") for r in partial_results)
+    merged["liste_vehicules"] = merge_vehicle_lists(r.get("liste_vehicules") for r in partial_results)
+
+    if merged["liste_vehicules"]:
+        merged["nombre_vehicules"] = len(merged["liste_vehicules"])
+    else:
+        declared = [r.get("nombre_vehicules") for r in partial_results if isinstance(r.get("nombre_vehicules"), (int, float))]
+        merged["nombre_vehicules"] = max(declared) if declared else None
+    return merged
@@ -0,0 +1,177 @@
+import os
+import re
+
+from cache import normalize_key_component
+
+# --- Pré-classification des documents par règles ---
+# Avant l'appel au LLM d'identification, chaque fichier est classé localement par des
+# expressions régulières (IBAN, BIC, numéro RCS, immatriculations), des mots-clés pondérés et
+# l'inspection des en-têtes d'onglets. Chaque type de document obtient un score de confiance
+# entre 0 et 1 ; le LLM n'est appelé que si le résultat est ambigu.
+
+# Au-delà de ce score un type est retenu ; en deçà du score de rejet il est ignoré.
+# Entre les deux, le résultat est ambigu et l'identification est confiée au LLM.
+CLASSIFIER_ACCEPT_SCORE = float(os.getenv("CLASSIFIER_ACCEPT_SCORE", "0.8"))
+CLASSIFIER_REJECT_SCORE = float(os.getenv("CLASSIFIER_REJECT_SCORE", "0.3"))
+
+# Seul le début du texte est analysé pour les mots-clés (les titres y figurent)
+CLASSIFIER_MAX_CHARS = 200_000
+
+QUESTIONNAIRE = "Formulaire de demande / questionnaire dûment rempli"
+FLEET_LIST = "Liste détaillée des véhicules de la flotte (Excel ou structuré)"
+CLAIMS_HISTORY = "Historique de sinistralité sur les 3 à 5 dernières années"
+PREVIOUS_INSURER = "Relevé d'informations / Attestation du précédent assureur"
+KBIS = "Extrait Kbis récent de l'entreprise"
+RIB = "RIB de l'entreprise"
+SPECIAL_CONDITIONS = "Conditions particulières souhaitées"
+
+# Mots-clés pondérés, recherchés dans le texte normalisé (minuscules, sans accents ni ponctuation)
+KEYWORD_RULES = {
+    QUESTIONNAIRE: [
+        (r"\bquestionnaire\b", 0.5),
+        (r"\bformulaire de (?:demande|souscription)\b", 0.4),
+        (r"\bdemande de (?:devis|cotation|tarification)\b", 0.3),
+        (r"\braison sociale\b", 0.1),
+        (r"\bnombre de vehicules\b", 0.1),
+    ],
+    CLAIMS_HISTORY: [
+        (r"\bhistorique (?:de sinistralite|des sinistres)\b", 0.5),
+        (r"\breleve des sinistres\b", 0.4),
+        (r"\bstatistiques? de sinistralite\b", 0.4),
+    ],
+    PREVIOUS_INSURER: [
+        (r"\breleve d informations?\b", 0.7),
+        (r"\battestation\b.{0,60}\bassureur\b", 0.4),
+        (r"\bcoefficient de reduction majoration\b|\bbonus malus\b", 0.3),
+    ],
+    KBIS: [
+        (r"\bextrait k ?bis\b", 0.6),
+        (r"\bgreffe du tribunal de commerce\b", 0.3),
+        (r"\bregistre du commerce et des societes\b", 0.2),
+    ],
+    RIB: [
+        (r"\breleve d identite bancaire\b", 0.4),
+        (r"\brib\b", 0.2),
+        (r"\btitulaire du compte\b|\bdomiciliation\b", 0.2),
+    ],
+    SPECIAL_CONDITIONS: [
+        (r"\bconditions particulieres\b", 0.6),
+        (r"\bfranchises?\b", 0.2),
+        (r"\bresponsabilite civile\b", 0.1),
+        (r"\bbris de glace\b", 0.1),
+        (r"\bdommages tous accidents\b", 0.1),
+    ],
+}
+
+# Motifs recherchés dans le texte brut (casse d'origine)
+RAW_RULES = {
+    RIB: [
+        (r"\b[A-Z]{2}\d{2}(?: ?[A-Z0-9]{4}){3,7}(?: ?[A-Z0-9]{1,3})?\b", 0.6),  # IBAN
+        (r"\b(?:BIC|SWIFT)\b\W{0,3}[A-Z]{6}[A-Z0-9]{2}(?:[A-Z0-9]{3})?\b", 0.3),
+    ],
+    KBIS: [
+        (r"\bR\.?C\.?S\.?\b[^\n]{0,40}?\b\d{3} ?\d{3} ?\d{3}\b", 0.4),
+    ],
+}
+
+# Indices tirés du nom du fichier (normalisé)
+FILENAME_RULES = {
+    QUESTIONNAIRE: (r"\bquestionnaire\b|\bformulaire\b", 0.3),
+    FLEET_LIST: (r"\bflotte\b|\bparc\b|\bvehicules?\b", 0.2),
+    CLAIMS_HISTORY: (r"\bsinistr", 0.3),
+    PREVIOUS_INSURER: (r"\breleve d\b|\bri\b|\battestation\b", 0.2),
+    KBIS: (r"\bk ?bis\b", 0.3),
+    RIB: (r"\brib\b|\biban\b", 0.3),
+    SPECIAL_CONDITIONS: (r"\bconditions?\b|\bgaranties\b", 0.2),
+}
+
+# Colonnes caractéristiques des tableaux de flotte et de sinistres
+FLEET_COLUMNS = {"immatriculation", "marque", "modele", "date de mise en circulation", "vin", "numero de serie", "genre", "puissance", "energie"}
+CLAIMS_COLUMNS = {"sinistre", "nature", "montant", "responsabilite", "cout", "date de survenance", "reglement"}
+
+IMMATRICULATION_RE = re.compile(r"\b[A-Z]{2}[- ]?\d{3}[- ]?[A-Z]{2}\b")
+SHEET_RE = re.compile(r"--- DEBUT CONTENU DE L'ONGLET: '(.*?)' ---\n([^\n]*)")
+CLAIM_LINE_RE = re.compile(r"\d{1,2}/\d{1,2}/\d{2,4}.*\b(?:sinistre|accident|bris|vol|incendie|collision)\b", re.IGNORECASE)
+
+_KEYWORD_RULES = {doc: [(re.compile(p), w) for p, w in rules] for doc, rules in KEYWORD_RULES.items()}
+_RAW_RULES = {doc: [(re.compile(p), w) for p, w in rules] for doc, rules in RAW_RULES.items()}
+_FILENAME_RULES = {doc: (re.compile(p), w) for doc, (p, w) in FILENAME_RULES.items()}
+
+
+def _header_columns(header_line):
+    """Colonnes normalisées d'une ligne d'en-tête (séparateurs | ; , ou tabulation)."""
+    return {normalize_key_component(cell) for cell in re.split(r"[|;,\t]", header_line) if cell.strip()}
+
+
+def _count_matches(pattern, text, limit):
+    count = 0
+    for _ in pattern.finditer(text):
+        count += 1
+        if count >= limit:
+            break
+    return count
+
+
+def _table_scores(text):
+    """Scores des tableaux de flotte et de sinistres, d'après les en-têtes d'onglets (ou la première ligne) et le contenu."""
+    scores = {}
+    sheets = SHEET_RE.findall(text)
+    if not sheets:
+        first_line = next((line for line in text[:CLASSIFIER_MAX_CHARS].splitlines() if line.strip()), "")
+        sheets = [("", first_line)]
+
+    for sheet_name, header in sheets:
+        columns = _header_columns(header)
+        if len(columns & FLEET_COLUMNS) >= 2:
+            scores[FLEET_LIST] = scores.get(FLEET_LIST, 0.0) + 0.5
+        claims_columns = columns & CLAIMS_COLUMNS
+        if "sinistre" in normalize_key_component(sheet_name):
+            scores[CLAIMS_HISTORY] = scores.get(CLAIMS_HISTORY, 0.0) + 0.4
+        if len(claims_columns) >= 2 and any("date" in column for column in columns):
+            scores[CLAIMS_HISTORY] = scores.get(CLAIMS_HISTORY, 0.0) + 0.4
+
+    # Une liste de véhicules contient de nombreuses immatriculations au format SIV
+    plates = _count_matches(IMMATRICULATION_RE, text, 5)
+    if plates >= 5:
+        scores[FLEET_LIST] = scores.get(FLEET_LIST, 0.0) + 0.5
+    elif plates:
+        scores[FLEET_LIST] = scores.get(FLEET_LIST, 0.0) + 0.1
+
+    # Un historique de sinistres liste des sinistres datés
+    if _count_matches(CLAIM_LINE_RE, text[:CLASSIFIER_MAX_CHARS], 3) >= 3:
+        scores[CLAIMS_HISTORY] = scores.get(CLAIMS_HISTORY, 0.0) + 0.3
+    return scores
+
+
+def classify_document(filename, text):
+    """
+    Classe un fichier par règles. Retourne {type de document: confiance entre 0 et 1},
+    pour les types ayant au moins un indice.
+    """
+    head = text[:CLASSIFIER_MAX_CHARS]
+    normalized = normalize_key_component(head)
+    normalized_filename = normalize_key_component(os.path.splitext(filename)[0])
+
+    scores = _table_scores(text)
+    for doc, rules in _KEYWORD_RULES.items():
+        for pattern, weight in rules:
+            if pattern.search(normalized):
+                scores[doc] = scores.get(doc, 0.0) + weight
+    for doc, rules in _RAW_RULES.items():
+        for pattern, weight in rules:
+            if pattern.search(head):
+                scores[doc] = scores.get(doc, 0.0) + weight
+    for doc, (pattern, weight) in _FILENAME_RULES.items():
+        if pattern.search(normalized_filename):
+            scores[doc] = scores.get(doc, 0.0) + weight
+    return {doc: round(min(1.0, score), 2) for doc, score in scores.items() if score > 0}
+
+
+def decide(scores):
+    """
+    Décision à partir des scores : (types retenus, ambigu).
+    Le résultat est ambigu si aucun type n'est retenu ou si un type est entre les seuils de rejet et d'acceptation.
+    """
+    accepted = sorted(doc for doc, score in scores.items() if score >= CLASSIFIER_ACCEPT_SCORE)
+    uncertain = [doc for doc, score in scores.items() if CLASSIFIER_REJECT_SCORE <= score < CLASSIFIER_ACCEPT_SCORE]
+    return accepted, not accepted or bool(uncertain)
@@ -0,0 +1,469 @@
+"""
+Export en masse des JSON de tarification et envoi par lots au système de tarification.
+
+Les devis (JSON produits par le Rule Engine) sont lus en flux depuis les sorties de batch.py
+(fichier NDJSON ou répertoire de fichiers JSON) et traités en une seule passe :
+- NDJSON : un devis par ligne (--ndjson) ;
+- tableau d'une ligne par véhicule de `liste_vehicules`, en CSV (--csv) ou Parquet (--parquet,
+  nécessite pyarrow) ; les colonnes sont fixes, les champs non standard d'un véhicule sont
+  regroupés dans la colonne `autres_champs` (JSON) ;
+- envoi au système de tarification (--submit) : les devis sont regroupés par lots, envoyés par un
+  client http à connexions persistantes, avec un nombre borné de requêtes simultanées. Chaque devis
+  et chaque lot portent un identifiant dérivé de leur contenu (en-tête Idempotency-Key) : un lot
+  renvoyé après une erreur transitoire n'est pas enregistré deux fois par le tarificateur.
+
+Usage :
+    python export.py resultats.ndjson --ndjson devis.ndjson --csv vehicules.csv --parquet vehicules.parquet
+    PRICING_API_URL=https://tarificateur.example/api/devis python export.py devis/ --submit
+"""
+import argparse
+import contextlib
+import csv
+import hashlib
+import importlib.util
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from dotenv import load_dotenv
+
+from fleet import FLEET_FIELDS
+from instrumentation import METRICS, bind_context, span
+from llm import RETRYABLE_STATUS_CODES, retry_delay
+from rules import parse_amount
+
+# --- Configuration du système de tarification ---
+
+PRICING_API_URL = os.getenv("PRICING_API_URL")
+PRICING_API_KEY = os.getenv("PRICING_API_KEY")
+# Nombre de devis par requête et nombre de requêtes simultanées
+PRICING_BATCH_SIZE = max(1, int(os.getenv("PRICING_BATCH_SIZE", "100")))
+PRICING_MAX_CONCURRENCY = max(1, int(os.getenv("PRICING_MAX_CONCURRENCY", "4")))
+PRICING_MAX_RETRIES = int(os.getenv("PRICING_MAX_RETRIES", "5"))
+PRICING_TIMEOUT_SECONDS = float(os.getenv("PRICING_TIMEOUT_SECONDS", "30"))
+
+# Export Parquet : dépendance facultative
+PARQUET_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+# Nombre de lignes par groupe de lignes Parquet (lignes gardées en mémoire avant écriture)
+PARQUET_ROW_GROUP_ROWS = int(os.getenv("PARQUET_ROW_GROUP_ROWS", "50000"))
+
+# Colonnes du tableau des véhicules : informations du devis, puis champs standard du véhicule
+QUOTE_COLUMNS = [
+    "id_devis", "nom_entreprise", "siren", "decision_souscription", "niveau_risque", "segment", "score_risque_flotte",
+]
+VEHICLE_COLUMNS = list(FLEET_FIELDS) + ["score_risque"]
+EXTRA_COLUMN = "autres_champs"
+EXTRA_KEY_PREFIX = "vehicule_"
+VEHICLE_TABLE_COLUMNS = QUOTE_COLUMNS + VEHICLE_COLUMNS + [EXTRA_COLUMN]
+# Colonnes numériques (les autres sont exportées en texte)
+NUMERIC_COLUMNS = {"score_risque_flotte", "valeur", "puissance", "score_risque"}
+
+logger = logging.getLogger("export")
+
+
+class ExportError(Exception):
+    """Export ou envoi impossible (configuration, dépendance manquante) ; le message est destiné à l'utilisateur."""
+
+
+def quote_id(quote):
+    """Identifiant stable d'un devis, dérivé de son contenu (identique d'un envoi à l'autre)."""
+    canonical = json.dumps(quote, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+# --- Lecture des devis ---
+
+def iter_quotes(sources):
+    """
+    Devis contenus dans des sorties de batch.py, lus en flux : fichiers NDJSON (une ligne par dossier),
+    fichiers JSON (résultat de dossier ou devis seul) ou répertoires de fichiers JSON.
+    Les dossiers sans devis (incomplets, en erreur) sont ignorés.
+    """
+    for source in sources:
+        if os.path.isdir(source):
+            paths = [os.path.join(source, name) for name in sorted(os.listdir(source)) if name.endswith(".json")]
+        else:
+            paths = [source]
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                if path.endswith(".json"):
+                    records = [json.load(f)]
+                else:
+                    records = (json.loads(line) for line in f if line.strip())
+                for record in records:
+                    quote = record.get("devis", record) if "statut" in record else record
+                    if quote:
+                        yield quote
+
+
+# --- Tableau d'une ligne par véhicule ---
+
+def iter_vehicle_rows(quote):
+    """Lignes du tableau des véhicules d'un devis (dictionnaires aux colonnes VEHICLE_TABLE_COLUMNS)."""
+    client = quote.get("informations_client") or {}
+    analysis = quote.get("analyse_risque") or {}
+    pricing = quote.get("parametres_tarification") or {}
+    common = {
+        "id_devis": quote_id(quote),
+        "nom_entreprise": client.get("nom_entreprise"),
+        "siren": client.get("siren"),
+        "decision_souscription": analysis.get("decision_souscription"),
+        "niveau_risque": pricing.get("niveau_risque"),
+        "segment": pricing.get("segment"),
+        "score_risque_flotte": pricing.get("score_risque_flotte"),
+    }
+    for vehicle in (quote.get("informations_flotte") or {}).get("liste_vehicules") or []:
+        if not isinstance(vehicle, dict):
+            continue
+        row = dict(common)
+        for column in VEHICLE_COLUMNS:
+            row[column] = vehicle.get(column)
+        # Un champ du véhicule homonyme d'une colonne du devis est conservé sous un nom préfixé
+        extra = {
+            (f"{EXTRA_KEY_PREFIX}{key}" if key in common or key == EXTRA_COLUMN else key): value
+            for key, value in vehicle.items() if key not in VEHICLE_COLUMNS
+        }
+        row[EXTRA_COLUMN] = json.dumps(extra, ensure_ascii=False) if extra else None
+        yield row
+
+
+class VehicleWriter:
+    """Écriture du tableau des véhicules ; utilisable comme gestionnaire de contexte (fermeture garantie)."""
+
+    def write(self, rows):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def abort(self):
+        """Fermeture après un échec de l'export."""
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class CsvVehicleWriter(VehicleWriter):
+    """
+    Écrit le tableau des véhicules en CSV (séparateur « ; », comme les exports Excel français).
+    Si `path` est fourni, `stream` est le fichier correspondant : il est fermé à la fin de l'export,
+    et supprimé si l'export échoue (voir create).
+    """
+
+    def __init__(self, stream, path=None):
+        self.path = path
+        self._stream = stream
+        self._writer = csv.DictWriter(stream, fieldnames=VEHICLE_TABLE_COLUMNS, delimiter=";", extrasaction="ignore")
+        self._writer.writeheader()
+
+    @classmethod
+    def create(cls, path):
+        """Tableau écrit dans le fichier `path`."""
+        return cls(open(path, "w", encoding="utf-8", newline=""), path=path)
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        if self.path is not None:
+            self._stream.close()
+
+    def abort(self):
+        self.close()
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def _to_float(value):
+    if value is None or isinstance(value, float):
+        return value
+    if isinstance(value, (int, bool)):
+        return float(value)
+    amount = parse_amount(value)
+    return None if math.isnan(amount) else amount
+
+
+def _to_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else str(value)
+
+
+class ParquetVehicleWriter(VehicleWriter):
+    """
+    Écrit le tableau des véhicules en Parquet, par groupes de PARQUET_ROW_GROUP_ROWS lignes :
+    la mémoire utilisée ne dépend pas du nombre total de véhicules. Si l'export échoue, le fichier
+    incomplet est supprimé.
+    """
+
+    def __init__(self, path, row_group_rows=PARQUET_ROW_GROUP_ROWS):
+        if not PARQUET_AVAILABLE:
+            raise ExportError("L'export Parquet nécessite le paquet pyarrow (pip install pyarrow).")
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self._schema = pa.schema([
+            (column, pa.float64() if column in NUMERIC_COLUMNS else pa.string()) for column in VEHICLE_TABLE_COLUMNS
+        ])
+        self.path = path
+        self._writer = pq.ParquetWriter(path, self._schema, compression="zstd")
+        self._row_group_rows = row_group_rows
+        self._columns = {column: [] for column in VEHICLE_TABLE_COLUMNS}
+        self._pending = 0
+
+    def write(self, rows):
+        for row in rows:
+            for column, values in self._columns.items():
+                value = row.get(column)
+                values.append(_to_float(value) if column in NUMERIC_COLUMNS else _to_text(value))
+            self._pending += 1
+            if self._pending >= self._row_group_rows:
+                self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self._writer.write_table(self._pa.Table.from_pydict(self._columns, schema=self._schema))
+            for values in self._columns.values():
+                values.clear()
+            self._pending = 0
+
+    def close(self):
+        if self._writer is not None:
+            try:
+                self._flush()
+            finally:
+                self._writer.close()
+                self._writer = None
+
+    def abort(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+# --- Envoi au système de tarification ---
+
+def create_pricing_client(api_key=PRICING_API_KEY, max_concurrency=PRICING_MAX_CONCURRENCY, transport=None):
+    """
+    Client http du système de tarification : connexions persistantes, en nombre égal aux requêtes
+    simultanées autorisées. Prévu pour être créé une fois par processus et partagé entre les threads.
+    """
+    headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+    return httpx.Client(
+        proxies={},
+        transport=transport,
+        headers=headers,
+        limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        timeout=httpx.Timeout(PRICING_TIMEOUT_SECONDS, connect=10.0),
+    )
+
+
+class PricingSubmitter:
+    """
+    Envoi des devis au système de tarification, par lots de `batch_size` devis et avec au plus
+    `max_concurrency` requêtes simultanées. Les lots sont envoyés au fil de la lecture des devis :
+    au plus 2 × max_concurrency lots sont en mémoire à un instant donné.
+    """
+
+    def __init__(self, url=PRICING_API_URL, http_client=None, batch_size=PRICING_BATCH_SIZE,
+                 max_concurrency=PRICING_MAX_CONCURRENCY, max_retries=PRICING_MAX_RETRIES):
+        if not url:
+            raise ExportError("Adresse du système de tarification non configurée (PRICING_API_URL).")
+        self.url = url
+        self.http_client = http_client or create_pricing_client(max_concurrency=max_concurrency)
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+
+    def send_batch(self, quotes):
+        """
+        Envoie un lot de devis ; les erreurs transitoires (réseau, 408/409/429, 5xx) sont retentées
+        avec la même clé d'idempotence. Retourne le nombre de tentatives supplémentaires.
+        """
+        documents = [{"id_devis": quote_id(quote), **quote} for quote in quotes]
+        batch_key = hashlib.sha256("".join(document["id_devis"] for document in documents).encode()).hexdigest()[:32]
+        body = json.dumps({"id_lot": batch_key, "devis": documents}, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Idempotency-Key": batch_key}
+        attempt = 0
+        with span("envoi_lot_tarificateur", kind="http", nombre_devis=len(documents)) as current:
+            while True:
+                try:
+                    response = self.http_client.post(self.url, content=body, headers=headers)
+                    response.raise_for_status()
+                    current.set(tentatives=attempt + 1)
+                    return attempt
+                except httpx.HTTPError as e:
+                    retryable = isinstance(e, httpx.TransportError) or (
+                        isinstance(e, httpx.HTTPStatusError)
+                        and (e.response.status_code in RETRYABLE_STATUS_CODES or e.response.status_code >= 500)
+                    )
+                    if attempt >= self.max_retries or not retryable:
+                        raise
+                    METRICS.inc("souscription_tarificateur_erreurs_transitoires_total", {"erreur": type(e).__name__})
+                    time.sleep(retry_delay(attempt, e))
+                    attempt += 1
+
+    def _send(self, quotes):
+        # Un lot en échec n'interrompt pas l'envoi des autres : l'échec est rapporté dans le bilan
+        try:
+            retries = self.send_batch(quotes)
+        except Exception as e:
+            logger.warning("Échec de l'envoi d'un lot de %d devis : %s", len(quotes), e)
+            METRICS.inc("souscription_tarificateur_lots_total", {"statut": "echec"})
+            return {"envoye": False, "ids": [quote_id(quote) for quote in quotes], "erreur": str(e), "tentatives_supplementaires": 0}
+        METRICS.inc("souscription_tarificateur_lots_total", {"statut": "envoye"})
+        return {"envoye": True, "ids": None, "erreur": None, "tentatives_supplementaires": retries, "nombre": len(quotes)}
+
+    def submit(self, quotes):
+        """
+        Envoie des devis (itérable, lu en flux) et retourne le bilan : nombre de devis et de lots envoyés,
+        tentatives supplémentaires, et pour chaque lot en échec les identifiants des devis et l'erreur.
+        """
+        summary = {"devis_envoyes": 0, "lots_envoyes": 0, "tentatives_supplementaires": 0, "echecs": []}
+        slots = threading.BoundedSemaphore(2 * self.max_concurrency)
+        lock = threading.Lock()
+
+        def collect(future):
+            slots.release()
+            outcome = future.result()
+            with lock:
+                summary["tentatives_supplementaires"] += outcome["tentatives_supplementaires"]
+                if outcome["envoye"]:
+                    summary["devis_envoyes"] += outcome["nombre"]
+                    summary["lots_envoyes"] += 1
+                else:
+                    summary["echecs"].append({"ids_devis": outcome["ids"], "erreur": outcome["erreur"]})
+
+        with span("envoi_tarificateur", kind="http") as current:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                for batch in _batches(quotes, self.batch_size):
+                    slots.acquire()
+                    executor.submit(bind_context(self._send), batch).add_done_callback(collect)
+            current.set(devis_envoyes=summary["devis_envoyes"], lots_en_echec=len(summary["echecs"]))
+        return summary
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# --- Export en une passe ---
+
+def export_quotes(quotes, ndjson_stream=None, vehicle_writers=(), submitter=None):
+    """
+    Parcourt les devis une seule fois : chaque devis est écrit en NDJSON, ses véhicules sont ajoutés aux
+    tableaux (CsvVehicleWriter, ParquetVehicleWriter) et il est transmis à l'envoi par lots.
+    Les tableaux sont fermés à la fin de l'export, y compris en cas d'échec.
+    Retourne le bilan (nombre de devis et de véhicules, bilan de l'envoi).
+    """
+    counts = {"devis": 0, "vehicules": 0}
+
+    def iter_exported():
+        for quote in quotes:
+            counts["devis"] += 1
+            if ndjson_stream is not None:
+                ndjson_stream.write(json.dumps(quote, ensure_ascii=False) + "\n")
+            if vehicle_writers:
+                rows = list(iter_vehicle_rows(quote))
+                for writer in vehicle_writers:
+                    writer.write(rows)
+            counts["vehicules"] += len((quote.get("informations_flotte") or {}).get("liste_vehicules") or [])
+            yield quote
+
+    with span("export_devis", kind="export") as current, contextlib.ExitStack() as writers:
+        for writer in vehicle_writers:
+            writers.enter_context(writer)
+        if submitter is not None:
+            counts["envoi"] = submitter.submit(iter_exported())
+        else:
+            for _ in iter_exported():
+                pass
+        current.set(nombre_devis=counts["devis"], nombre_vehicules=counts["vehicules"])
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sources", nargs="+", help="Fichiers NDJSON ou JSON, ou répertoires de fichiers JSON (sorties de batch.py).")
+    parser.add_argument("--ndjson", help="Fichier NDJSON des devis, '-' pour la sortie standard.")
+    parser.add_argument("--csv", help="Fichier CSV d'une ligne par véhicule.")
+    parser.add_argument("--parquet", help="Fichier Parquet d'une ligne par véhicule (nécessite pyarrow).")
+    parser.add_argument("--submit", action="store_true", help="Envoyer les devis au système de tarification (PRICING_API_URL).")
+    parser.add_argument("--batch-size", type=int, default=PRICING_BATCH_SIZE, help=f"Devis par lot (défaut : {PRICING_BATCH_SIZE}).")
+    parser.add_argument("--concurrency", type=int, default=PRICING_MAX_CONCURRENCY, help=f"Lots envoyés simultanément (défaut : {PRICING_MAX_CONCURRENCY}).")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s", stream=sys.stderr)
+    load_dotenv()
+    if not (args.ndjson or args.csv or args.parquet or args.submit):
+        parser.error("aucune sortie demandée (--ndjson, --csv, --parquet ou --submit)")
+
+    ndjson_stream = None
+    start = time.perf_counter()
+    try:
+        # Les tableaux déjà créés sont supprimés si la suite de l'export échoue
+        with contextlib.ExitStack() as vehicle_writers:
+            submitter = None
+            if args.submit:
+                submitter = PricingSubmitter(
+                    url=os.getenv("PRICING_API_URL"),
+                    http_client=create_pricing_client(os.getenv("PRICING_API_KEY"), max(1, args.concurrency)),
+                    batch_size=max(1, args.batch_size), max_concurrency=max(1, args.concurrency),
+                )
+            if args.ndjson:
+                ndjson_stream = sys.stdout if args.ndjson == "-" else open(args.ndjson, "w", encoding="utf-8")
+            writers = []
+            if args.csv:
+                writers.append(vehicle_writers.enter_context(CsvVehicleWriter.create(args.csv)))
+            if args.parquet:
+                writers.append(vehicle_writers.enter_context(ParquetVehicleWriter(args.parquet)))
+            counts = export_quotes(iter_quotes(args.sources), ndjson_stream, writers, submitter)
+    except ExportError as e:
+        logger.error("%s", e)
+        return 2
+    finally:
+        if ndjson_stream is not None and ndjson_stream is not sys.stdout:
+            ndjson_stream.close()
+
+    elapsed = time.perf_counter() - start
+    logger.info("%d devis, %d véhicule(s) exportés en %.1f s", counts["devis"], counts["vehicules"], elapsed)
+    sent = counts.get("envoi")
+    if sent is not None:
+        logger.info(
+            "Envoi : %d devis en %d lot(s), %d nouvelle(s) tentative(s), %d lot(s) en échec",
+            sent["devis_envoyes"], sent["lots_envoyes"], sent["tentatives_supplementaires"], len(sent["echecs"]),
+        )
+        return 1 if sent["echecs"] else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from docx import Document
+from openpyxl import load_workbook
+from pypdf import PdfReader
+
+from tables import iter_compact_table
+
+# --- Types MIME pris en charge ---
+
+PDF_MIME = "application/pdf"
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Types acceptés par l'interface de chargement, indexés par extension de fichier
+EXTENSION_MIME_TYPES = {
+    ".pdf": PDF_MIME,
+    ".docx": DOCX_MIME,
+    ".xlsx": XLSX_MIME,
+    ".csv": "text/csv",
+    ".txt": "text/plain",
+}
+
+
+# Extraction parallèle des PDF : nombre de processus, et nombre de pages à partir duquel
+# les pages restant à lire sont réparties par plages entre les processus
+PDF_MAX_PROCESSES = max(1, int(os.getenv("PDF_MAX_PROCESSES", str(min(4, os.cpu_count() or 1)))))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+# Nombre maximal de pages lues pour l'identification : un PDF numérisé, sans couche texte,
+# n'atteint jamais la taille d'extrait demandée
+PDF_HEAD_MAX_PAGES = int(os.getenv("PDF_HEAD_MAX_PAGES", "10"))
+
+
+# --- Extraction en flux ---
+# Chaque format est lu par un générateur de fragments de texte, assemblés une seule fois
+# avec "".join : pas de concaténations répétées, et aucune représentation complète du
+# document (cellules Excel, etc.) n'est conservée en mémoire pendant la lecture.
+# Le contenu est fourni en octets, ou par le chemin d'un fichier sur disque (voir spool.py) :
+# le fichier est alors lu à la demande par les lecteurs, sans être chargé entièrement en mémoire.
+
+def open_content(data):
+    """Flux binaire sur un contenu (octets ou chemin de fichier)."""
+    if isinstance(data, str):
+        return open(data, "rb")
+    return io.BytesIO(data)
+
+
+def iter_pdf_text(data):
+    """
+    Produit le texte complet d'un PDF, page par page (pages extraites en parallèle pour les documents
+    longs, voir PdfTextSource.iter_text) ; le document est fermé à la fin de la lecture.
+    """
+    source = PdfTextSource(data)
+    try:
+        yield from source.iter_text()
+    finally:
+        source.close()
+
+
+# --- Lecture paresseuse des PDF ---
+# L'identification d'un document n'a besoin que de ses premières pages : un PdfTextSource lit les
+# pages à la demande et mémorise leur texte. Le texte complet n'est produit que lorsqu'il est
+# nécessaire (extraction des informations clés), en répartissant les pages restantes par plages
+# entre plusieurs processus pour les documents longs.
+
+def extract_pdf_pages(data, start, stop):
+    """Texte des pages [start, stop) d'un PDF (exécuté dans un processus de la réserve ; `data` : octets ou chemin)."""
+    with open_content(data) as stream:
+        pdf_reader = PdfReader(stream)
+        return [pdf_reader.pages[index].extract_text() or "" for index in range(start, stop)]
+
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool():
+    # Processus lancés en mode "spawn" : l'application est multi-thread, un fork n'y est pas sûr
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_MAX_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+        return _pdf_pool
+
+
+class PdfTextSource:
+    """
+    Texte d'un PDF, lu page par page à la demande ; le texte de chaque page lue est mémorisé.
+    `data` est le contenu du PDF ou le chemin du fichier ; dans ce cas, les processus d'extraction
+    parallèle relisent le fichier eux-mêmes plutôt que de recevoir une copie du contenu.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data) if isinstance(data, (bytes, bytearray)) else os.path.getsize(data)
+        self._stream = None
+        self._reader = None
+        self._pages = {}
+        self._lock = threading.Lock()
+        self.page_count = len(self._get_reader().pages)
+
+    def _get_reader(self):
+        # Le document est rouvert s'il a été fermé entre-temps (source retirée de la réserve pendant sa lecture)
+        if self._reader is None:
+            self._stream = open_content(self.data)
+            self._reader = PdfReader(self._stream)
+        return self._reader
+
+    @property
+    def complete(self):
+        """Vrai si toutes les pages ont été lues."""
+        return len(self._pages) == self.page_count
+
+    @property
+    def memory_bytes(self):
+        """Estimation de la mémoire occupée : contenu (ou fichier lu) et texte des pages lues."""
+        return self.size + sum(len(text) for text in list(self._pages.values()))
+
+    def page(self, index):
+        with self._lock:
+            if index not in self._pages:
+                self._pages[index] = self._get_reader().pages[index].extract_text() or ""
+            return self._pages[index]
+
+    def close(self):
+        """Ferme le document ; le texte des pages déjà lues reste disponible."""
+        with self._lock:
+            if self._stream is not None:
+                self._stream.close()
+            self._stream = None
+            self._reader = None
+
+    def iter_pages(self):
+        for index in range(self.page_count):
+            yield self.page(index)
+
+    def head(self, max_chars, max_pages=PDF_HEAD_MAX_PAGES):
+        """Texte des premières pages, jusqu'à atteindre au moins `max_chars` caractères ou `max_pages` pages."""
+        parts = []
+        size = 0
+        for index in range(min(self.page_count, max_pages)):
+            text = self.page(index)
+            parts.append(text)
+            size += len(text)
+            if size >= max_chars:
+                break
+        return "".join(parts)
+
+    def iter_text(self):
+        """Texte complet, page par page ; les pages non encore lues sont extraites en parallèle si elles sont nombreuses."""
+        missing = [index for index in range(self.page_count) if index not in self._pages]
+        if len(missing) >= PDF_PARALLEL_MIN_PAGES and PDF_MAX_PROCESSES > 1:
+            # Les pages déjà lues sont en tête du document : les pages restantes forment une plage continue
+            start = missing[0]
+            step = -(-(self.page_count - start) // PDF_MAX_PROCESSES)
+            ranges = [(first, min(first + step, self.page_count)) for first in range(start, self.page_count, step)]
+            futures = [_get_pdf_pool().submit(extract_pdf_pages, self.data, first, stop) for first, stop in ranges]
+            for (first, _), future in zip(ranges, futures):
+                texts = future.result()
+                with self._lock:
+                    for offset, page_text in enumerate(texts):
+                        self._pages.setdefault(first + offset, page_text)
+        return self.iter_pages()
+
+
+def iter_xlsx_text(data):
+    """
+    Produit le texte d'un classeur Excel onglet par onglet, sous forme de tableaux compacts (tables.py).
+    Le classeur est ouvert en lecture seule : les lignes sont lues à la volée depuis l'archive.
+    """
+    with open_content(data) as stream:
+        workbook = load_workbook(filename=stream, read_only=True)
+        try:
+            for sheet in workbook.worksheets:
+                yield from iter_compact_table(sheet.title, lambda: sheet.iter_rows(values_only=True))
+        finally:
+            workbook.close()
+
+
+def iter_plain_text(data):
+    """Produit le contenu d'un fichier texte (CSV, TXT) ligne par ligne."""
+    with io.TextIOWrapper(open_content(data), encoding="utf-8", newline="") as stream:
+        yield from stream
+
+
+def iter_docx_text(data):
+    """Produit le texte d'un document Word, paragraphe par paragraphe."""
+    with open_content(data) as stream:
+        paragraphs = Document(stream).paragraphs
+    for index, para in enumerate(paragraphs):
+        yield ("\n" if index else "") + para.text
+
+
+def iter_text(data, mime_type):
+    """
+    Fragments du texte brut d'un fichier, à partir de son contenu (octets ou chemin) et de son type MIME.
+    Retourne None si le type n'est pas pris en charge ; les erreurs de lecture sont propagées pendant l'itération.
+    """
+    if mime_type == PDF_MIME:
+        return iter_pdf_text(data)
+    elif mime_type == DOCX_MIME:
+        return iter_docx_text(data)
+    elif mime_type == XLSX_MIME:
+        return iter_xlsx_text(data)
+    elif "text" in mime_type:
+        return iter_plain_text(data)
+    else:
+        return None
+
+
+def extract_text(data, mime_type):
+    """
+    Extrait le texte brut d'un fichier à partir de son contenu (octets ou chemin) et de son type MIME.
+    Retourne None si le type n'est pas pris en charge ; les erreurs de lecture sont propagées.
+    """
+    fragments = iter_text(data, mime_type)
+    return None if fragments is None else "".join(fragments)
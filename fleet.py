@@ -0,0 +1,354 @@
+import csv
+import json
+import math
+import re
+
+from cache import get_cache, make_key, normalize_key_component
+from classifier import CLAIMS_COLUMNS
+from instrumentation import record_cache_lookup, span
+from llm import chat_completion
+from rules import parse_amount, parse_date
+from tables import CELL_SEPARATOR, COMMON_VALUES_PREFIX, PREAMBLE_PREFIX, SHEET_END, SHEET_START
+
+# --- Extraction déterministe de la liste des véhicules ---
+# Les listes de flotte sont presque toujours des tableaux (onglets Excel, CSV). Plutôt que de faire
+# recopier chaque ligne par le LLM, le tableau des véhicules est repéré et ses colonnes sont
+# associées aux champs attendus (immatriculation, marque, modèle, date de mise en circulation,
+# valeur...) grâce à un dictionnaire de synonymes. Le LLM n'est sollicité que pour associer des
+# en-têtes inconnus, jamais pour lire les lignes. Chaque ligne devient un véhicule typé : dates au
+# format ISO, montants numériques, immatriculations normalisées. Le nombre de véhicules est exact.
+
+# À incrémenter dès que les synonymes ou la conversion des valeurs changent
+FLEET_EXTRACTION_VERSION = "4"
+HEADER_MAPPING_MODEL = "gpt-4o-mini"
+HEADER_MAPPING_PROMPT_VERSION = "1"
+# Nombre de lignes d'exemple transmises au LLM pour l'association des en-têtes
+HEADER_MAPPING_SAMPLE_ROWS = 3
+# Proportion minimale de valeurs au format immatriculation pour reconnaître la colonne sans en-tête connu
+PLATE_COLUMN_MIN_RATIO = 0.8
+
+# Synonymes des en-têtes de colonnes, sous forme normalisée (minuscules, sans accents ni ponctuation)
+FLEET_FIELDS = {
+    "immatriculation": [
+        "immatriculation", "immat", "n immatriculation", "no immatriculation", "numero immatriculation",
+        "numero d immatriculation", "plaque", "plaque d immatriculation", "registration", "plate",
+    ],
+    "vin": ["vin", "numero de serie", "n de serie", "no de serie", "numero serie", "chassis", "numero de chassis", "numero vin"],
+    "marque": ["marque", "constructeur", "make", "brand"],
+    "modele": ["modele", "model", "version", "designation", "modele commercial"],
+    "marque_modele": ["marque modele", "marque et modele", "vehicule marque modele"],
+    "genre": ["genre", "categorie", "type de vehicule", "type vehicule", "carrosserie", "type"],
+    "energie": ["energie", "carburant", "motorisation"],
+    "puissance": ["puissance", "puissance fiscale", "cv", "chevaux fiscaux", "puissance cv"],
+    "date_mise_circulation": [
+        "date de mise en circulation", "date mise en circulation", "mise en circulation", "dmc", "mec",
+        "date 1ere mise en circulation", "date de 1ere mise en circulation", "date de premiere mise en circulation",
+        "date 1ere immatriculation", "date de 1ere immatriculation", "date de premiere immatriculation",
+        "premiere immatriculation", "date d immatriculation", "annee de mise en circulation", "annee",
+    ],
+    "valeur": [
+        "valeur", "valeur assuree", "valeur a neuf", "valeur venale", "valeur catalogue", "valeur du vehicule",
+        "valeur eur", "valeur ht", "valeur ttc", "prix", "prix d achat", "prix achat", "prix catalogue",
+    ],
+    "usage": ["usage", "utilisation"],
+    "conducteur": ["conducteur", "conducteur principal", "affectation", "utilisateur"],
+}
+
+IDENTIFIER_FIELDS = ("immatriculation", "vin")
+# Champs dont au moins un doit être reconnu pour que l'association des en-têtes soit jugée suffisante
+CORE_FIELD_GROUPS = (("marque", "modele", "marque_modele"), ("date_mise_circulation",), ("valeur",))
+DATE_FIELDS = ("date_mise_circulation",)
+AMOUNT_FIELDS = ("valeur", "puissance")
+
+SIV_RE = re.compile(r"^([A-Z]{2})[\s-]?(\d{3})[\s-]?([A-Z]{2})$")
+FNI_RE = re.compile(r"^(\d{1,4})[\s-]?([A-Z]{1,3})[\s-]?(\d{2}|2A|2B|97\d)$")
+
+_SYNONYMS = sorted(
+    ((synonym, field) for field, synonyms in FLEET_FIELDS.items() for synonym in synonyms),
+    key=lambda item: -len(item[0]),
+)
+_SYNONYM_RES = [(re.compile(rf"\b{re.escape(synonym)}\b"), field) for synonym, field in _SYNONYMS]
+_EXACT_SYNONYMS = {synonym: field for synonym, field in _SYNONYMS}
+
+
+# --- Lecture des tableaux ---
+
+def iter_tables(name, lines):
+    """
+    Tableaux d'un fichier, à partir des lignes de son texte : onglets encodés par tables.py, ou fichier
+    CSV entier. Chaque tableau est un dictionnaire : fichier, onglet (None pour un CSV), en-tête,
+    valeurs communes [(colonne, valeur)] et lignes (listes de cellules).
+    """
+    sheet_prefix = SHEET_START.split("{}")[0]
+    end_prefix = SHEET_END.split("{}")[0]
+    lines = iter(lines)
+    first = next(lines, None)
+    if first is None:
+        return
+    if not first.startswith(sheet_prefix):
+        if name.lower().endswith(".csv"):
+            yield from _iter_csv_table(name, first, lines)
+        return
+
+    table = None
+    for line in _prepend(first, lines):
+        if line.startswith(sheet_prefix):
+            table = {"fichier": name, "onglet": line[len(sheet_prefix):].rsplit("' ---", 1)[0], "entete": None, "communes": [], "lignes": []}
+        elif table is None:
+            continue
+        elif line.startswith(end_prefix):
+            if table["entete"]:
+                yield table
+            table = None
+        elif not line.strip():
+            continue
+        elif table["entete"] is None:
+            table["entete"] = line.split(CELL_SEPARATOR)
+        elif line.startswith(COMMON_VALUES_PREFIX):
+            table["communes"] = _parse_common_values(line[len(COMMON_VALUES_PREFIX):])
+        elif line.startswith(PREAMBLE_PREFIX) and not table["lignes"]:
+            continue
+        else:
+            table["lignes"].append(line.split(CELL_SEPARATOR))
+
+
+def _prepend(first, lines):
+    yield first
+    yield from lines
+
+
+def _parse_common_values(text):
+    common = []
+    for item in text.split("; "):
+        column, separator, value = item.strip().partition("=")
+        if separator:
+            common.append((column, value))
+    return common
+
+
+def _iter_csv_table(name, first, lines):
+    # Séparateur le plus fréquent de la première ligne
+    delimiter = max(";,\t|", key=first.count)
+    rows = (row for row in csv.reader(_prepend(first, lines), delimiter=delimiter) if any(cell.strip() for cell in row))
+    header = next(rows, None)
+    if header:
+        yield {"fichier": name, "onglet": None, "entete": [cell.strip() for cell in header], "communes": [], "lignes": [[cell.strip() for cell in row] for row in rows]}
+
+
+# --- Association des colonnes ---
+
+def match_header(header):
+    """Champ véhicule correspondant à un en-tête de colonne (None s'il est inconnu)."""
+    normalized = normalize_key_component(header)
+    if not normalized:
+        return None
+    if normalized in _EXACT_SYNONYMS:
+        return _EXACT_SYNONYMS[normalized]
+    # Synonyme le plus long contenu dans l'en-tête ("numero d immatriculation du vehicule")
+    for pattern, field in _SYNONYM_RES:
+        if pattern.search(normalized):
+            return field
+    return None
+
+
+def format_immatriculation(value):
+    """Immatriculation au format officiel ("AB-123-CD", ou "1234 AB 75" pour l'ancien format), None si vide."""
+    text = str(value or "").strip().upper()
+    if not text:
+        return None
+    match = SIV_RE.match(text)
+    if match:
+        return "-".join(match.groups())
+    match = FNI_RE.match(text)
+    if match:
+        return " ".join(match.groups())
+    return text
+
+
+def _is_plate(value):
+    text = str(value or "").strip().upper()
+    return bool(SIV_RE.match(text) or FNI_RE.match(text))
+
+
+def map_columns(columns, sample_rows):
+    """
+    Associe chaque colonne (en-têtes du tableau puis colonnes à valeur commune) à un champ véhicule.
+    Retourne {indice de colonne: champ} ; une colonne sans en-tête connu dont les valeurs sont des
+    immatriculations est reconnue à ses valeurs.
+    """
+    mapping = {}
+    for index, header in enumerate(columns):
+        field = match_header(header)
+        if field is not None and field not in mapping.values():
+            mapping[index] = field
+
+    if not any(field in IDENTIFIER_FIELDS for field in mapping.values()):
+        for index in range(len(columns)):
+            if index in mapping:
+                continue
+            values = [row[index] for row in sample_rows if index < len(row) and row[index]]
+            if values and sum(map(_is_plate, values)) >= PLATE_COLUMN_MIN_RATIO * len(values):
+                mapping[index] = "immatriculation"
+                break
+    return mapping
+
+
+def is_fleet_table(table, mapping):
+    """Un tableau de véhicules identifie chaque véhicule (immatriculation ou VIN) ; les tableaux de sinistres sont écartés."""
+    if "sinistre" in normalize_key_component(table["onglet"] or ""):
+        return False
+    columns = {normalize_key_component(header) for header in table["entete"]}
+    if len(columns & CLAIMS_COLUMNS) >= 2:
+        return False
+    return bool(table["lignes"]) and any(field in IDENTIFIER_FIELDS for field in mapping.values())
+
+
+def needs_llm_mapping(columns, mapping):
+    """Vrai si des en-têtes sont inconnus alors qu'un groupe de champs essentiels n'a pas été reconnu."""
+    unmapped = [header for index, header in enumerate(columns) if index not in mapping and header.strip()]
+    found = set(mapping.values())
+    return bool(unmapped) and any(not found.intersection(group) for group in CORE_FIELD_GROUPS)
+
+
+def map_headers_with_llm(columns, sample_rows, client):
+    """
+    Demande au LLM le champ véhicule de chaque en-tête (seuls les en-têtes et quelques lignes lui sont
+    transmis). Le résultat est mis en cache par liste d'en-têtes. Retourne {en-tête: champ}.
+    """
+    cache = get_cache()
+    key = make_key("entetes_flotte", normalize_key_component("|".join(columns)), HEADER_MAPPING_MODEL, HEADER_MAPPING_PROMPT_VERSION)
+    mapping = cache.get(key)
+    record_cache_lookup("entetes_flotte", mapping is not None)
+    if mapping is not None:
+        return mapping
+
+    prompt = f"""
+    Voici l'en-tête et les premières lignes d'un tableau de véhicules d'une flotte automobile, cellules séparées par "|" :
+    <tableau>
+    {CELL_SEPARATOR.join(columns)}
+    {chr(10).join(CELL_SEPARATOR.join(row) for row in sample_rows)}
+    </tableau>
+
+    Associez chaque en-tête de colonne à l'un des champs suivants, ou à null si aucun ne convient :
+    {json.dumps(list(FLEET_FIELDS), ensure_ascii=False)}
+
+    Retournez exclusivement un objet JSON avec une clé "correspondances" dont la valeur associe chaque en-tête à un champ ou à null.
+    """
+    response = chat_completion(
+        client,
+        "correspondance_entetes_flotte",
+        model=HEADER_MAPPING_MODEL,
+        messages=[
+            {"role": "system", "content": "Vous êtes un expert en assurance flotte qui interprète des tableaux de véhicules."},
+            {"role": "user", "content": prompt},
+        ],
+        response_format={"type": "json_object"},
+        temperature=0.0,
+    )
+    answer = json.loads(response.choices[0].message.content).get("correspondances") or {}
+    mapping = {header: field for header, field in answer.items() if field in FLEET_FIELDS}
+    cache.set(key, mapping)
+    return mapping
+
+
+# --- Conversion des valeurs ---
+
+def to_amount(value):
+    """Montant numérique d'une cellule (rules.parse_amount), entier s'il est rond ; None si illisible."""
+    amount = parse_amount(value)
+    if math.isnan(amount):
+        return None
+    return int(amount) if amount.is_integer() else amount
+
+
+def _column_key(header):
+    return normalize_key_component(header).replace(" ", "_")
+
+
+def parse_vehicle(cells, columns, mapping):
+    """Véhicule typé à partir des cellules d'une ligne ; les colonnes non reconnues sont conservées telles quelles."""
+    vehicle = {}
+    for index, header in enumerate(columns):
+        value = cells[index].strip() if index < len(cells) else ""
+        if not value:
+            continue
+        field = mapping.get(index)
+        if field is None:
+            key = _column_key(header)
+            if key:
+                vehicle.setdefault(key, value)
+        elif field == "immatriculation":
+            vehicle[field] = format_immatriculation(value)
+        elif field in DATE_FIELDS:
+            vehicle[field] = parse_date(value) or value
+        elif field in AMOUNT_FIELDS:
+            vehicle[field] = to_amount(value)
+        else:
+            vehicle[field] = value
+    return vehicle
+
+
+def _is_vehicle(vehicle, cells):
+    # Les lignes de total et les lignes sans aucune information sur le véhicule sont ignorées
+    if cells and normalize_key_component(cells[0]).startswith("total"):
+        return False
+    return any(vehicle.get(field) for field in ("immatriculation", "vin", "marque", "modele", "marque_modele"))
+
+
+# --- Extraction ---
+
+def _with_common_cells(row, table, common_cells):
+    # Les cellules vides en fin de ligne sont omises dans les tableaux compacts : la ligne est complétée
+    # jusqu'au nombre de colonnes de l'en-tête pour que les valeurs communes restent dans leurs colonnes
+    if not common_cells:
+        return row
+    width = len(table["entete"])
+    return row[:width] + [""] * (width - len(row)) + common_cells
+
+
+def extract_fleet_table(table, client, problems):
+    """Véhicules d'un tableau, ou None si ce n'est pas un tableau de véhicules."""
+    columns = table["entete"] + [column for column, _ in table["communes"]]
+    common_cells = [value for _, value in table["communes"]]
+    sample_rows = [_with_common_cells(row, table, common_cells) for row in table["lignes"][:HEADER_MAPPING_SAMPLE_ROWS]]
+    mapping = map_columns(columns, sample_rows)
+    if not is_fleet_table(table, mapping):
+        return None
+
+    if needs_llm_mapping(columns, mapping) and client is not None:
+        try:
+            llm_mapping = map_headers_with_llm(columns, sample_rows, client)
+        except Exception as e:
+            problems.append(("warning", f"Association des colonnes du tableau '{table['onglet'] or table['fichier']}' incomplète : {e}"))
+            llm_mapping = {}
+        for index, header in enumerate(columns):
+            field = llm_mapping.get(header)
+            if index not in mapping and field and field not in mapping.values():
+                mapping[index] = field
+
+    vehicles = []
+    for row in table["lignes"]:
+        cells = _with_common_cells(row, table, common_cells)
+        vehicle = parse_vehicle(cells, columns, mapping)
+        if _is_vehicle(vehicle, row):
+            vehicles.append(vehicle)
+    return vehicles
+
+
+def extract_fleet(files_lines, client, problems):
+    """
+    Extrait les véhicules des tableaux du dossier. `files_lines` est un itérable de couples
+    (nom du fichier, lignes du texte). Retourne (véhicules, tableaux utilisés), où chaque tableau
+    utilisé est décrit par (fichier, onglet ou None, nombre de véhicules).
+    """
+    vehicles = []
+    tables = []
+    with span("extraction_flotte", kind="extraction") as current:
+        for name, lines in files_lines:
+            for table in iter_tables(name, lines):
+                table_vehicles = extract_fleet_table(table, client, problems)
+                if table_vehicles:
+                    vehicles.extend(table_vehicles)
+                    tables.append((table["fichier"], table["onglet"], len(table_vehicles)))
+        current.set(vehicules=len(vehicles), tableaux=len(tables))
+    return vehicles, tables
@@ -0,0 +1,313 @@
+import atexit
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+
+# --- Instrumentation du pipeline ---
+# Chaque étape, fichier et appel LLM est mesuré dans un « span » (durée, tokens, coût, tentatives,
+# accès au cache). Les spans d'un dossier forment une trace exportée en JSON ; des métriques
+# agrégées sur tout le processus sont exportées au format texte Prometheus.
+
+TRACE_DIR = os.getenv("TRACE_DIR", "traces")
+# Nombre maximal de fichiers de trace conservés : les plus anciens sont supprimés
+TRACE_MAX_FILES = int(os.getenv("TRACE_MAX_FILES", "500"))
+# Un fichier de métriques par processus ("{pid}" est remplacé par l'identifiant du processus) : sous
+# batch.py --processes, chaque processus a ses propres compteurs. Les séries portent le label
+# « processus » pour pouvoir être additionnées (collecteur textfile de Prometheus). Le fichier est
+# supprimé à la fin du processus ; ceux des processus arrêtés brutalement le sont au prochain export.
+METRICS_FILE = os.getenv("METRICS_FILE", os.path.join(TRACE_DIR, "metrics_{pid}.prom"))
+
+# Prix indicatifs en USD par million de tokens (entrée, sortie), utilisés pour estimer le coût des appels
+MODEL_PRICING = {
+    "gpt-4o": (5.00, 15.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "llama-3.1-sonar-small-128k-online": (0.20, 0.20),
+}
+
+# Bornes (en secondes) des histogrammes de durée
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """Coût estimé d'un appel en USD, 0 si le modèle n'a pas de tarif connu."""
+    input_price, output_price = MODEL_PRICING.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+class Span:
+    """Mesure d'une opération : nom, type, durée, attributs et sous-opérations."""
+
+    def __init__(self, name, kind, parent=None, **attributes):
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.attributes = dict(attributes)
+        self.children = []
+        self.start = time.time()
+        self._start_perf = time.perf_counter()
+        self.duration = None
+        self.error = None
+        self._lock = threading.Lock()
+        if parent is not None:
+            with parent._lock:
+                parent.children.append(self)
+
+    def set(self, **attributes):
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.attributes[name] = self.attributes.get(name, 0) + amount
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start_perf
+
+    def iter_spans(self):
+        yield self
+        for child in list(self.children):
+            yield from child.iter_spans()
+
+    def to_dict(self):
+        return {
+            "nom": self.name,
+            "type": self.kind,
+            "debut": self.start,
+            "duree_secondes": None if self.duration is None else round(self.duration, 6),
+            "attributs": dict(self.attributes),
+            "erreur": self.error,
+            "enfants": [child.to_dict() for child in list(self.children)],
+        }
+
+
+class Metrics:
+    """Compteurs et histogrammes agrégés sur l'ensemble du processus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            buckets, total, count = self.histograms.get(key, ([0] * len(DURATION_BUCKETS), 0.0, 0))
+            buckets = [n + (1 if value <= bound else 0) for n, bound in zip(buckets, DURATION_BUCKETS)]
+            self.histograms[key] = (buckets, total + value, count + 1)
+
+    def to_prometheus(self, common_labels=()):
+        """Sérialise les métriques au format d'exposition texte de Prometheus ; `common_labels` est ajouté à chaque série."""
+        def format_labels(labels, extra=()):
+            items = list(labels) + list(common_labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in items) + "}"
+
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f"# TYPE {name} counter")
+                seen.add(name)
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), (buckets, total, count) in histograms:
+            if name not in seen:
+                lines.append(f"# TYPE {name} histogram")
+                seen.add(name)
+            for bound, n in zip(DURATION_BUCKETS, buckets):
+                lines.append(f"{name}_bucket{format_labels(labels, [('le', bound)])} {n}")
+            lines.append(f"{name}_bucket{format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+@contextlib.contextmanager
+def span(name, kind="etape", **attributes):
+    """
+    Mesure le bloc de code dans un span rattaché au span courant (s'il existe).
+    La durée est aussi agrégée dans les métriques du processus.
+    """
+    current = Span(name, kind, parent=_current_span.get(), **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.finish()
+        METRICS.observe("souscription_duree_secondes", {"type": kind, "nom": name}, current.duration)
+        if current.error:
+            METRICS.inc("souscription_erreurs_total", {"type": kind, "nom": name})
+
+
+def traced(name, kind="etape"):
+    """Décorateur : mesure chaque appel de la fonction dans un span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, kind=kind):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind_context(func):
+    """
+    Rattache `func` au contexte courant (span en cours) pour une exécution dans un autre thread.
+    À appeler dans le thread qui soumet la tâche.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(func, *args, **kwargs)
+
+
+def record_cache_lookup(cache_type, hit):
+    """Comptabilise un accès au cache, dans les métriques et sur le span courant."""
+    result = "hit" if hit else "miss"
+    METRICS.inc("souscription_cache_acces_total", {"cache": cache_type, "resultat": result})
+    current = _current_span.get()
+    if current is not None:
+        current.increment(f"cache_{cache_type}_{result}")
+
+
+def record_llm_usage(model, response, retries=0):
+    """Enregistre tokens, coût estimé et nombre de nouvelles tentatives d'un appel LLM."""
+    usage = getattr(response, "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    cost = estimate_cost(model, prompt_tokens, completion_tokens)
+    METRICS.inc("souscription_llm_appels_total", {"modele": model})
+    METRICS.inc("souscription_llm_tokens_total", {"modele": model, "type": "prompt"}, prompt_tokens)
+    METRICS.inc("souscription_llm_tokens_total", {"modele": model, "type": "completion"}, completion_tokens)
+    METRICS.inc("souscription_llm_cout_usd_total", {"modele": model}, cost)
+    if retries:
+        METRICS.inc("souscription_llm_tentatives_supplementaires_total", {"modele": model}, retries)
+    current = _current_span.get()
+    if current is not None:
+        current.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cout_usd=round(cost, 6), tentatives_supplementaires=retries)
+
+
+def summarize(root):
+    """Totaux d'une trace : appels LLM, tokens, coût estimé et accès au cache."""
+    totals = {"appels_llm": 0, "prompt_tokens": 0, "completion_tokens": 0, "cout_usd": 0.0, "tentatives_supplementaires": 0, "cache_hit": 0, "cache_miss": 0}
+    for s in root.iter_spans():
+        if s.kind == "llm":
+            totals["appels_llm"] += 1
+        for key in ("prompt_tokens", "completion_tokens", "cout_usd", "tentatives_supplementaires"):
+            totals[key] += s.attributes.get(key, 0)
+        for key, value in s.attributes.items():
+            if key.startswith("cache_") and key.endswith("_hit"):
+                totals["cache_hit"] += value
+            elif key.startswith("cache_") and key.endswith("_miss"):
+                totals["cache_miss"] += value
+    totals["cout_usd"] = round(totals["cout_usd"], 6)
+    return totals
+
+
+def _write_atomically(path, content):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def export_trace(root, trace_dir=TRACE_DIR, metrics_file=METRICS_FILE):
+    """
+    Écrit la trace d'un dossier (JSON) dans `trace_dir`, en ne conservant que les TRACE_MAX_FILES
+    traces les plus récentes, et met à jour le fichier de métriques Prometheus du processus.
+    Retourne le chemin du fichier de trace.
+    """
+    trace = {"trace_id": root.attributes.get("trace_id"), "resume": summarize(root), "racine": root.to_dict()}
+    path = os.path.join(trace_dir, f"trace_{time.strftime('%Y%m%d_%H%M%S')}_{trace['trace_id']}.json")
+    _write_atomically(path, json.dumps(trace, indent=2, ensure_ascii=False))
+    _prune_traces(trace_dir)
+    if metrics_file:
+        _write_metrics(metrics_file)
+    return path
+
+
+_metrics_paths = set()
+
+
+def _write_metrics(metrics_file):
+    pid = os.getpid()
+    path = metrics_file.replace("{pid}", str(pid))
+    _write_atomically(path, METRICS.to_prometheus([("processus", pid)]))
+    if "{pid}" in metrics_file and path not in _metrics_paths:
+        _metrics_paths.add(path)
+        atexit.register(_remove_quietly, path)
+        _prune_metrics(metrics_file)
+
+
+def _prune_metrics(metrics_file):
+    """Supprime les fichiers de métriques des processus qui ne sont plus en cours d'exécution."""
+    directory = os.path.dirname(metrics_file) or "."
+    prefix, suffix = os.path.basename(metrics_file).split("{pid}", 1)
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        pid = name[len(prefix):len(name) - len(suffix)] if name.startswith(prefix) and name.endswith(suffix) else ""
+        if pid.isdigit() and not _process_alive(int(pid)):
+            _remove_quietly(os.path.join(directory, name))
+
+
+def _process_alive(pid):
+    if os.name != "posix":
+        # os.kill ne sert pas à tester l'existence d'un processus sous Windows
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _prune_traces(trace_dir, max_files=TRACE_MAX_FILES):
+    """Supprime les traces les plus anciennes au-delà de `max_files` (les noms commencent par la date)."""
+    try:
+        traces = sorted(name for name in os.listdir(trace_dir) if name.startswith("trace_") and name.endswith(".json"))
+    except OSError:
+        return
+    for name in traces[:max(0, len(traces) - max_files)]:
+        _remove_quietly(os.path.join(trace_dir, name))
+
+
+@contextlib.contextmanager
+def dossier_trace(name, **attributes):
+    """Span racine d'un dossier, identifié par un trace_id unique."""
+    with span(name, kind="dossier", trace_id=uuid.uuid4().hex, **attributes) as root:
+        yield root
@@ -0,0 +1,313 @@
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+from cache import CACHE_DIR
+from instrumentation import METRICS
+from pipeline import load_dossier_files, process_dossier
+from spool import COPY_BLOCK_BYTES, spool_files
+
+# --- File de traitements en arrière-plan ---
+# Un dossier soumis devient un « job » : ses fichiers sont copiés sur disque et le job est
+# enregistré dans une base SQLite (mode WAL, partageable entre plusieurs processus Streamlit).
+# Des threads de traitement, en nombre borné, prennent les jobs en attente et enchaînent
+# Smart Intake, Enrichment Layer et Rule Engine (pipeline.process_dossier, sans interface).
+# L'état, l'étape en cours et le résultat (devis JSON) sont écrits dans la base : l'interface
+# interroge l'état du job, qui survit aux réexécutions du script et aux redémarrages.
+# Un job dont le traitement ne donne plus signe de vie (processus arrêté) est remis en attente.
+# Les jobs terminés sont supprimés après JOB_RETENTION_SECONDS, ainsi que les répertoires orphelins.
+
+JOBS_DIR = os.getenv("DOSSIER_JOBS_DIR", os.path.join(CACHE_DIR, "jobs"))
+JOBS_DB_PATH = os.getenv("DOSSIER_JOBS_DB", os.path.join(JOBS_DIR, "jobs.sqlite3"))
+# Nombre de dossiers traités simultanément par processus
+JOB_WORKERS = max(1, int(os.getenv("DOSSIER_JOB_WORKERS", "4")))
+# Intervalle de signal de vie des jobs en cours, et délai au-delà duquel un job sans signal est repris
+JOB_HEARTBEAT_SECONDS = float(os.getenv("DOSSIER_JOB_HEARTBEAT_SECONDS", "10"))
+JOB_STALE_SECONDS = float(os.getenv("DOSSIER_JOB_STALE_SECONDS", "60"))
+# Nombre maximal de reprises d'un job interrompu avant de le déclarer en échec
+JOB_MAX_ATTEMPTS = int(os.getenv("DOSSIER_JOB_MAX_ATTEMPTS", "3"))
+# Durée de conservation des jobs terminés (ou en échec) et de leur résultat
+JOB_RETENTION_SECONDS = float(os.getenv("DOSSIER_JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+# Attente des threads de traitement quand la file est vide
+JOB_POLL_SECONDS = 1.0
+
+PENDING = "en_attente"
+RUNNING = "en_cours"
+DONE = "termine"
+FAILED = "echec"
+
+STAGES = ["smart_intake", "enrichment_layer", "rule_engine"]
+
+# Séparateur entre le numéro d'ordre et le nom d'origine des fichiers enregistrés d'un job
+STORED_NAME_SEPARATOR = "_"
+
+logger = logging.getLogger(__name__)
+
+
+class JobStore:
+    """
+    Base SQLite des jobs. Les fichiers d'un job sont conservés dans `directory/<id>/`
+    jusqu'à la fin de son traitement.
+    """
+
+    def __init__(self, path=JOBS_DB_PATH, directory=JOBS_DIR):
+        self.path = path
+        self.directory = directory
+        self._local = threading.local()
+        os.makedirs(directory, exist_ok=True)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection().execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                nom TEXT NOT NULL,
+                statut TEXT NOT NULL,
+                etape TEXT,
+                tentatives INTEGER NOT NULL DEFAULT 0,
+                proprietaire TEXT,
+                signal_de_vie REAL,
+                cree_le REAL NOT NULL,
+                debut REAL,
+                fin REAL,
+                resultat TEXT,
+                erreur TEXT
+            )
+            """
+        )
+        self._connection().execute("CREATE INDEX IF NOT EXISTS idx_jobs_statut ON jobs(statut, cree_le)")
+
+    def _connection(self):
+        # Une connexion par thread : les connexions SQLite ne doivent pas être partagées entre threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def files_dir(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def submit(self, uploaded_files, name="dossier"):
+        """Enregistre un dossier (fichiers chargés ou IntakeFile) et retourne l'identifiant du job."""
+        job_id = uuid.uuid4().hex
+        files_dir = self.files_dir(job_id)
+        os.makedirs(files_dir)
+        for index, uploaded_file in enumerate(spool_files(uploaded_files)):
+            # Seul le nom de base est conservé : un nom de fichier ne doit pas sortir du répertoire du job ;
+            # le préfixe évite qu'un fichier en remplace un autre de même nom et conserve l'ordre de chargement
+            stored_name = f"{index:04d}{STORED_NAME_SEPARATOR}{os.path.basename(uploaded_file.name)}"
+            with uploaded_file.open() as source, open(os.path.join(files_dir, stored_name), "wb") as f:
+                shutil.copyfileobj(source, f, COPY_BLOCK_BYTES)
+        self._connection().execute(
+            "INSERT INTO jobs (id, nom, statut, cree_le) VALUES (?, ?, ?, ?)", (job_id, name, PENDING, time.time())
+        )
+        METRICS.inc("souscription_jobs_total", {"evenement": "soumis"})
+        return job_id
+
+    def get(self, job_id):
+        """État d'un job (dictionnaire, avec le résultat décodé), ou None s'il est inconnu."""
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["resultat"] = json.loads(job["resultat"]) if job["resultat"] else None
+        if job["statut"] == PENDING:
+            job["position"] = self._connection().execute(
+                "SELECT COUNT(*) FROM jobs WHERE statut = ? AND cree_le <= ?", (PENDING, job["cree_le"])
+            ).fetchone()[0]
+        return job
+
+    def claim(self, owner):
+        """Attribue à `owner` le plus ancien job en attente et retourne son identifiant (None si la file est vide)."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE statut = ? ORDER BY cree_le LIMIT 1", (PENDING,)
+            ).fetchone()
+            if row is not None:
+                now = time.time()
+                conn.execute(
+                    "UPDATE jobs SET statut = ?, etape = NULL, tentatives = tentatives + 1, proprietaire = ?, "
+                    "signal_de_vie = ?, debut = ? WHERE id = ?",
+                    (RUNNING, owner, now, now, row["id"]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return row["id"] if row is not None else None
+
+    def set_stage(self, job_id, owner, stage):
+        """Enregistre l'étape en cours d'un job de `owner` ; sans effet si le job a été repris par un autre traitement."""
+        self._connection().execute(
+            "UPDATE jobs SET etape = ?, signal_de_vie = ? WHERE id = ? AND proprietaire = ? AND statut = ?",
+            (stage, time.time(), job_id, owner, RUNNING),
+        )
+
+    def heartbeat(self, owner):
+        """Signal de vie de tous les jobs en cours de `owner`."""
+        self._connection().execute(
+            "UPDATE jobs SET signal_de_vie = ? WHERE proprietaire = ? AND statut = ?", (time.time(), owner, RUNNING)
+        )
+
+    def finish(self, job_id, owner, result=None, error=None):
+        """
+        Termine un job de `owner` (résultat du pipeline ou message d'erreur) et supprime ses fichiers.
+        Retourne False, sans rien modifier, si le job a entre-temps été repris par un autre traitement.
+        """
+        cursor = self._connection().execute(
+            "UPDATE jobs SET statut = ?, fin = ?, resultat = ?, erreur = ? WHERE id = ? AND proprietaire = ? AND statut = ?",
+            (
+                FAILED if error is not None else DONE,
+                time.time(),
+                json.dumps(result, ensure_ascii=False) if result is not None else None,
+                error,
+                job_id,
+                owner,
+                RUNNING,
+            ),
+        )
+        if cursor.rowcount == 0:
+            logger.warning("Job %s repris par un autre traitement : résultat de %s ignoré", job_id, owner)
+            return False
+        shutil.rmtree(self.files_dir(job_id), ignore_errors=True)
+        METRICS.inc("souscription_jobs_total", {"evenement": "echec" if error is not None else "termine"})
+        return True
+
+    def recover_stale(self):
+        """
+        Remet en attente les jobs en cours sans signal de vie récent (processus arrêté pendant le traitement) ;
+        au-delà de JOB_MAX_ATTEMPTS tentatives, le job est déclaré en échec. Retourne le nombre de jobs repris.
+        """
+        limit = time.time() - JOB_STALE_SECONDS
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            stale = conn.execute(
+                "SELECT id, tentatives FROM jobs WHERE statut = ? AND signal_de_vie < ?", (RUNNING, limit)
+            ).fetchall()
+            failed = []
+            for row in stale:
+                if row["tentatives"] >= JOB_MAX_ATTEMPTS:
+                    conn.execute(
+                        "UPDATE jobs SET statut = ?, fin = ?, erreur = ? WHERE id = ?",
+                        (FAILED, time.time(), "Traitement interrompu à plusieurs reprises.", row["id"]),
+                    )
+                    failed.append(row["id"])
+                else:
+                    conn.execute("UPDATE jobs SET statut = ?, proprietaire = NULL WHERE id = ?", (PENDING, row["id"]))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        for job_id in failed:
+            shutil.rmtree(self.files_dir(job_id), ignore_errors=True)
+            METRICS.inc("souscription_jobs_total", {"evenement": "echec"})
+        if stale:
+            logger.warning("%d job(s) interrompu(s) repris", len(stale))
+        return len(stale)
+
+    def purge_expired(self):
+        """
+        Supprime les jobs terminés ou en échec depuis plus de JOB_RETENTION_SECONDS, et les répertoires de
+        fichiers qui ne correspondent à aucun job à traiter (processus arrêté avant la fin d'une soumission
+        ou d'une suppression). Retourne le nombre de jobs supprimés.
+        """
+        now = time.time()
+        cursor = self._connection().execute(
+            "DELETE FROM jobs WHERE statut IN (?, ?) AND fin < ?", (DONE, FAILED, now - JOB_RETENTION_SECONDS)
+        )
+        active = {row["id"] for row in self._connection().execute(
+            "SELECT id FROM jobs WHERE statut IN (?, ?)", (PENDING, RUNNING)
+        )}
+        for entry in os.scandir(self.directory):
+            # Un répertoire récent peut appartenir à une soumission en cours, pas encore enregistrée dans la base
+            try:
+                orphan = entry.is_dir() and entry.name not in active and entry.stat().st_mtime < now - JOB_STALE_SECONDS
+            except OSError:
+                continue
+            if orphan:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        return cursor.rowcount
+
+
+class JobRunner:
+    """
+    Threads de traitement des jobs d'un processus (au plus `workers` dossiers simultanés).
+    Les clients LLM sont partagés par tous les threads.
+    """
+
+    def __init__(self, store, openai_client, perplexity_client, workers=JOB_WORKERS):
+        self.store = store
+        self.openai_client = openai_client
+        self.perplexity_client = perplexity_client
+        self.workers = workers
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Démarre les threads de traitement et le thread de signal de vie."""
+        self.store.recover_stale()
+        self.store.purge_expired()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._keep_alive, name="job-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        """Arrête les threads après le job en cours."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _keep_alive(self):
+        while not self._stop.wait(JOB_HEARTBEAT_SECONDS):
+            try:
+                self.store.heartbeat(self.owner)
+                self.store.recover_stale()
+                self.store.purge_expired()
+            except sqlite3.Error as e:
+                logger.warning("Signal de vie des jobs impossible : %s", e)
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job_id = self.store.claim(self.owner)
+            except sqlite3.Error as e:
+                logger.warning("Lecture de la file des jobs impossible : %s", e)
+                job_id = None
+            if job_id is None:
+                self._stop.wait(JOB_POLL_SECONDS)
+                continue
+            self.run_job(job_id)
+
+    def run_job(self, job_id):
+        """Traite un job attribué à ce processus et enregistre son résultat."""
+        try:
+            files = load_dossier_files(self.store.files_dir(job_id))
+            for f in files:
+                f.name = f.name.split(STORED_NAME_SEPARATOR, 1)[1]
+            result = process_dossier(
+                files, self.openai_client, self.perplexity_client,
+                progress=lambda stage: self.store.set_stage(job_id, self.owner, stage), name=f"job_{job_id}",
+            )
+            result["fichiers"] = [f.name for f in files]
+            self.store.finish(job_id, self.owner, result=result)
+        except Exception as e:
+            logger.exception("Échec du job %s", job_id)
+            self.store.finish(job_id, self.owner, error=str(e))
@@ -0,0 +1,143 @@
+import json
+import re
+
+# --- Analyse incrémentale d'un objet JSON reçu par fragments ---
+# Les réponses du LLM en mode flux arrivent token par token. L'analyseur suit la structure de
+# l'objet (profondeur, chaînes, clés de premier niveau) et signale chaque valeur dès qu'elle est
+# complète, sans attendre la fin de la réponse :
+# - ("champ", clé, valeur) pour chaque clé de premier niveau ;
+# - ("element", clé, valeur) pour chaque élément des tableaux diffusés (par exemple liste_vehicules).
+# Le texte déjà analysé est oublié au fur et à mesure : la mémoire ne dépend pas de la taille de la réponse.
+
+_STRUCTURE_RE = re.compile(r'["{}\[\],:]')
+_STRING_RE = re.compile(r'["\\]')
+
+
+class IncrementalJsonParser:
+    """Analyseur incrémental d'un objet JSON ; `stream_arrays` liste les clés dont les tableaux sont diffusés élément par élément."""
+
+    def __init__(self, stream_arrays=()):
+        self.stream_arrays = set(stream_arrays)
+        self.result = {}
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._expect_key = False
+        self._key = None
+        self._key_start = None
+        self._value_start = None  # début de la valeur de premier niveau en cours
+        self._items = None        # éléments du tableau diffusé en cours
+        self._item_start = None
+        self._done = False
+
+    def feed(self, fragment):
+        """Ajoute un fragment de texte et retourne la liste des événements produits."""
+        events = []
+        self._text += fragment
+        text = self._text
+        pos = self._pos
+        while True:
+            if self._in_string:
+                match = _STRING_RE.search(text, pos)
+                if match is None:
+                    pos = len(text)
+                    break
+                if match.group() == "\\":
+                    if match.end() >= len(text):
+                        # Le caractère échappé n'est pas encore arrivé
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                self._in_string = False
+                pos = match.end()
+                if self._key_start is not None:
+                    self._key = json.loads(text[self._key_start:pos])
+                    self._key_start = None
+                continue
+
+            match = _STRUCTURE_RE.search(text, pos)
+            if match is None:
+                pos = len(text)
+                break
+            char, index, pos = match.group(), match.start(), match.end()
+
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect_key:
+                    self._key_start = index
+                    self._expect_key = False
+            elif char in "{[":
+                if self._depth == 0:
+                    if char != "{":
+                        raise ValueError("La réponse n'est pas un objet JSON.")
+                    self._expect_key = True
+                elif (self._depth == 1 and char == "[" and self._key in self.stream_arrays
+                        and not text[self._value_start:index].strip()):
+                    self._value_start = None
+                    self._items = []
+                    self._item_start = pos
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 2 and self._items is not None and self._item_start is not None:
+                    self._end_item(text, index, events)
+                    self._item_start = None
+                elif self._depth == 1:
+                    self._end_value(text, index, events)
+                    self._done = True
+                self._depth -= 1
+            elif char == ",":
+                if self._depth == 1:
+                    self._end_value(text, index, events)
+                    self._expect_key = True
+                elif self._depth == 2 and self._items is not None:
+                    self._end_item(text, index, events)
+                    self._item_start = pos
+            elif char == ":" and self._depth == 1:
+                self._value_start = pos
+
+        self._pos = pos
+        self._trim()
+        return events
+
+    def _end_item(self, text, end, events):
+        item_text = text[self._item_start:end].strip()
+        if item_text:
+            item = json.loads(item_text)
+            self._items.append(item)
+            events.append(("element", self._key, item))
+
+    def _end_value(self, text, end, events):
+        if self._items is not None:
+            value, self._items = self._items, None
+        elif self._value_start is not None:
+            value_text = text[self._value_start:end].strip()
+            if not value_text:
+                return
+            value = json.loads(value_text)
+        else:
+            return
+        self._value_start = None
+        self.result[self._key] = value
+        events.append(("champ", self._key, value))
+
+    def _trim(self):
+        # Oublie le texte déjà analysé qui n'appartient à aucune valeur en cours
+        pending = [start for start in (self._key_start, self._value_start, self._item_start) if start is not None]
+        cut = min(pending + [self._pos])
+        if cut:
+            self._text = self._text[cut:]
+            self._pos -= cut
+            if self._key_start is not None:
+                self._key_start -= cut
+            if self._value_start is not None:
+                self._value_start -= cut
+            if self._item_start is not None:
+                self._item_start -= cut
+
+    def close(self):
+        """Vérifie que l'objet est complet et le retourne ; lève une ValueError sinon."""
+        if not self._done:
+            raise ValueError("Réponse JSON incomplète.")
+        return self.result
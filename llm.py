@@ -0,0 +1,222 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import openai
+
+from chunking import count_tokens
+from instrumentation import METRICS, record_llm_usage, span
+
+# --- Appels aux modèles de langage ---
+# Point de passage unique des appels chat.completions (OpenAI et Perplexity) : chaque appel est
+# mesuré dans un span "llm" avec sa durée, ses tokens et son coût estimé.
+# Les appels d'un même fournisseur partagent un limiteur de débit (requêtes et tokens par minute),
+# commun à tous les threads du processus, et les erreurs transitoires (429, 5xx, coupure réseau)
+# sont retentées avec un délai exponentiel aléatoire.
+
+# Limites par fournisseur : (requêtes par minute, tokens par minute), 0 = pas de limite
+RATE_LIMITS = {
+    "openai": (int(os.getenv("OPENAI_RPM", "500")), int(os.getenv("OPENAI_TPM", "450000"))),
+    "perplexity": (int(os.getenv("PERPLEXITY_RPM", "50")), int(os.getenv("PERPLEXITY_TPM", "0"))),
+}
+
+# Tokens de réponse comptés à l'avance quand l'appel ne fixe pas max_tokens (corrigés après la réponse)
+DEFAULT_COMPLETION_TOKENS = int(os.getenv("LLM_DEFAULT_COMPLETION_TOKENS", "1000"))
+
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "1"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "30"))
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+class TokenBucket:
+    """Seau à jetons : `rate_per_minute` jetons disponibles par minute, avec une réserve d'une minute."""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount):
+        """Attend que `amount` jetons soient disponibles puis les consomme ; retourne le temps d'attente."""
+        waited = 0.0
+        # Une demande plus grande que la réserve passe dès que la réserve est pleine (le solde devient négatif)
+        needed = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= needed:
+                    self.tokens -= amount
+                    return waited
+                delay = (needed - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def adjust(self, amount):
+        """Consomme (amount > 0) ou restitue (amount < 0) des jetons sans attendre."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class RateLimiter:
+    """Limiteur de débit d'un fournisseur : requêtes et tokens par minute."""
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+
+    def acquire(self, estimated_tokens):
+        waited = 0.0
+        if self.requests is not None:
+            waited += self.requests.acquire(1)
+        if self.tokens is not None:
+            waited += self.tokens.acquire(estimated_tokens)
+        return waited
+
+    def settle(self, estimated_tokens, actual_tokens):
+        """Corrige le décompte des tokens une fois la consommation réelle connue (None : inconnue)."""
+        if self.tokens is not None and actual_tokens is not None:
+            self.tokens.adjust(actual_tokens - estimated_tokens)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def scale_rate_limits(factor):
+    """
+    Applique `factor` aux limites de débit du processus, par exemple 1/N quand N processus
+    se partagent le quota d'une même clé API.
+    """
+    with _limiters_lock:
+        _limiters.clear()
+        for provider, (rpm, tpm) in RATE_LIMITS.items():
+            _limiters[provider] = RateLimiter(max(1, int(rpm * factor)) if rpm else 0, max(1, int(tpm * factor)) if tpm else 0)
+
+
+def provider_of(client):
+    """Fournisseur d'un client OpenAI, déduit de son URL de base."""
+    host = urlparse(str(getattr(client, "base_url", ""))).hostname or ""
+    return "perplexity" if "perplexity" in host else "openai"
+
+
+def get_limiter(provider):
+    with _limiters_lock:
+        if provider not in _limiters:
+            _limiters[provider] = RateLimiter(*RATE_LIMITS.get(provider, (0, 0)))
+        return _limiters[provider]
+
+
+def estimate_tokens(kwargs):
+    """Estimation des tokens d'un appel (prompt et réponse), comptés avant l'envoi de la requête."""
+    prompt = "".join(str(message.get("content", "")) for message in kwargs.get("messages", []))
+    return count_tokens(prompt) + (kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+
+
+def is_retryable(error):
+    """Erreurs transitoires : coupure réseau, délai dépassé, 408/409/429 et erreurs serveur."""
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        # Un quota épuisé (facturation) ne se rétablit pas en quelques secondes
+        if getattr(error, "code", None) == "insufficient_quota":
+            return False
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+def retry_delay(attempt, error):
+    """Délai avant la tentative suivante : en-tête Retry-After s'il existe, sinon exponentiel aléatoire."""
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            retry_after = float(response.headers.get("retry-after", ""))
+            if 0 <= retry_after <= LLM_RETRY_MAX_SECONDS:
+                return retry_after
+        except ValueError:
+            pass
+    return random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+def _create(client, limiter, estimated_tokens, kwargs):
+    """Envoie la requête dans la limite de débit, en retentant les erreurs transitoires ; retourne (réponse, tentatives, attente)."""
+    model = kwargs.get("model")
+    waited = 0.0
+    attempt = 0
+    while True:
+        waited += limiter.acquire(estimated_tokens)
+        try:
+            return client.chat.completions.create(**kwargs), attempt, waited
+        except Exception as e:
+            # La requête refusée n'a pas consommé de tokens
+            limiter.settle(estimated_tokens, 0)
+            if attempt >= LLM_MAX_RETRIES or not is_retryable(e):
+                raise
+            METRICS.inc("souscription_llm_erreurs_transitoires_total", {"modele": model, "erreur": type(e).__name__})
+            delay = retry_delay(attempt, e)
+            attempt += 1
+            time.sleep(delay)
+            waited += delay
+
+
+def chat_completion(client, operation, **kwargs):
+    """
+    Appelle `client.chat.completions.create(**kwargs)` en instrumentant l'appel sous le nom `operation`,
+    dans la limite de débit du fournisseur et en retentant les erreurs transitoires.
+    """
+    model = kwargs.get("model")
+    provider = provider_of(client)
+    limiter = get_limiter(provider)
+    estimated_tokens = estimate_tokens(kwargs)
+    with span(operation, kind="llm", modele=model, fournisseur=provider) as current:
+        response, attempt, waited = _create(client, limiter, estimated_tokens, kwargs)
+        usage = getattr(response, "usage", None)
+        limiter.settle(estimated_tokens, getattr(usage, "total_tokens", None))
+        current.set(attente_secondes=round(waited, 3))
+        record_llm_usage(model, response, retries=attempt)
+        return response
+
+
+def chat_completion_stream(client, operation, on_delta, **kwargs):
+    """
+    Variante en flux de chat_completion : `on_delta(texte)` est appelé pour chaque fragment de la réponse
+    dès sa réception. Retourne le texte complet. Seul l'envoi de la requête est retenté : une erreur
+    survenue pendant la réception est propagée.
+    """
+    model = kwargs.get("model")
+    provider = provider_of(client)
+    limiter = get_limiter(provider)
+    estimated_tokens = estimate_tokens(kwargs)
+    kwargs = dict(kwargs, stream=True, stream_options={"include_usage": True})
+    with span(operation, kind="llm", modele=model, fournisseur=provider, flux=True) as current:
+        # Délai jusqu'au premier fragment mesuré depuis l'envoi : la réponse en flux n'est renvoyée
+        # qu'une fois la requête acceptée, l'attente de la limite de débit est incluse (voir attente_secondes)
+        start = time.perf_counter()
+        stream, attempt, waited = _create(client, limiter, estimated_tokens, kwargs)
+        parts = []
+        last_chunk = None
+        for chunk in stream:
+            last_chunk = chunk
+            for choice in chunk.choices:
+                delta = choice.delta.content
+                if delta:
+                    if not parts:
+                        current.set(premier_fragment_secondes=round(time.perf_counter() - start, 3))
+                    parts.append(delta)
+                    on_delta(delta)
+        usage = getattr(last_chunk, "usage", None)
+        limiter.settle(estimated_tokens, getattr(usage, "total_tokens", None))
+        current.set(attente_secondes=round(waited, 3))
+        record_llm_usage(model, last_chunk, retries=attempt)
+        return "".join(parts)
@@ -0,0 +1,840 @@
+import collections
+import importlib.util
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from openai import OpenAI, AuthenticationError
+
+from cache import get_cache, make_key, normalize_key_component
+from classifier import classify_document, decide
+from chunking import CHARS_PER_TOKEN, merge_key_information, merge_vehicle_lists, split_into_chunks, truncate_to_tokens
+from extraction import EXTENSION_MIME_TYPES, PDF_MIME, XLSX_MIME, PdfTextSource, extract_text, iter_text
+from fleet import extract_fleet
+from instrumentation import METRICS, bind_context, dossier_trace, export_trace, record_cache_lookup, span, traced
+from jsonstream import IncrementalJsonParser
+from llm import chat_completion, chat_completion_stream
+from rules import evaluate_dossier
+from spool import IntakeFile, iter_text_lines, read_text_head, spool_files, spool_text, stored_text
+from tables import COMMON_VALUES_PREFIX, SHEET_END, SHEET_START, summarize_tables
+
+# --- Pipeline de traitement d'un dossier ---
+# Les trois étapes (Smart Intake, Enrichment Layer, Rule Engine) sont implémentées ici sans aucune
+# dépendance à Streamlit, afin d'être utilisées aussi bien par l'interface (app.py) que par le
+# traitement par lots (batch.py). Les problèmes non bloquants sont remontés sous forme de
+# couples (niveau, message) ; les échecs bloquants lèvent une PipelineError.
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration & Constantes ---
+
+REQUIRED_DOCS_LIST = [
+    "Formulaire de demande / questionnaire dûment rempli",
+    "Liste détaillée des véhicules de la flotte (Excel ou structuré)",
+    "Historique de sinistralité sur les 3 à 5 dernières années",
+    "Relevé d'informations / Attestation du précédent assureur",
+    "Extrait Kbis récent de l'entreprise",
+    "RIB de l'entreprise",
+    "Conditions particulières souhaitées",
+    "Document non identifiable"
+]
+
+# Nombre maximal de fichiers analysés en parallèle par l'agent Smart Intake (1 = analyse séquentielle)
+INTAKE_MAX_WORKERS = max(1, int(os.getenv("INTAKE_MAX_WORKERS", "8")))
+
+# Versions utilisées dans les clés du cache disque : à incrémenter dès que l'extraction
+# de texte ou le prompt d'identification changent, afin d'invalider les anciens résultats.
+EXTRACTION_VERSION = "3"
+IDENTIFICATION_MODEL = "gpt-4o"
+IDENTIFICATION_PROMPT_VERSION = "2"
+# Nombre de tokens du début de chaque fichier utilisés pour l'identification (les tableaux y sont
+# résumés : en-têtes, valeurs communes et premières lignes). Pour les PDF, seules les pages
+# nécessaires sont lues ; le texte complet n'est extrait que pour l'extraction des informations clés
+# (voir complete_texts).
+IDENTIFICATION_SNIPPET_TOKENS = 2000
+# Mémoire totale des PDF ouverts pendant l'identification conservés entre les étapes (contenu et texte des pages lues)
+PDF_SOURCES_MAX_BYTES = int(os.getenv("PDF_SOURCES_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Extraction des informations clés : taille maximale (en tokens) de chaque extrait du dossier
+# et nombre d'extraits analysés en parallèle
+KEY_INFO_CHUNK_TOKENS = int(os.getenv("KEY_INFO_CHUNK_TOKENS", "3000"))
+KEY_INFO_MAX_WORKERS = max(1, int(os.getenv("KEY_INFO_MAX_WORKERS", "8")))
+# Tableaux de la réponse diffusés élément par élément en mode flux
+STREAMED_KEY_INFO_ARRAYS = ("liste_vehicules", "garanties_souhaitees")
+# Mention remplaçant, dans le texte transmis au LLM, un tableau de véhicules lu directement (fleet.py)
+FLEET_TABLE_NOTE = "[Tableau des véhicules lu automatiquement : {} véhicule(s), non reproduit ici]"
+
+# Enrichissement : les résultats ne dépendent que du secteur, de la région et du type de flotte,
+# ils sont donc mis en cache (recherches brutes et extraction structurée) pour une durée limitée.
+ENRICHMENT_SEARCH_MODEL = "llama-3.1-sonar-small-128k-online"
+ENRICHMENT_EXTRACTION_MODEL = "gpt-4o-mini"
+ENRICHMENT_PROMPT_VERSION = "1"
+ENRICHMENT_CACHE_TTL_SECONDS = int(os.getenv("ENRICHMENT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+PERPLEXITY_BASE_URL = "https://api.perplexity.ai"
+
+# Client http partagé par les clients OpenAI et Perplexity : connexions persistantes (keep-alive),
+# HTTP/2 si le paquet h2 est installé. Les nouvelles tentatives sont gérées par llm.chat_completion.
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "60"))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "120"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "1") != "0" and importlib.util.find_spec("h2") is not None
+
+# Clés de l'enrichissement ajoutées aux données du dossier
+ENRICHMENT_KEYS = [
+    "Taux de sinistralité du secteur",
+    "Analyse du risque géographique",
+    "Info sur le score télématique"
+]
+
+
+class PipelineError(Exception):
+    """Échec bloquant d'une étape du pipeline ; le message est destiné à l'utilisateur."""
+
+
+class LocalFile(IntakeFile):
+    """Fichier du disque exposant la même interface que les fichiers chargés dans Streamlit ; il est lu à la demande."""
+
+    def __init__(self, path):
+        super().__init__(
+            os.path.basename(path), EXTENSION_MIME_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream"), path=path
+        )
+
+
+def load_dossier_files(directory):
+    """Retourne les fichiers pris en charge d'un répertoire de dossier, triés par nom."""
+    return [
+        LocalFile(os.path.join(directory, name))
+        for name in sorted(os.listdir(directory))
+        if os.path.splitext(name)[1].lower() in EXTENSION_MIME_TYPES and os.path.isfile(os.path.join(directory, name))
+    ]
+
+
+# --- Clients ---
+
+def create_clients(openai_api_key, perplexity_api_key, http_client=None, openai_base_url=None, perplexity_base_url=PERPLEXITY_BASE_URL):
+    """
+    Crée les clients OpenAI et Perplexity, partageant un client http qui ignore les proxys de l'environnement.
+    Les clients sont prévus pour être créés une fois par processus et partagés entre les threads.
+    Un client http (par exemple avec un transport de test) et des URL de base peuvent être fournis.
+    """
+    if http_client is None:
+        http_client = httpx.Client(
+            proxies={},
+            http2=HTTP2_ENABLED,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            timeout=httpx.Timeout(HTTP_TIMEOUT_SECONDS, connect=10.0),
+        )
+    openai_client = OpenAI(api_key=str(openai_api_key), base_url=openai_base_url, http_client=http_client, max_retries=0)
+    perplexity_client = OpenAI(api_key=str(perplexity_api_key), base_url=perplexity_base_url, http_client=http_client, max_retries=0)
+    return openai_client, perplexity_client
+
+
+# --- Exécution concurrente ---
+
+def run_in_threads(func, items, max_workers, initializer=None):
+    """
+    Applique `func` à chaque élément sur un pool de threads borné à `max_workers`.
+    Les résultats sont renvoyés dans l'ordre des éléments, quel que soit l'ordre de fin.
+    """
+    workers = max(1, min(max_workers, len(items)))
+    # Chaque tâche hérite du span courant, pour que ses mesures soient rattachées à la bonne trace
+    tasks = [bind_context(func) for _ in items]
+    with ThreadPoolExecutor(max_workers=workers, initializer=initializer) as executor:
+        return list(executor.map(lambda task, item: task(item), tasks, items))
+
+
+# --- Fonctions d'Extraction de Texte ---
+
+def extract_text_from_file(uploaded_file):
+    """Extrait le texte de différents types de fichiers, en gérant les onglets multiples pour Excel. Les erreurs sont propagées."""
+    with span("extraction_texte", kind="extraction", type_mime=uploaded_file.type):
+        return extract_text(uploaded_file.content, uploaded_file.type)
+
+
+_pdf_sources = collections.OrderedDict()
+_pdf_sources_lock = threading.Lock()
+
+
+def get_pdf_source(file_hash, data):
+    """
+    PdfTextSource d'un document (`data` : octets ou chemin), mémorisé par empreinte ; au-delà de
+    PDF_SOURCES_MAX_BYTES, les plus anciens sont fermés et oubliés.
+    """
+    with _pdf_sources_lock:
+        source = _pdf_sources.get(file_hash)
+        if source is not None:
+            _pdf_sources.move_to_end(file_hash)
+            return source
+    source = PdfTextSource(data)
+    evicted = []
+    with _pdf_sources_lock:
+        _pdf_sources[file_hash] = source
+        total = sum(s.memory_bytes for s in _pdf_sources.values())
+        # Le document demandé est conservé même s'il dépasse à lui seul le budget
+        while total > PDF_SOURCES_MAX_BYTES and len(_pdf_sources) > 1:
+            _, oldest = _pdf_sources.popitem(last=False)
+            total -= oldest.memory_bytes
+            evicted.append(oldest)
+    for oldest in evicted:
+        oldest.close()
+    return source
+
+
+def forget_pdf_source(file_hash):
+    """Ferme et oublie un PDF dont le texte n'est plus nécessaire (texte complet enregistré, dossier terminé)."""
+    with _pdf_sources_lock:
+        source = _pdf_sources.pop(file_hash, None)
+    if source is not None:
+        source.close()
+
+
+def load_stored_text(analysis, text_key):
+    """
+    Renseigne le texte d'une analyse depuis le cache (texte court) ou le disque (texte volumineux :
+    seul son début est chargé). Retourne False si le texte n'a pas encore été extrait.
+    """
+    content = get_cache().get(text_key)
+    text_file = stored_text(text_key) if content is None else None
+    record_cache_lookup("texte", content is not None or text_file is not None)
+    if content is None and text_file is None:
+        return False
+    analysis["texte"] = read_text_head(text_file) if text_file is not None else content
+    analysis["fichier_texte"] = text_file
+    analysis["texte_complet"] = True
+    return True
+
+
+def store_text(analysis, uploaded_file, text_key, fragments):
+    """
+    Renseigne le texte d'une analyse à partir des fragments extraits (None : type non pris en charge).
+    Un texte volumineux est écrit sur disque au fil de l'extraction ; l'analyse n'en garde que le début,
+    et le chemin du texte complet ("fichier_texte"). Les erreurs de lecture sont propagées.
+    """
+    if fragments is None:
+        return
+    with span("extraction_texte", kind="extraction", type_mime=uploaded_file.type, complet=True):
+        content, text_file = spool_text(text_key, fragments)
+    if text_file is None:
+        get_cache().set(text_key, content)
+    analysis["texte"] = content
+    analysis["fichier_texte"] = text_file
+    analysis["texte_complet"] = True
+
+
+def complete_texts(analyses, uploaded_files, problems):
+    """
+    Complète le texte des fichiers dont seul le début a été lu pour l'identification (PDF), ou dont le
+    texte enregistré sur disque a disparu, en parallèle ; à appeler avant iter_dossier_lines.
+    Les échecs sont ajoutés à `problems`.
+    """
+    files_by_hash = {f.hash: f for f in spool_files(uploaded_files)}
+    partial = [
+        a for a in analyses
+        if a["texte"] is not None and (not a.get("texte_complet", True) or (a.get("fichier_texte") and not os.path.exists(a["fichier_texte"])))
+    ]
+
+    def complete(analysis):
+        uploaded_file = files_by_hash.get(analysis["empreinte"])
+        if uploaded_file is None:
+            analysis["fichier_texte"] = None
+            problems.append(("warning", f"Le fichier '{analysis['nom']}' n'est plus disponible : seul le début de son texte est utilisé."))
+            return
+        text_key = make_key("texte", analysis["empreinte"], EXTRACTION_VERSION)
+        try:
+            if not load_stored_text(analysis, text_key):
+                if uploaded_file.type == PDF_MIME:
+                    fragments = get_pdf_source(analysis["empreinte"], uploaded_file.content).iter_text()
+                else:
+                    fragments = iter_text(uploaded_file.content, uploaded_file.type)
+                store_text(analysis, uploaded_file, text_key, fragments)
+        except Exception as e:
+            problems.append(("warning", f"Impossible de lire entièrement le fichier '{analysis['nom']}': {e}"))
+        # Le texte des pages n'est plus nécessaire : il est dans l'analyse ou sur disque
+        forget_pdf_source(analysis["empreinte"])
+
+    run_in_threads(complete, partial, INTAKE_MAX_WORKERS)
+    return analyses
+
+
+# --- Agent Smart Intake ---
+
+def identify_documents_in_content_with_llm(filename, content_snippet, client):
+    """Utilise l'IA pour identifier un ou plusieurs documents à partir du contenu d'un fichier. Les erreurs sont propagées."""
+
+    prompt = f"""
+    Vous êtes un assistant expert en souscription d'assurance flotte automobile.
+    Votre tâche est d'analyser le contenu d'un fichier pour déterminer quels documents requis il contient. Un seul fichier peut contenir plusieurs types de documents (par exemple, un fichier Excel avec plusieurs onglets).
+
+    Voici la liste des types de documents possibles que nous recherchons :
+    <document_types>
+    {json.dumps(REQUIRED_DOCS_LIST, indent=2, ensure_ascii=False)}
+    </document_types>
+
+    Voici le nom du fichier et son contenu (qui peut contenir plusieurs sections/onglets) :
+    <filename>{filename}</filename>
+    <content>
+    {truncate_to_tokens(content_snippet, IDENTIFICATION_SNIPPET_TOKENS)}
+    </content>
+
+    Analysez le contenu et déterminez TOUS les types de documents de la liste ci-dessus qui sont présents dans ce fichier.
+
+    Retournez votre réponse exclusivement au format JSON, avec une seule clé "documents_identifies". La valeur de cette clé doit être une LISTE de chaînes de caractères correspondant aux types de documents trouvés.
+    Si le fichier contient une liste de véhicules ET un historique de sinistres, la liste doit contenir ces deux éléments.
+    Si le fichier ne correspond à aucun type de document ou est illisible, retournez une liste vide.
+
+    Exemple de réponse pour un fichier Excel contenant des véhicules et des sinistres:
+    {{
+      "documents_identifies": [
+        "Liste détaillée des véhicules de la flotte (Excel ou structuré)",
+        "Historique de sinistralité sur les 3 à 5 dernières années"
+      ]
+    }}
+
+    Exemple si le document est incompréhensible:
+    {{
+      "documents_identifies": []
+    }}
+    """
+    response = chat_completion(
+        client,
+        "identification_documents",
+        model=IDENTIFICATION_MODEL, # Utilisation d'un modèle plus puissant pour cette tâche complexe
+        messages=[
+            {"role": "system", "content": "Vous êtes un expert en assurance qui identifie les documents contenus dans des fichiers."},
+            {"role": "user", "content": prompt}
+        ],
+        response_format={"type": "json_object"},
+        temperature=0.0,
+    )
+    result_json = response.choices[0].message.content
+    analysis_result = json.loads(result_json)
+    return analysis_result.get("documents_identifies", [])
+
+
+def analyze_file(uploaded_file, client):
+    """
+    Extrait le texte d'un fichier puis identifie les documents qu'il contient : par règles
+    (classifier.py) si le résultat est net, sinon par le LLM.
+    Le texte et l'identification par le LLM sont mis en cache sur disque, indexés par l'empreinte du contenu du fichier.
+    Ne lève jamais d'exception : une erreur sur un fichier ne doit pas interrompre l'analyse des autres.
+    """
+    with span("fichier", kind="fichier", nom=uploaded_file.name) as file_span:
+        analysis = _analyze_file(uploaded_file, client)
+        file_span.set(methode_identification=analysis["methode_identification"])
+        return analysis
+
+
+def _analyze_file(uploaded_file, client):
+    analysis = {
+        "nom": uploaded_file.name, "empreinte": None, "texte": None, "texte_complet": True, "fichier_texte": None,
+        "documents_identifies": [], "confiance": {}, "methode_identification": None, "problemes": [],
+    }
+    try:
+        cache = get_cache()
+        file_hash = uploaded_file.hash
+        analysis["empreinte"] = file_hash
+
+        text_key = make_key("texte", file_hash, EXTRACTION_VERSION)
+        try:
+            if not load_stored_text(analysis, text_key):
+                if uploaded_file.type == PDF_MIME:
+                    # Seul le début du PDF est lu ici ; le texte complet est extrait par complete_texts
+                    with span("extraction_texte", kind="extraction", type_mime=uploaded_file.type, complet=False):
+                        source = get_pdf_source(file_hash, uploaded_file.content)
+                        analysis["texte"] = source.head(IDENTIFICATION_SNIPPET_TOKENS * CHARS_PER_TOKEN)
+                    analysis["texte_complet"] = source.complete
+                    if source.complete:
+                        cache.set(text_key, analysis["texte"])
+                else:
+                    store_text(analysis, uploaded_file, text_key, iter_text(uploaded_file.content, uploaded_file.type))
+        except Exception as e:
+            analysis["problemes"].append(("warning", f"Impossible de lire le fichier '{uploaded_file.name}': {e}"))
+            return analysis
+        content = analysis["texte"]
+
+        if content is None or not content.strip():
+            return analysis
+
+        # Les tableaux sont résumés pour l'identification (en-têtes, valeurs communes, premières lignes)
+        identification_text = summarize_tables(content) if uploaded_file.type == XLSX_MIME else content
+
+        # Pré-classification par règles : le LLM n'est appelé que si le résultat est ambigu
+        scores = classify_document(uploaded_file.name, identification_text)
+        doc_types_found, ambiguous = decide(scores)
+        analysis["confiance"] = scores
+        if not ambiguous:
+            analysis["methode_identification"] = "regles"
+            analysis["documents_identifies"] = [doc for doc in doc_types_found if doc in REQUIRED_DOCS_LIST]
+            METRICS.inc("souscription_identification_total", {"methode": "regles"})
+            return analysis
+
+        analysis["methode_identification"] = "llm"
+        METRICS.inc("souscription_identification_total", {"methode": "llm"})
+        identification_key = make_key("identification", file_hash, IDENTIFICATION_MODEL, IDENTIFICATION_PROMPT_VERSION)
+        doc_types_found = cache.get(identification_key)
+        record_cache_lookup("identification", doc_types_found is not None)
+        if doc_types_found is None:
+            try:
+                doc_types_found = identify_documents_in_content_with_llm(uploaded_file.name, identification_text, client)
+            except Exception as e:
+                # Les échecs d'identification ne sont pas mis en cache
+                analysis["problemes"].append(("error", f"Erreur lors de l'identification du fichier {uploaded_file.name}: {e}"))
+                return analysis
+            cache.set(identification_key, doc_types_found)
+        analysis["documents_identifies"] = doc_types_found or []
+    except Exception as e:
+        analysis["problemes"].append(("error", f"Erreur lors de l'analyse du fichier {uploaded_file.name}: {e}"))
+    return analysis
+
+
+@traced("smart_intake.analyse_fichiers")
+def analyze_files(uploaded_files, client, max_workers=INTAKE_MAX_WORKERS):
+    """
+    Analyse les fichiers en parallèle (extraction + identification).
+    Les résultats sont renvoyés dans l'ordre des fichiers chargés, quel que soit l'ordre de fin.
+    """
+    uploaded_files = spool_files(uploaded_files)
+    return run_in_threads(lambda f: analyze_file(f, client), uploaded_files, max_workers)
+
+
+def check_completeness(analyses):
+    """Consolide les documents identifiés sur tous les fichiers ; retourne (documents fournis, documents manquants)."""
+    all_identified_doc_types = [doc for analysis in analyses for doc in analysis["documents_identifies"]]
+    present_docs = sorted(list(set(all_identified_doc_types)))
+    all_required = [doc for doc in REQUIRED_DOCS_LIST if doc != "Document non identifiable"]
+    missing_docs = sorted(list(set(all_required) - set(present_docs)))
+    return present_docs, missing_docs
+
+
+def iter_analysis_lines(analysis):
+    """Lignes du texte d'un fichier analysé (relues depuis le disque pour un texte volumineux)."""
+    if analysis.get("fichier_texte"):
+        return iter_text_lines(analysis["fichier_texte"])
+    return iter(analysis["texte"].splitlines())
+
+
+def _skip_tables(lines, skipped_sheets):
+    """Remplace le contenu des onglets `skipped_sheets` ({titre: nombre de véhicules}) par une mention."""
+    sheet_prefix = SHEET_START.split("{}")[0]
+    end_prefix = SHEET_END.split("{}")[0]
+    skipping = False
+    for line in lines:
+        if line.startswith(sheet_prefix):
+            title = line[len(sheet_prefix):].rsplit("' ---", 1)[0]
+            skipping = title in skipped_sheets
+            if skipping:
+                yield line
+                yield FLEET_TABLE_NOTE.format(skipped_sheets[title])
+                continue
+        elif line.startswith(end_prefix):
+            skipping = False
+        if not skipping:
+            yield line
+
+
+def iter_dossier_lines(analyses, skipped_tables=()):
+    """
+    Lignes du texte de tous les fichiers du dossier, chaque fichier étant précédé d'un marqueur.
+    Les textes enregistrés sur disque sont relus à la demande : le dossier n'est jamais assemblé en une seule chaîne.
+    Les tableaux de véhicules déjà extraits (`skipped_tables` : (fichier, onglet ou None, nombre de véhicules))
+    sont remplacés par une mention. Les textes partiels doivent avoir été complétés au préalable (complete_texts).
+    """
+    skipped = {}
+    for name, sheet, count in skipped_tables:
+        skipped.setdefault(name, {})[sheet] = count
+    first = True
+    for analysis in analyses:
+        if not analysis["texte"]:
+            continue
+        if not first:
+            yield ""
+        first = False
+        yield f"--- DEBUT FICHIER: {analysis['nom']} ---"
+        skipped_sheets = skipped.get(analysis["nom"])
+        if not skipped_sheets:
+            yield from iter_analysis_lines(analysis)
+        elif None in skipped_sheets:
+            # Fichier entièrement constitué du tableau des véhicules (CSV)
+            yield FLEET_TABLE_NOTE.format(skipped_sheets[None])
+        else:
+            yield from _skip_tables(iter_analysis_lines(analysis), skipped_sheets)
+
+
+def extract_key_information_from_chunk(chunk_text, part_index, part_count, client, on_event=None):
+    """
+    Utilise l'IA pour extraire les informations clés d'un extrait du dossier. Les erreurs sont propagées.
+    Si `on_event` est fourni, la réponse est reçue en flux et `on_event(part_index, événement)` est appelé
+    pour chaque champ et chaque véhicule dès qu'il est complet (voir jsonstream.py).
+    """
+
+    prompt = f"""
+    Vous êtes un expert en souscription d'assurance qui analyse un dossier de demande de devis complet.
+    Voici la partie {part_index}/{part_count} du contenu de tous les fichiers fournis, concaténés en un seul texte :
+    <dossier_complet>
+    {chunk_text}
+    </dossier_complet>
+
+    Votre tâche est de lire attentivement l'intégralité de cette partie du dossier et d'extraire les informations suivantes.
+    Retournez votre réponse exclusivement au format JSON. Si une information n'est pas trouvée, mettez la valeur `null` ou une liste vide [].
+    Les tableaux sont écrits une ligne par enregistrement, cellules séparées par "|", sous leur ligne d'en-tête. Une ligne « {COMMON_VALUES_PREFIX} » donne les colonnes dont la valeur est la même pour toutes les lignes du tableau : appliquez-les à chaque ligne.
+
+    1.  **"nom_entreprise"**: Le nom légal de l'entreprise.
+    2.  **"secteur_activite"**: Le secteur d'activité de l'entreprise.
+    3.  **"region"**: La région ou le département principal de l'entreprise.
+    4.  **"nombre_vehicules"**: Le nombre total de véhicules dans la flotte. Instruction : comptez les lignes du tableau de véhicules de cette partie.
+    5.  **"usage_flotte"**: L'usage principal de la flotte.
+    6.  **"type_flotte"**: Le type de véhicules majoritaire.
+    7.  **"chiffre_affaires_annuel"**: Le dernier chiffre d'affaires annuel.
+    8.  **"historique_sinistralite_resume"**: Un résumé court de l'historique de sinistralité.
+    9.  **"garanties_souhaitees"**: Une liste des garanties demandées (objets JSON avec "garantie", "incluse", "franchise_eur").
+    10. **"liste_vehicules"**: La liste détaillée de TOUS les véhicules présents dans cette partie. Chaque véhicule doit être un objet JSON. Extrayez les colonnes telles que "marque", "modele", "immatriculation", "date_mise_circulation", "valeur", etc.
+
+    Exemple de format JSON de sortie attendu :
+    {{
+      "nom_entreprise": "Transport Express SARL",
+      "secteur_activite": "Transport routier de marchandises",
+      "region": "Île-de-France",
+      "nombre_vehicules": 2,
+      "usage_flotte": "Transport national de marchandises",
+      "type_flotte": "Camions de livraison",
+      "chiffre_affaires_annuel": "2.5 M€",
+      "historique_sinistralite_resume": "3 sinistres responsables sur les 36 derniers mois",
+      "garanties_souhaitees": [
+        {{"garantie": "Responsabilité civile", "incluse": "Oui", "franchise_eur": 500}}
+      ],
+      "liste_vehicules": [
+        {{ "immatriculation": "AA-123-BB", "marque_modele": "Renault Master", "valeur": 25000 }},
+        {{ "immatriculation": "CC-456-DD", "marque_modele": "Peugeot Expert", "valeur": 22000 }}
+      ]
+    }}
+    """
+    request = dict(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": "Vous êtes un expert en extraction de données d'assurance au format JSON."},
+            {"role": "user", "content": prompt}
+        ],
+        response_format={"type": "json_object"},
+        temperature=0.0,
+    )
+    if on_event is None:
+        response = chat_completion(client, "extraction_informations_cles", **request)
+        result_json = response.choices[0].message.content
+        return json.loads(result_json)
+
+    parser = IncrementalJsonParser(stream_arrays=STREAMED_KEY_INFO_ARRAYS)
+
+    def on_delta(fragment):
+        for event in parser.feed(fragment):
+            on_event(part_index, event)
+
+    chat_completion_stream(client, "extraction_informations_cles", on_delta, **request)
+    return parser.close()
+
+
+@traced("smart_intake.extraction_informations_cles")
+def extract_key_information(all_content_text, client, problems, on_event=None):
+    """
+    Utilise l'IA pour extraire les informations clés de l'ensemble des documents
+    (`all_content_text` : texte du dossier, ou itérable de ses lignes, voir iter_dossier_lines).
+    Le dossier est découpé en extraits bornés en tokens, analysés en parallèle, puis les résultats
+    sont fusionnés (véhicules dédoublonnés par immatriculation, nombre de véhicules recalculé).
+    Les échecs partiels sont ajoutés à `problems` ; lève une PipelineError si rien n'a pu être extrait.
+    `on_event` active la réception en flux (voir extract_key_information_from_chunk) ; il est appelé
+    depuis les threads d'extraction.
+    """
+    chunks = split_into_chunks(all_content_text, KEY_INFO_CHUNK_TOKENS)
+    if not chunks:
+        raise PipelineError("Une erreur est survenue lors de l'extraction des informations clés : le dossier est vide.")
+
+    def extract_chunk(indexed_chunk):
+        index, chunk_text = indexed_chunk
+        try:
+            return extract_key_information_from_chunk(chunk_text, index, len(chunks), client, on_event)
+        except Exception as e:
+            problems.append(("warning", f"L'extraction de la partie {index}/{len(chunks)} du dossier a échoué : {e}"))
+            return None
+
+    partial_results = run_in_threads(extract_chunk, list(enumerate(chunks, start=1)), KEY_INFO_MAX_WORKERS)
+    partial_results = [result for result in partial_results if isinstance(result, dict)]
+    if not partial_results:
+        raise PipelineError("Une erreur est survenue lors de l'extraction des informations clés : aucune partie du dossier n'a pu être analysée.")
+    return merge_key_information(partial_results)
+
+
+@traced("smart_intake.extraction_dossier")
+def extract_dossier_information(analyses, uploaded_files, client, problems, on_event=None):
+    """
+    Informations clés du dossier : la liste des véhicules est lue directement dans les tableaux de flotte
+    (fleet.py) ; le LLM extrait les autres informations du reste du dossier, dont les tableaux de véhicules
+    sont retirés. Les véhicules trouvés par le LLM hors de ces tableaux sont ajoutés, sans doublons.
+    `on_event` : voir extract_key_information ; les véhicules des tableaux sont signalés en premier.
+    """
+    complete_texts(analyses, uploaded_files, problems)
+    vehicles, fleet_tables = extract_fleet(
+        ((a["nom"], iter_analysis_lines(a)) for a in analyses if a["texte"]), client, problems
+    )
+    if on_event is not None:
+        for vehicle in vehicles:
+            on_event(0, ("element", "liste_vehicules", vehicle))
+
+    extracted_data = extract_key_information(iter_dossier_lines(analyses, fleet_tables), client, problems, on_event)
+    if vehicles:
+        extracted_data["liste_vehicules"] = merge_vehicle_lists([vehicles, extracted_data.get("liste_vehicules")])
+        extracted_data["nombre_vehicules"] = len(extracted_data["liste_vehicules"])
+    return extracted_data
+
+
+def to_agent_data(extracted_data):
+    """Mappe les clés extraites par l'IA vers le format attendu par les agents suivants."""
+    return {
+        "Nom de l'entreprise": extracted_data.get("nom_entreprise"),
+        "Secteur d'activité": extracted_data.get("secteur_activite"),
+        "Région": extracted_data.get("region"),
+        "Nombre de véhicules": extracted_data.get("nombre_vehicules"),
+        "Usage": extracted_data.get("usage_flotte"),
+        "Type de flotte": extracted_data.get("type_flotte"),
+        "Chiffre d'affaires": extracted_data.get("chiffre_affaires_annuel"),
+        "Historique de sinistralité": extracted_data.get("historique_sinistralite_resume"),
+        "Liste des véhicules": extracted_data.get("liste_vehicules", [])
+    }
+
+
+# --- Agent Enrichment Layer ---
+
+@traced("enrichment_layer")
+def enrich_data(data, perplexity_client, openai_client):
+    """
+    Utilise Perplexity pour la recherche web et OpenAI pour l'extraction.
+    Retourne (données enrichies, résultats bruts de la recherche) ; lève une PipelineError en cas d'échec.
+    """
+    # 1. Définir les questions de recherche
+    activity_sector = data["Secteur d'activité"]
+    region = data["Région"]
+
+    search_queries = {
+        "sector_claim_rate": f"Quel est le taux de sinistralité moyen dans le secteur d'activité '{activity_sector}' en France ?",
+        "geo_risk": f"Quels sont les risques de vol, vandalisme et d'accident pour les véhicules d'entreprise dans la région '{region}' en France ?",
+        "telematics_risk_score_info": f"Comment un score de risque télématique influence-t-il l'assurance pour une flotte de '{data['Type de flotte']}' ?"
+    }
+    # Chaque recherche ne dépend que d'un critère : c'est lui qui indexe son résultat dans le cache
+    search_criteria = {
+        "sector_claim_rate": activity_sector,
+        "geo_risk": region,
+        "telematics_risk_score_info": data["Type de flotte"],
+    }
+    cache = get_cache()
+    search_cache_keys = {
+        key: make_key("recherche", ENRICHMENT_SEARCH_MODEL, key, normalize_key_component(criterion))
+        for key, criterion in search_criteria.items()
+    }
+    extraction_cache_key = make_key(
+        "enrichissement", ENRICHMENT_EXTRACTION_MODEL, ENRICHMENT_PROMPT_VERSION,
+        *(normalize_key_component(criterion) for criterion in search_criteria.values())
+    )
+
+    # 2. Effectuer les recherches avec Perplexity (en parallèle, uniquement celles absentes du cache)
+    search_results = {}
+    for key, cache_key in search_cache_keys.items():
+        cached_result = cache.get(cache_key)
+        record_cache_lookup("recherche", cached_result is not None)
+        if cached_result is not None:
+            search_results[key] = cached_result
+
+    def run_search(key):
+        response = chat_completion(
+            perplexity_client,
+            "recherche_web",
+            model=ENRICHMENT_SEARCH_MODEL,
+            messages=[
+                {"role": "system", "content": "Vous êtes un assistant de recherche. Fournissez des réponses factuelles et concises basées sur les informations disponibles sur Internet."},
+                {"role": "user", "content": search_queries[key]},
+            ],
+        )
+        return response.choices[0].message.content
+
+    missing_keys = [key for key in search_queries if key not in search_results]
+    try:
+        for key, result in zip(missing_keys, run_in_threads(run_search, missing_keys, len(missing_keys))):
+            search_results[key] = result
+            cache.set(search_cache_keys[key], result, ttl_seconds=ENRICHMENT_CACHE_TTL_SECONDS)
+    except AuthenticationError:
+        raise PipelineError("Erreur d'authentification Perplexity. Veuillez vérifier votre clé API.")
+    except Exception as e:
+        raise PipelineError(f"Une erreur est survenue lors de la recherche Perplexity : {e}")
+
+    # Conserver l'ordre des questions pour l'affichage et le prompt d'extraction
+    search_results = {key: search_results[key] for key in search_queries}
+
+    # 3. Extraire les informations structurées avec OpenAI
+
+    extraction_prompt = f"""
+    Vous êtes un expert en analyse de données pour l'assurance.
+    Voici des informations brutes provenant d'une recherche sur Internet :
+    <search_results>
+    {json.dumps(search_results, indent=2, ensure_ascii=False)}
+    </search_results>
+
+    Votre tâche est d'extraire les informations clés suivantes et de les retourner dans un format JSON strict.
+    Si une information n'est pas clairement trouvable, mettez "Non trouvé".
+
+    Format JSON attendu :
+    {{
+        "taux_sinistralite_secteur": "Ex: 12%",
+        "analyse_risque_geo": "Un résumé court des risques de la région.",
+        "facteur_risque_telematique": "Un résumé court de l'influence de la télématique."
+    }}
+
+    Ne retournez que le JSON.
+    """
+
+    extracted_info = cache.get(extraction_cache_key)
+    record_cache_lookup("enrichissement", extracted_info is not None)
+    if extracted_info is None:
+        try:
+            response = chat_completion(
+                openai_client,
+                "extraction_enrichissement",
+                model=ENRICHMENT_EXTRACTION_MODEL,
+                messages=[
+                    {"role": "system", "content": "Vous êtes un expert en extraction de données JSON."},
+                    {"role": "user", "content": extraction_prompt}
+                ],
+                response_format={"type": "json_object"},
+                temperature=0.0,
+            )
+            extracted_info_json = response.choices[0].message.content
+            extracted_info = json.loads(extracted_info_json)
+        except Exception as e:
+            raise PipelineError(f"Une erreur est survenue lors de l'extraction par OpenAI : {e}")
+        cache.set(extraction_cache_key, extracted_info, ttl_seconds=ENRICHMENT_CACHE_TTL_SECONDS)
+
+    # 4. Fusionner les données
+    enriched_data = data.copy()
+    enriched_data[ENRICHMENT_KEYS[0]] = extracted_info.get("taux_sinistralite_secteur", "Non trouvé")
+    enriched_data[ENRICHMENT_KEYS[1]] = extracted_info.get("analyse_risque_geo", "Non trouvé")
+    enriched_data[ENRICHMENT_KEYS[2]] = extracted_info.get("facteur_risque_telematique", "Non trouvé")
+    return enriched_data, search_results
+
+
+# --- Agent Rule Engine ---
+
+@traced("rule_engine")
+def build_quote(data):
+    """
+    Agent Rule Engine : applique les règles de souscription (rules.py) au dossier enrichi.
+    Retourne le JSON (en français) contenant toutes les informations pour le système de tarification.
+    """
+    evaluation = evaluate_dossier(data)
+    vehicles = [v for v in (data.get("Liste des véhicules") or []) if isinstance(v, dict)]
+    scored_vehicles = [
+        {**vehicle, "score_risque": round(float(score), 4)}
+        for vehicle, score in zip(vehicles, evaluation["scores_vehicules"])
+    ]
+
+    # Generate JSON for the quoting system (in French)
+    return {
+        "informations_client": {
+            "nom_entreprise": data.get("Nom de l'entreprise"),
+            "siren": data.get("SIREN", "N/A"), # Enrichi plus tard
+            "sante_financiere": data.get("Santé financière (fictif)", "N/A") # Enrichi plus tard
+        },
+        "informations_flotte": {
+            "nombre_vehicules": data.get("Nombre de véhicules"),
+            "type_flotte": data.get("Type de flotte"),
+            "usage": data.get("Usage"),
+            "liste_vehicules": scored_vehicles
+        },
+        "analyse_risque": {
+            "historique_sinistralite": data.get("Historique de sinistralité"),
+            "taux_sinistralite_secteur": data.get("Taux de sinistralité du secteur"),
+            "risque_geographique": data.get("Analyse du risque géographique"),
+            "info_score_telematique": data.get("Info sur le score télématique"),
+            "decision_souscription": evaluation["decision"],
+            "commentaire_souscription": evaluation["commentaires"]
+        },
+        "parametres_tarification": {
+            "niveau_risque": evaluation["niveau_risque"],
+            "segment": evaluation["segment"],
+            "score_risque_flotte": evaluation["score_flotte"],
+            "coefficient_secteur": evaluation["coefficient_secteur"],
+            "coefficient_geographique": evaluation["coefficient_geographique"],
+            "coefficient_sinistralite_secteur": evaluation["coefficient_sinistralite_secteur"],
+            "age_moyen_vehicules": evaluation["age_moyen_vehicules"],
+            "valeur_assuree_totale": evaluation["valeur_assuree_totale"],
+            "frequence_sinistres_annuelle": evaluation["frequence_sinistres_annuelle"],
+            "version_regles": evaluation["version_regles"]
+        }
+    }
+
+
+# --- Traitement complet d'un dossier ---
+
+def process_dossier(uploaded_files, openai_client, perplexity_client, progress=None, name="dossier"):
+    """
+    Enchaîne Smart Intake, Enrichment Layer et Rule Engine sur les fichiers d'un dossier.
+    `progress`, s'il est fourni, est appelé avec le nom de chaque étape au moment où elle démarre.
+    Retourne un dictionnaire décrivant le résultat ("statut" : "complet", "incomplet" ou "erreur"),
+    ainsi que le chemin de la trace d'exécution exportée.
+    """
+    with dossier_trace(name, nombre_fichiers=len(uploaded_files)) as root:
+        result = _process_dossier(uploaded_files, openai_client, perplexity_client, progress)
+        root.set(statut=result["statut"])
+    METRICS.inc("souscription_dossiers_total", {"statut": result["statut"]})
+    result["trace"] = export_trace(root)
+    return result
+
+
+def _process_dossier(uploaded_files, openai_client, perplexity_client, progress):
+    def report(stage):
+        if progress is not None:
+            progress(stage)
+
+    start = time.perf_counter()
+    uploaded_files = spool_files(uploaded_files)
+    result = {"statut": "erreur", "documents_fournis": [], "documents_manquants": [], "devis": None, "problemes": []}
+    try:
+        report("smart_intake")
+        analyses = analyze_files(uploaded_files, openai_client)
+        for analysis in analyses:
+            result["problemes"].extend(analysis["problemes"])
+
+        present_docs, missing_docs = check_completeness(analyses)
+        result["documents_fournis"] = present_docs
+        result["documents_manquants"] = missing_docs
+        if missing_docs:
+            result["statut"] = "incomplet"
+            return result
+
+        extracted_data = extract_dossier_information(analyses, uploaded_files, openai_client, result["problemes"])
+        data = to_agent_data(extracted_data)
+
+        report("enrichment_layer")
+        try:
+            data, _ = enrich_data(data, perplexity_client, openai_client)
+        except PipelineError as e:
+            # Comme dans l'interface, le dossier poursuit son traitement sans enrichissement
+            result["problemes"].append(("error", str(e)))
+
+        report("rule_engine")
+        result["devis"] = build_quote(data)
+        result["statut"] = "complet"
+    except PipelineError as e:
+        result["problemes"].append(("error", str(e)))
+    except Exception as e:
+        logger.exception("Échec du traitement du dossier")
+        result["problemes"].append(("error", f"Erreur inattendue : {e}"))
+    finally:
+        for uploaded_file in uploaded_files:
+            forget_pdf_source(uploaded_file.hash)
+        result["duree_secondes"] = round(time.perf_counter() - start, 3)
+    return result
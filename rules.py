@@ -0,0 +1,361 @@
+import datetime
+import functools
+import json
+import os
+import re
+
+import numpy as np
+
+from cache import normalize_key_component
+
+# --- Moteur de règles de souscription ---
+# Les règles sont déclarées sous forme de données (dictionnaire JSON), compilées une seule fois en
+# tableaux NumPy, puis appliquées colonne par colonne à toute la liste des véhicules.
+# Un fichier JSON de même structure que DEFAULT_RULES peut être fourni via la variable RULES_FILE.
+
+RULES_FILE = os.getenv("RULES_FILE")
+
+DEFAULT_RULES = {
+    "version": "4",
+    # Valeurs retenues lorsqu'une donnée véhicule est absente ou illisible
+    "valeurs_par_defaut": {"age_annees": 5.0, "valeur_eur": 25000.0},
+    # Chaque barème associe len(bornes) + 1 facteurs : facteurs[i] s'applique entre bornes[i-1] et bornes[i]
+    "age_vehicule": {"bornes": [3, 6, 10, 15], "facteurs": [0.95, 1.00, 1.05, 1.15, 1.30]},
+    "valeur_vehicule": {"bornes": [15000, 30000, 60000, 100000], "facteurs": [0.95, 1.00, 1.05, 1.12, 1.25]},
+    # Fréquence annuelle de sinistres par véhicule
+    "frequence_sinistres": {"bornes": [0.05, 0.10, 0.20, 0.35], "facteurs": [0.85, 1.00, 1.15, 1.35, 1.60]},
+    # Taux de sinistralité moyen du secteur (en %), issu de l'enrichissement
+    "taux_sinistralite_secteur": {"bornes": [5, 10, 20], "facteurs": [0.95, 1.00, 1.05, 1.10]},
+    "secteurs": [
+        {"mots_cles": ["transport", "logistique", "livraison", "messagerie", "fret"], "segment": "Transport Logistique", "facteur": 1.10},
+        {"mots_cles": ["taxi", "vtc", "ambulance", "transport de personnes"], "segment": "Transport de Personnes", "facteur": 1.15},
+        {"mots_cles": ["btp", "batiment", "construction", "travaux"], "segment": "BTP", "facteur": 1.08},
+        {"mots_cles": ["location"], "segment": "Location de Véhicules", "facteur": 1.12},
+        {"mots_cles": ["commerce", "distribution", "vente"], "segment": "Commerce Distribution", "facteur": 1.00},
+        {"mots_cles": ["conseil", "service", "informatique", "banque", "assurance"], "segment": "Services", "facteur": 0.92},
+    ],
+    "secteur_par_defaut": {"segment": "Autres Activités", "facteur": 1.00},
+    "regions": [
+        {"mots_cles": ["ile de france", "paris", "hauts de seine", "seine saint denis", "val de marne"], "facteur": 1.10},
+        {"mots_cles": ["provence", "marseille", "bouches du rhone", "alpes maritimes", "nice"], "facteur": 1.07},
+        {"mots_cles": ["auvergne rhone alpes", "lyon", "rhone"], "facteur": 1.03},
+        {"mots_cles": ["hauts de france", "lille", "nord"], "facteur": 1.03},
+        {"mots_cles": ["bretagne", "pays de la loire", "normandie", "nouvelle aquitaine", "occitanie"], "facteur": 0.97},
+    ],
+    "region_par_defaut": 1.00,
+    # Score de flotte -> niveau de risque -> décision de souscription. Les facteurs se multiplient :
+    # une flotte de transport francilienne sans sinistralité particulière obtient entre 1,1 et 1,3 (niveau Moyen)
+    "niveaux_risque": {"bornes": [1.00, 1.40, 1.80], "libelles": ["Faible", "Moyen", "Élevé", "Très élevé"]},
+    "decisions": {
+        "Faible": "Favorable",
+        "Moyen": "Favorable",
+        "Élevé": "Favorable sous réserve",
+        "Très élevé": "Défavorable",
+    },
+}
+
+# Noms de colonnes possibles pour les données véhicules extraites
+DATE_KEYS = ("date_mise_circulation", "date_mise_en_circulation", "date_1ere_mise_circulation", "mise_en_circulation", "annee")
+VALUE_KEYS = ("valeur", "valeur_eur", "valeur_vehicule", "valeur_assuree", "prix", "prix_achat")
+CLAIMS_KEYS = ("nombre_sinistres", "sinistres", "nb_sinistres")
+
+# Formats de date d'une cellule ou d'une valeur extraite (parse_date)
+_DATE_DMY_RE = re.compile(r"^(\d{1,2})[/.-](\d{1,2})[/.-](\d{2}|\d{4})$")
+_DATE_ISO_RE = re.compile(r"^(\d{4})-(\d{1,2})-(\d{1,2})(?:[T ].*)?$")
+_DATE_MONTH_RE = re.compile(r"^(\d{1,2})[/.-](\d{2}|\d{4})$")
+_YEAR_RE = re.compile(r"^(?:19|20)\d{2}$")
+# Dates Excel exprimées en nombre de jours (tableaux CSV exportés sans format)
+_EXCEL_EPOCH = datetime.date(1899, 12, 30)
+# Date recherchée dans un texte libre ("mise en circulation le 15/03/2019"), à défaut d'un format reconnu
+_DATE_PATTERNS = [
+    re.compile(r"(?P<year>(?:19|20)\d{2})[-/.](?P<month>\d{1,2})"),      # 2019-03-15, 2019/03
+    re.compile(r"(?:\d{1,2}[-/.])?(?P<month>\d{1,2})[-/.](?P<year>(?:19|20)\d{2})"),  # 15/03/2019, 03/2019
+    re.compile(r"(?P<year>(?:19|20)\d{2})"),                                # 2019
+]
+
+_AMOUNT_CLEAN_RE = re.compile(r"[^\d,.\-]")
+# Nombre écrit avec un séparateur de milliers : "25.000", "1.234.567", "25,000" (mais pas "0.500")
+_THOUSANDS_RE = {separator: re.compile(rf"^-?[1-9]\d{{0,2}}(?:\{separator}\d{{3}})+$") for separator in ",."}
+
+
+class CompiledRules:
+    """Règles converties en tableaux NumPy, prêtes à être appliquées en lot."""
+
+    def __init__(self, rules):
+        self.version = str(rules["version"])
+        self.default_age = float(rules["valeurs_par_defaut"]["age_annees"])
+        self.default_value = float(rules["valeurs_par_defaut"]["valeur_eur"])
+        self.age_scale = self._compile_scale(rules["age_vehicule"])
+        self.value_scale = self._compile_scale(rules["valeur_vehicule"])
+        self.claims_scale = self._compile_scale(rules["frequence_sinistres"])
+        self.sector_rate_scale = self._compile_scale(rules["taux_sinistralite_secteur"])
+        self.sectors = [
+            ([normalize_key_component(k) for k in s["mots_cles"]], s["segment"], float(s["facteur"])) for s in rules["secteurs"]
+        ]
+        self.default_sector = (rules["secteur_par_defaut"]["segment"], float(rules["secteur_par_defaut"]["facteur"]))
+        self.regions = [([normalize_key_component(k) for k in r["mots_cles"]], float(r["facteur"])) for r in rules["regions"]]
+        self.default_region_factor = float(rules["region_par_defaut"])
+        self.level_bounds = np.asarray(rules["niveaux_risque"]["bornes"], dtype=float)
+        self.level_labels = list(rules["niveaux_risque"]["libelles"])
+        self.decisions = dict(rules["decisions"])
+
+    @staticmethod
+    def _compile_scale(scale):
+        bounds = np.asarray(scale["bornes"], dtype=float)
+        factors = np.asarray(scale["facteurs"], dtype=float)
+        if len(factors) != len(bounds) + 1 or np.any(np.diff(bounds) <= 0):
+            raise ValueError(f"Barème invalide : {scale}")
+        return bounds, factors
+
+    @staticmethod
+    def apply_scale(scale, values):
+        """Facteur du barème pour chaque valeur (tableau NumPy)."""
+        bounds, factors = scale
+        return factors[np.searchsorted(bounds, values, side="right")]
+
+    def sector(self, label):
+        normalized = f" {normalize_key_component(label)} "
+        for keywords, segment, factor in self.sectors:
+            if any(f" {keyword} " in normalized for keyword in keywords):
+                return segment, factor
+        return self.default_sector
+
+    def region_factor(self, label):
+        normalized = f" {normalize_key_component(label)} "
+        for keywords, factor in self.regions:
+            if any(f" {keyword} " in normalized for keyword in keywords):
+                return factor
+        return self.default_region_factor
+
+    def risk_level(self, score):
+        return self.level_labels[int(np.searchsorted(self.level_bounds, score, side="right"))]
+
+
+def compile_rules(rules):
+    """Valide et compile une définition de règles."""
+    return CompiledRules(rules)
+
+
+@functools.lru_cache(maxsize=None)
+def load_rules(path=RULES_FILE):
+    """Charge et compile les règles (fichier JSON si fourni, sinon règles par défaut), une seule fois par processus."""
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return compile_rules(json.load(f))
+    return compile_rules(DEFAULT_RULES)
+
+
+# --- Conversion des données extraites en colonnes ---
+
+def _first_value(vehicle, keys):
+    for key in keys:
+        value = vehicle.get(key)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def parse_amount(value):
+    """
+    Convertit un montant ("25 000 €", "25.000 €", "25.000,50", "25,000.50", 25000) en float, NaN s'il est illisible.
+    Un séparateur suivi de groupes de trois chiffres est un séparateur de milliers ("1.234.567", "25,000").
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if value is None:
+        return np.nan
+    text = _AMOUNT_CLEAN_RE.sub("", str(value))
+    if "," in text and "." in text:
+        # Le dernier séparateur est le séparateur décimal
+        thousands = "." if text.rfind(",") > text.rfind(".") else ","
+        text = text.replace(thousands, "").replace(",", ".")
+    elif "," in text or "." in text:
+        separator = "," if "," in text else "."
+        if _THOUSANDS_RE[separator].match(text):
+            text = text.replace(separator, "")
+        elif text.count(separator) == 1:
+            text = text.replace(separator, ".")
+        else:
+            return np.nan
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+
+def _full_year(year):
+    # Année sur deux chiffres : siècle en cours jusqu'à l'année courante, siècle précédent au-delà
+    if year < 100:
+        year += 2000 if year <= datetime.date.today().year % 100 else 1900
+    return year
+
+
+def parse_date(value):
+    """Date au format ISO ("2019-03-14", "2019-03" ou "2019"), None si illisible."""
+    text = str(value or "").strip()
+    if not text:
+        return None
+    try:
+        match = _DATE_ISO_RE.match(text)
+        if match:
+            return datetime.date(*map(int, match.groups())).isoformat()
+        match = _DATE_DMY_RE.match(text)
+        if match:
+            day, month, year = (int(part) for part in match.groups())
+            return datetime.date(_full_year(year), month, day).isoformat()
+        match = _DATE_MONTH_RE.match(text)
+        if match:
+            month, year = int(match.group(1)), _full_year(int(match.group(2)))
+            return f"{year:04d}-{month:02d}" if 1 <= month <= 12 else None
+        if _YEAR_RE.match(text):
+            return text
+        serial = float(text)
+        if 1000 < serial < 100000:
+            return (_EXCEL_EPOCH + datetime.timedelta(days=int(serial))).isoformat()
+    except ValueError:
+        pass
+    return None
+
+
+def parse_year_fraction(value):
+    """Convertit une date de mise en circulation en année décimale (ex. 2019.17), NaN si illisible."""
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.year + (value.month - 1) / 12
+    if value is None or isinstance(value, bool):
+        return np.nan
+    if isinstance(value, (int, float)) and 1900 <= value <= 2100:
+        return float(value)
+    date = parse_date(value)
+    if date:
+        year, _, rest = date.partition("-")
+        return int(year) + (int(rest[:2] or 1) - 1) / 12
+    if isinstance(value, (int, float)):
+        return np.nan
+    text = str(value)
+    for pattern in _DATE_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            month = int(match.groupdict().get("month") or 1)
+            return int(match.group("year")) + (min(max(month, 1), 12) - 1) / 12
+    return np.nan
+
+
+def vehicle_columns(vehicles):
+    """Extrait de la liste des véhicules les colonnes utilisées par les règles (années, valeurs, sinistres)."""
+    count = len(vehicles)
+    years = np.fromiter((parse_year_fraction(_first_value(v, DATE_KEYS)) for v in vehicles), dtype=float, count=count)
+    values = np.fromiter((parse_amount(_first_value(v, VALUE_KEYS)) for v in vehicles), dtype=float, count=count)
+    claims = np.fromiter((parse_amount(_first_value(v, CLAIMS_KEYS)) for v in vehicles), dtype=float, count=count)
+    return years, values, claims
+
+
+def parse_claims_history(summary):
+    """
+    Extrait d'un résumé de sinistralité ("3 sinistres responsables sur les 36 derniers mois")
+    le nombre de sinistres et la période couverte en années. Retourne (None, None) si illisible.
+    """
+    text = normalize_key_component(summary)
+    if not text:
+        return None, None
+    if re.search(r"\b(aucun|zero|0) sinistres?\b", text):
+        claims = 0
+    else:
+        match = re.search(r"\b(\d+) sinistres?\b", text)
+        claims = int(match.group(1)) if match else None
+    period = None
+    match = re.search(r"\b(\d+) (?:derniers )?mois\b", text)
+    if match:
+        period = int(match.group(1)) / 12
+    else:
+        match = re.search(r"\b(\d+) (?:dernieres )?(?:ans|annees)\b", text)
+        if match:
+            period = float(match.group(1))
+    return claims, period
+
+
+def parse_percentage(value):
+    """Premier pourcentage trouvé dans un texte ("Environ 12,5 %" -> 12.5), NaN sinon."""
+    match = re.search(r"(\d+(?:[.,]\d+)?)\s*%", str(value or ""))
+    return float(match.group(1).replace(",", ".")) if match else np.nan
+
+
+# --- Évaluation ---
+
+def evaluate_dossier(data, rules=None, reference_date=None):
+    """
+    Applique les règles au dossier enrichi (format des agents) et retourne l'analyse de souscription :
+    scores par véhicule, score de flotte, niveau de risque, segment, décision et commentaires.
+    """
+    rules = rules or load_rules()
+    reference_date = reference_date or datetime.date.today()
+    reference_year = reference_date.year + (reference_date.month - 1) / 12
+    vehicles = [v for v in (data.get("Liste des véhicules") or []) if isinstance(v, dict)]
+
+    # Colonnes véhicules
+    years, values, vehicle_claims = vehicle_columns(vehicles)
+    ages = np.clip(reference_year - years, 0, None)
+    ages = np.where(np.isnan(ages), rules.default_age, ages)
+    values = np.where(np.isnan(values) | (values <= 0), rules.default_value, values)
+
+    # Fréquence de sinistres : colonne véhicule si disponible, sinon historique global réparti sur la flotte
+    fleet_size = len(vehicles) or parse_amount(data.get("Nombre de véhicules"))
+    claims, period_years = parse_claims_history(data.get("Historique de sinistralité"))
+    period_years = period_years or 3.0
+    fleet_frequency = np.nan
+    if claims is not None and fleet_size and not np.isnan(fleet_size):
+        fleet_frequency = claims / fleet_size / period_years
+    frequencies = np.where(np.isnan(vehicle_claims), fleet_frequency, vehicle_claims / period_years)
+    frequencies = np.where(np.isnan(frequencies), rules.claims_scale[0][0], frequencies)
+
+    # Facteurs par véhicule, puis facteurs du dossier
+    vehicle_scores = (
+        rules.apply_scale(rules.age_scale, ages)
+        * rules.apply_scale(rules.value_scale, values)
+        * rules.apply_scale(rules.claims_scale, frequencies)
+    )
+    segment, sector_factor = rules.sector(data.get("Secteur d'activité"))
+    region_factor = rules.region_factor(data.get("Région"))
+    sector_rate = parse_percentage(data.get("Taux de sinistralité du secteur"))
+    sector_rate_factor = 1.0 if np.isnan(sector_rate) else float(rules.apply_scale(rules.sector_rate_scale, np.array([sector_rate]))[0])
+    dossier_factor = sector_factor * region_factor * sector_rate_factor
+
+    # Score de flotte : moyenne des scores véhicules pondérée par la valeur assurée
+    fleet_vehicle_score = float(np.average(vehicle_scores, weights=values)) if len(vehicles) else 1.0
+    fleet_score = fleet_vehicle_score * dossier_factor
+    vehicle_scores = vehicle_scores * dossier_factor
+
+    level = rules.risk_level(fleet_score)
+    decision = rules.decisions.get(level, "À étudier")
+
+    mean_age = float(ages.mean()) if len(vehicles) else None
+    total_value = float(values.sum()) if len(vehicles) else None
+    mean_frequency = float(frequencies.mean()) if len(vehicles) else (None if np.isnan(fleet_frequency) else float(fleet_frequency))
+
+    comments = [f"Score de risque de la flotte : {fleet_score:.2f} (niveau {level}, segment {segment})."]
+    if len(vehicles):
+        formatted_value = f"{total_value:,.0f}".replace(",", " ")
+        comments.append(f"{len(vehicles)} véhicule(s), âge moyen {mean_age:.1f} ans, valeur assurée totale {formatted_value} €.")
+    else:
+        comments.append("Aucun véhicule détaillé : le score repose uniquement sur les facteurs du dossier.")
+    if mean_frequency is not None:
+        comments.append(f"Fréquence de sinistres estimée : {mean_frequency:.2f} par véhicule et par an.")
+    if sector_factor > 1 or region_factor > 1 or sector_rate_factor > 1:
+        comments.append(
+            f"Majorations : secteur x{sector_factor:.2f}, géographie x{region_factor:.2f}, sinistralité du secteur x{sector_rate_factor:.2f}."
+        )
+
+    return {
+        "decision": decision,
+        "commentaires": " ".join(comments),
+        "niveau_risque": level,
+        "segment": segment,
+        "score_flotte": round(fleet_score, 4),
+        "scores_vehicules": vehicle_scores,
+        "coefficient_secteur": sector_factor,
+        "coefficient_geographique": region_factor,
+        "coefficient_sinistralite_secteur": sector_rate_factor,
+        "age_moyen_vehicules": None if mean_age is None else round(mean_age, 2),
+        "valeur_assuree_totale": total_value,
+        "frequence_sinistres_annuelle": None if mean_frequency is None else round(mean_frequency, 4),
+        "version_regles": rules.version,
+    }
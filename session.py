@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import re
+import time
+import uuid
+
+from cache import CACHE_DIR, content_hash, make_key
+from instrumentation import record_cache_lookup
+from pipeline import EXTRACTION_VERSION, analyze_files, load_stored_text
+from spool import spool_files
+
+# --- Sessions de dossier ---
+# Une session conserve, pour un dossier en cours de constitution, le résultat de l'analyse de
+# chaque fichier (texte extrait, documents identifiés) et le résultat de chaque étape du pipeline
+# (« point de reprise »), avec l'empreinte des données dont il dépend. Quand le courtier ajoute un
+# fichier manquant ou que Streamlit réexécute le script, seuls les fichiers nouveaux sont analysés
+# et seules les étapes dont les données d'entrée ont changé sont recalculées.
+# Les sessions sont gardées en mémoire (st.session_state) et enregistrées sur disque (JSON), sans les
+# textes extraits : ceux-ci sont retrouvés par l'empreinte du fichier (cache disque ou texte sur disque).
+
+SESSION_DIR = os.getenv("DOSSIER_SESSION_DIR", os.path.join(CACHE_DIR, "sessions"))
+# Nombre maximal de sessions conservées sur disque : les moins récemment enregistrées sont supprimées
+SESSION_MAX_FILES = int(os.getenv("DOSSIER_SESSION_MAX_FILES", "1000"))
+
+logger = logging.getLogger(__name__)
+
+_SESSION_ID_RE = re.compile(r"[0-9a-f]{32}")
+
+
+def data_fingerprint(*values):
+    """Empreinte de données JSON, utilisée pour savoir si un point de reprise est encore valable."""
+    return content_hash(json.dumps(values, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+class DossierSession:
+    """Analyses des fichiers et points de reprise des étapes d'un dossier."""
+
+    def __init__(self, session_id=None, directory=SESSION_DIR):
+        self.id = session_id or uuid.uuid4().hex
+        self.path = os.path.join(directory, f"{self.id}.json")
+        self.files = {}   # empreinte du contenu -> analyse du fichier
+        self.stages = {}  # nom de l'étape -> {"empreinte", "resultat", "problemes"}
+        self._saved = None  # contenu du dernier enregistrement, pour ne réécrire que ce qui a changé
+
+    @classmethod
+    def load(cls, session_id, directory=SESSION_DIR):
+        """Recharge une session enregistrée ; une session vide est créée si l'identifiant est inconnu ou invalide."""
+        if not session_id or not _SESSION_ID_RE.fullmatch(session_id):
+            return cls(directory=directory)
+        session = cls(session_id, directory=directory)
+        try:
+            with open(session.path, encoding="utf-8") as f:
+                saved = json.load(f)
+            session.files = saved.get("fichiers", {})
+            session.stages = saved.get("etapes", {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("Session %s illisible, elle est réinitialisée : %s", session_id, e)
+        return session
+
+    def save(self):
+        """
+        Enregistre la session sur disque (écriture atomique), si elle a changé depuis le dernier enregistrement ;
+        les erreurs sont journalisées.
+        """
+        files = {h: _without_text(analysis) for h, analysis in self.files.items()}
+        content = json.dumps({"id": self.id, "fichiers": files, "etapes": self.stages}, ensure_ascii=False, sort_keys=True)
+        if content == self._saved:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"id": self.id, "mis_a_jour_le": time.time(), "fichiers": files, "etapes": self.stages}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            if self._saved is None:
+                # Premier enregistrement de la session par ce processus
+                _prune_sessions(os.path.dirname(self.path))
+            self._saved = content
+        except Exception as e:
+            logger.warning("Impossible d'enregistrer la session %s : %s", self.id, e)
+
+    def analyze_files(self, uploaded_files, client):
+        """
+        Analyse uniquement les fichiers absents de la session (comparés par empreinte de contenu)
+        et retourne les analyses de tous les fichiers, dans l'ordre de chargement.
+        Les analyses en erreur ne sont pas conservées : le fichier sera réanalysé à la prochaine exécution.
+        """
+        uploaded_files = spool_files(uploaded_files)
+        hashes = [f.hash for f in uploaded_files]
+        for file_hash in hashes:
+            # Session rechargée depuis le disque : le texte est retrouvé par l'empreinte, sinon le fichier est réanalysé
+            analysis = self.files.get(file_hash)
+            if analysis is not None and "texte" not in analysis:
+                if not load_stored_text(analysis, make_key("texte", file_hash, EXTRACTION_VERSION)):
+                    del self.files[file_hash]
+        new_files = {h: f for h, f in zip(hashes, uploaded_files) if h not in self.files}
+        for file_hash in hashes:
+            record_cache_lookup("session_fichier", file_hash not in new_files)
+
+        fresh = dict(zip(new_files, analyze_files(list(new_files.values()), client))) if new_files else {}
+        for file_hash, analysis in fresh.items():
+            if not any(level == "error" for level, _ in analysis["problemes"]):
+                self.files[file_hash] = analysis
+
+        analyses = []
+        for file_hash, uploaded_file in zip(hashes, uploaded_files):
+            analysis = dict(fresh.get(file_hash) or self.files[file_hash])
+            # Un même contenu peut avoir été chargé sous un autre nom
+            analysis["nom"] = uploaded_file.name
+            analysis["problemes"] = [tuple(problem) for problem in analysis["problemes"]]
+            analyses.append(analysis)
+
+        # Les fichiers retirés du dossier sont oubliés
+        self.files = {h: a for h, a in self.files.items() if h in hashes}
+        self.save()
+        return analyses
+
+    def run_stage(self, name, inputs, compute):
+        """
+        Retourne (résultat, problèmes) de l'étape `name` : depuis le point de reprise si `inputs`
+        n'a pas changé, sinon en appelant `compute(problems)`. Les exceptions sont propagées ; le point de
+        reprise est conservé avec ses avertissements, mais pas un résultat accompagné d'erreurs (résultat partiel).
+        """
+        fingerprint = make_key(name, data_fingerprint(inputs))
+        checkpoint = self.stages.get(name)
+        if checkpoint is not None and checkpoint["empreinte"] == fingerprint:
+            record_cache_lookup("session_etape", True)
+            return checkpoint["resultat"], [tuple(problem) for problem in checkpoint["problemes"]]
+
+        record_cache_lookup("session_etape", False)
+        problems = []
+        result = compute(problems)
+        if not any(level == "error" for level, _ in problems):
+            self.stages[name] = {"empreinte": fingerprint, "resultat": result, "problemes": list(problems)}
+            self.save()
+        return result, problems
+
+
+def _prune_sessions(directory, max_files=SESSION_MAX_FILES):
+    """Supprime les sessions les moins récemment enregistrées au-delà de `max_files`."""
+    sessions = []
+    try:
+        for entry in os.scandir(directory):
+            if entry.name.endswith(".json"):
+                sessions.append((entry.stat().st_mtime, entry.path))
+    except OSError:
+        return
+    sessions.sort()
+    for _, path in sessions[:max(0, len(sessions) - max_files)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _without_text(analysis):
+    """Analyse enregistrée dans la session : le texte extrait (jusqu'à plusieurs centaines de milliers de caractères) est omis."""
+    if analysis.get("texte") is None:
+        return analysis
+    return {key: value for key, value in analysis.items() if key != "texte"}
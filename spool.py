@@ -0,0 +1,211 @@
+import hashlib
+import io
+import itertools
+import mmap
+import os
+import shutil
+import tempfile
+import time
+import weakref
+
+from cache import CACHE_DIR, CACHE_TTL_SECONDS
+
+# --- Fichiers et textes d'un dossier, en mémoire bornée ---
+# Les fichiers chargés sont convertis une seule fois en IntakeFile :
+# - un fichier dépassant SPOOL_THRESHOLD_BYTES, ou qui ferait dépasser au dossier son budget
+#   mémoire (DOSSIER_MEMORY_BUDGET_BYTES), est recopié par blocs dans un fichier temporaire ;
+# - l'empreinte est calculée une seule fois, sur une projection mémoire (mmap) pour les fichiers sur disque ;
+# - les lecteurs (pypdf, openpyxl, python-docx) lisent le fichier disque à la demande, sans copie du contenu.
+# Le texte extrait d'un fichier volumineux est écrit sur disque au fil de l'extraction : l'analyse
+# n'en garde que le début (identification) et le texte complet est relu ligne par ligne (iter_text_lines).
+
+SPOOL_DIR = os.getenv("DOSSIER_SPOOL_DIR", os.path.join(CACHE_DIR, "spool"))
+TEXT_DIR = os.path.join(SPOOL_DIR, "textes")
+SPOOL_THRESHOLD_BYTES = int(os.getenv("SPOOL_THRESHOLD_BYTES", str(4 * 1024 * 1024)))
+DOSSIER_MEMORY_BUDGET_BYTES = int(os.getenv("DOSSIER_MEMORY_BUDGET_BYTES", str(32 * 1024 * 1024)))
+# Au-delà de cette taille, le texte extrait d'un fichier est écrit sur disque
+TEXT_SPOOL_THRESHOLD_CHARS = int(os.getenv("TEXT_SPOOL_THRESHOLD_CHARS", str(1_000_000)))
+# Début du texte conservé dans l'analyse d'un fichier dont le texte est sur disque
+TEXT_HEAD_CHARS = 200_000
+
+COPY_BLOCK_BYTES = 1024 * 1024
+
+_last_purge = 0.0
+
+
+class IntakeFile:
+    """
+    Fichier d'un dossier, en mémoire (`data`) ou sur disque (`path`), exposant la même interface
+    que les fichiers chargés dans Streamlit (name, type, size, getvalue).
+    """
+
+    def __init__(self, name, mime_type, data=None, path=None, temporary=False):
+        self.name = name
+        self.type = mime_type
+        self.path = path
+        self._data = data
+        self.size = len(data) if data is not None else os.path.getsize(path)
+        self._hash = None
+        if temporary:
+            # Le fichier temporaire est supprimé dès que l'objet n'est plus référencé
+            weakref.finalize(self, _remove_quietly, path)
+
+    @property
+    def hash(self):
+        """Empreinte SHA-256 du contenu, calculée une seule fois (sans copie pour un fichier sur disque)."""
+        if self._hash is None:
+            if self._data is not None:
+                self._hash = hashlib.sha256(self._data).hexdigest()
+            elif self.size == 0:
+                self._hash = hashlib.sha256(b"").hexdigest()
+            else:
+                with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                    self._hash = hashlib.sha256(view).hexdigest()
+        return self._hash
+
+    @property
+    def content(self):
+        """Contenu à transmettre aux fonctions d'extraction : les octets, ou le chemin du fichier sur disque."""
+        return self._data if self._data is not None else self.path
+
+    def open(self):
+        """Flux binaire en lecture sur le contenu."""
+        if self._data is not None:
+            # io.BytesIO partage le contenu d'un objet bytes tant qu'il n'est pas modifié
+            return io.BytesIO(self._data)
+        return open(self.path, "rb")
+
+    def getvalue(self):
+        """Contenu complet (copie en mémoire pour un fichier sur disque ; à éviter pour les gros fichiers)."""
+        if self._data is not None:
+            return self._data
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def spool_files(uploaded_files, budget=DOSSIER_MEMORY_BUDGET_BYTES):
+    """
+    Convertit les fichiers d'un dossier en IntakeFile ; ceux qui le sont déjà sont conservés tels quels.
+    Les fichiers volumineux, et ceux qui dépasseraient le budget mémoire du dossier, sont recopiés sur disque.
+    """
+    in_memory = sum(f.size for f in uploaded_files if isinstance(f, IntakeFile) and f.path is None)
+    intake_files = []
+    for uploaded_file in uploaded_files:
+        if isinstance(uploaded_file, IntakeFile):
+            intake_files.append(uploaded_file)
+            continue
+        size = getattr(uploaded_file, "size", None)
+        if size is None:
+            size = len(uploaded_file.getbuffer()) if hasattr(uploaded_file, "getbuffer") else len(uploaded_file.getvalue())
+        if size <= SPOOL_THRESHOLD_BYTES and in_memory + size <= budget:
+            in_memory += size
+            intake_files.append(IntakeFile(uploaded_file.name, uploaded_file.type, data=uploaded_file.getvalue()))
+        else:
+            intake_files.append(_spool_to_disk(uploaded_file))
+    return intake_files
+
+
+def _spool_to_disk(uploaded_file):
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=SPOOL_DIR, suffix=os.path.splitext(uploaded_file.name)[1])
+    with os.fdopen(fd, "wb") as out:
+        if hasattr(uploaded_file, "read"):
+            # Copie par blocs depuis le flux du fichier chargé : pas de copie complète en mémoire
+            uploaded_file.seek(0)
+            shutil.copyfileobj(uploaded_file, out, COPY_BLOCK_BYTES)
+            uploaded_file.seek(0)
+        else:
+            out.write(uploaded_file.getvalue())
+    return IntakeFile(uploaded_file.name, uploaded_file.type, path=path, temporary=True)
+
+
+# --- Textes extraits sur disque ---
+
+def text_path(key):
+    """Chemin du fichier de texte associé à une clé de cache (empreinte et version d'extraction)."""
+    return os.path.join(TEXT_DIR, key.replace(":", "_") + ".txt")
+
+
+def stored_text(key):
+    """Chemin du texte enregistré pour `key`, ou None s'il n'existe pas."""
+    path = text_path(key)
+    return path if os.path.exists(path) else None
+
+
+def spool_text(key, fragments, max_inline_chars=TEXT_SPOOL_THRESHOLD_CHARS):
+    """
+    Assemble les fragments d'un texte extrait. Retourne (texte, None) si le texte est court ; sinon le texte
+    est écrit sur disque au fil de l'eau et (début du texte, chemin du fichier) est retourné.
+    """
+    parts = []
+    size = 0
+    fragments = iter(fragments)
+    for fragment in fragments:
+        parts.append(fragment)
+        size += len(fragment)
+        if size > max_inline_chars:
+            break
+    else:
+        return "".join(parts), None
+
+    _purge_texts()
+    path = text_path(key)
+    os.makedirs(TEXT_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{id(parts)}.tmp"
+    head = "".join(itertools.islice(parts, _parts_for_chars(parts, TEXT_HEAD_CHARS)))[:TEXT_HEAD_CHARS]
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(parts)
+            del parts[:]
+            for fragment in fragments:
+                f.write(fragment)
+        os.replace(tmp_path, path)
+    except BaseException:
+        _remove_quietly(tmp_path)
+        raise
+    return head, path
+
+
+def _parts_for_chars(parts, max_chars):
+    """Nombre de premiers fragments nécessaires pour obtenir `max_chars` caractères."""
+    size = 0
+    for count, part in enumerate(parts, start=1):
+        size += len(part)
+        if size >= max_chars:
+            return count
+    return len(parts)
+
+
+def read_text_head(path, max_chars=TEXT_HEAD_CHARS):
+    """Début d'un texte enregistré sur disque."""
+    with open(path, encoding="utf-8") as f:
+        return f.read(max_chars)
+
+
+def iter_text_lines(path):
+    """Lignes d'un texte enregistré sur disque (sans fin de ligne), lues à la demande."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            yield line.rstrip("\n")
+
+
+def _purge_texts():
+    """Supprime, au plus une fois par heure, les textes enregistrés inutilisés depuis plus de CACHE_TTL_SECONDS."""
+    global _last_purge
+    now = time.time()
+    if now - _last_purge < 3600 or not os.path.isdir(TEXT_DIR):
+        return
+    _last_purge = now
+    for entry in os.scandir(TEXT_DIR):
+        try:
+            if entry.stat().st_atime < now - CACHE_TTL_SECONDS:
+                os.remove(entry.path)
+        except OSError:
+            pass
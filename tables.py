@@ -0,0 +1,167 @@
+import datetime
+import itertools
+import re
+
+# --- Encodage compact des tableaux (onglets Excel) ---
+# Les tableaux sont envoyés aux modèles sous une forme économe en tokens :
+# - la ligne d'en-tête est détectée une seule fois et placée juste après le marqueur d'onglet ;
+# - les colonnes entièrement vides sont supprimées, ainsi que les cellules vides en fin de ligne ;
+# - les colonnes dont la valeur est identique sur toutes les lignes sont sorties du tableau et
+#   indiquées une seule fois, sur une ligne « Valeurs identiques sur toutes les lignes » ;
+# - les cellules sont séparées par "|" sans espaces, les dates sans heure sont écrites au format ISO.
+# Le tableau est lu en deux passes (profil des colonnes, puis écriture) pour rester en flux.
+
+SHEET_START = "--- DEBUT CONTENU DE L'ONGLET: '{}' ---"
+SHEET_END = "--- FIN CONTENU DE L'ONGLET: '{}' ---"
+COMMON_VALUES_PREFIX = "Valeurs identiques sur toutes les lignes :"
+PREAMBLE_PREFIX = "Note :"
+CELL_SEPARATOR = "|"
+
+# Nombre de premières lignes examinées pour trouver la ligne d'en-tête
+HEADER_SEARCH_ROWS = 20
+# Nombre minimal de lignes de données pour sortir une colonne constante du tableau
+MIN_ROWS_FOR_COMMON_VALUES = 3
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def cell_to_text(value):
+    """Texte d'une cellule, sur une seule ligne et sans séparateur de colonnes ("" si vide)."""
+    if value is None:
+        return ""
+    if isinstance(value, datetime.datetime) and value.time() == datetime.time(0):
+        value = value.date()
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = value.isoformat() if isinstance(value, (datetime.date, datetime.time)) else str(value)
+    return _WHITESPACE_RE.sub(" ", text).strip().replace(CELL_SEPARATOR, "/")
+
+
+def _find_header(first_rows):
+    """Indice de la ligne d'en-tête : la première ligne ayant au moins la moitié du nombre maximal de cellules remplies."""
+    widths = [sum(1 for cell in row if cell) for row in first_rows]
+    best = max(widths, default=0)
+    for index, width in enumerate(widths):
+        if width and width * 2 >= best:
+            return index
+    return None
+
+
+def profile_table(rows):
+    """
+    Première passe : en-tête, lignes qui le précèdent (titres), colonnes utiles et valeurs constantes.
+    `rows` est un itérable de listes de textes de cellules ; les lignes vides sont ignorées.
+    """
+    rows = iter(rows)
+    first_rows = []
+    for row in rows:
+        if any(row):
+            first_rows.append(row)
+            if len(first_rows) >= HEADER_SEARCH_ROWS:
+                break
+    header_index = _find_header(first_rows)
+    if header_index is None:
+        return None
+
+    stats = {}  # indice de colonne -> [nombre de cellules remplies, première valeur, valeur constante ?]
+    data_rows = 0
+    for row in itertools.chain(first_rows[header_index + 1:], rows):
+        if any(row):
+            data_rows += 1
+            _update_stats(stats, row, data_rows)
+
+    header = first_rows[header_index]
+    width = max([len(header)] + [index + 1 for index in stats])
+    kept, common = [], []
+    for index in range(width):
+        filled, first_value, constant = stats.get(index, (0, "", False))
+        if filled == 0:
+            continue
+        if constant and filled == data_rows and data_rows >= MIN_ROWS_FOR_COMMON_VALUES:
+            common.append(index)
+        else:
+            kept.append(index)
+    return {
+        "preambule": first_rows[:header_index],
+        "entete": header,
+        "colonnes": kept,
+        "communes": [(header[index] if index < len(header) else "", stats[index][1]) for index in common],
+        "lignes": data_rows,
+    }
+
+
+def _update_stats(stats, row, row_number):
+    for index, cell in enumerate(row):
+        if not cell:
+            continue
+        entry = stats.get(index)
+        if entry is None:
+            # Une colonne vide sur les lignes précédentes n'est pas constante
+            stats[index] = [1, cell, row_number == 1]
+        else:
+            entry[0] += 1
+            if entry[2] and cell != entry[1]:
+                entry[2] = False
+    for index, entry in stats.items():
+        if entry[2] and (index >= len(row) or not row[index]):
+            entry[2] = False
+
+
+def iter_compact_table(title, rows_factory):
+    """
+    Produit l'encodage compact d'un tableau, ligne par ligne (chaque fragment se termine par un saut de ligne).
+    `rows_factory()` doit retourner un nouvel itérable sur les lignes (listes de valeurs brutes) à chaque appel.
+    """
+    profile = profile_table([cell_to_text(value) for value in row] for row in rows_factory())
+    yield SHEET_START.format(title) + "\n"
+    if profile is not None:
+        header = profile["entete"]
+        columns = profile["colonnes"]
+        yield CELL_SEPARATOR.join(header[index] if index < len(header) else "" for index in columns) + "\n"
+        if profile["communes"]:
+            yield COMMON_VALUES_PREFIX + " " + "; ".join(f"{name}={value}" for name, value in profile["communes"]) + "\n"
+        for row in profile["preambule"]:
+            yield PREAMBLE_PREFIX + " " + " ".join(cell for cell in row if cell) + "\n"
+
+        seen_header = False
+        for raw_row in rows_factory():
+            row = [cell_to_text(value) for value in raw_row]
+            if not any(row):
+                continue
+            if not seen_header:
+                # Les lignes jusqu'à l'en-tête inclus ont déjà été écrites
+                seen_header = row == header
+                continue
+            cells = [row[index] if index < len(row) else "" for index in columns]
+            while cells and not cells[-1]:
+                cells.pop()
+            yield CELL_SEPARATOR.join(cells) + "\n"
+    yield SHEET_END.format(title) + "\n\n"
+
+
+def summarize_tables(text, sample_rows=10):
+    """
+    Résumé des tableaux d'un texte encodé pour l'identification des documents : pour chaque onglet,
+    en-tête, valeurs communes, nombre de lignes et premières lignes ; le reste du texte est conservé.
+    """
+    output = []
+    in_sheet = False
+    header_seen = False
+    data_rows = 0
+    for line in text.splitlines():
+        if line.startswith(SHEET_START.split("{}")[0]):
+            in_sheet, header_seen, data_rows = True, False, 0
+            output.append(line)
+        elif line.startswith(SHEET_END.split("{}")[0]):
+            if data_rows > sample_rows:
+                output.append(f"[... {data_rows - sample_rows} autre(s) ligne(s), {data_rows} au total]")
+            output.append(line)
+            in_sheet = False
+        elif not in_sheet or not header_seen or line.startswith((COMMON_VALUES_PREFIX, PREAMBLE_PREFIX)):
+            header_seen = header_seen or (in_sheet and bool(line.strip()))
+            output.append(line)
+        elif line.strip():
+            data_rows += 1
+            if data_rows <= sample_rows:
+                output.append(line)
+    return "\n".join(output)
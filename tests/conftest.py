@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# Les modules sont à la racine du dépôt ; le cache disque et les traces sont isolés des données réelles
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_workdir = tempfile.mkdtemp(prefix="tests_souscription_")
+os.environ.setdefault("DOSSIER_CACHE_ENABLED", "0")
+os.environ.setdefault("DOSSIER_CACHE_DIR", os.path.join(_workdir, "cache"))
+os.environ.setdefault("TRACE_DIR", os.path.join(_workdir, "traces"))
@@ -0,0 +1,37 @@
+import time
+
+from cache import DiskCache
+
+
+def total_size(cache):
+    conn = cache._connection()
+    stored = conn.execute("SELECT total_size FROM stats").fetchone()[0]
+    assert stored == conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+    return stored
+
+
+def test_least_recently_used_entries_are_evicted_over_budget(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite3"), max_bytes=300)
+    for index in range(3):
+        cache.set(f"cle{index}", "x" * 98)
+        time.sleep(0.01)
+    cache.get("cle0")
+    time.sleep(0.01)
+    cache.set("cle3", "x" * 98)
+
+    assert [cache.get(f"cle{index}") is not None for index in range(4)] == [True, False, True, True]
+    assert total_size(cache) == 300
+
+
+def test_total_size_follows_replaced_and_expired_entries(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = DiskCache(path)
+    cache.set("cle", "x" * 98)
+    cache.set("cle", "x" * 8)
+    cache.set("expiree", "x" * 48, ttl_seconds=0.05)
+    assert total_size(cache) == 10 + 50
+    time.sleep(0.1)
+    cache.set("autre", "x")
+    assert total_size(cache) == 10 + 3
+    # Une base existante est relue avec la même taille totale
+    assert total_size(DiskCache(path)) == 13
@@ -0,0 +1,73 @@
+import json
+import os
+
+import pytest
+
+import export
+from export import ParquetVehicleWriter, export_quotes, iter_vehicle_rows, main
+
+QUOTE = {
+    "informations_client": {"nom_entreprise": "Transport Express SARL", "siren": "123456789"},
+    "informations_flotte": {
+        "liste_vehicules": [
+            {"immatriculation": "AB-123-CD", "valeur": 25000, "segment": "VUL", "autres_champs": "x", "couleur": "blanc"},
+        ],
+    },
+    "analyse_risque": {"decision_souscription": "Favorable"},
+    "parametres_tarification": {"niveau_risque": "Faible", "segment": "Transport Logistique", "score_risque_flotte": 0.9},
+}
+
+
+def test_vehicle_keys_colliding_with_quote_columns_are_kept_with_a_prefix():
+    (row,) = iter_vehicle_rows(QUOTE)
+    assert row["segment"] == "Transport Logistique"
+    assert json.loads(row["autres_champs"]) == {"vehicule_segment": "VUL", "vehicule_autres_champs": "x", "couleur": "blanc"}
+
+
+def test_parquet_file_is_removed_when_the_export_fails(tmp_path):
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / "vehicules.parquet")
+
+    def quotes():
+        yield QUOTE
+        raise RuntimeError("source illisible")
+
+    with pytest.raises(RuntimeError):
+        export_quotes(quotes(), vehicle_writers=[ParquetVehicleWriter(path, row_group_rows=1)])
+    assert not os.path.exists(path)
+
+
+def test_parquet_export(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "vehicules.parquet")
+    counts = export_quotes([QUOTE, QUOTE], vehicle_writers=[ParquetVehicleWriter(path)])
+    table = pq.read_table(path)
+    assert counts["vehicules"] == 2
+    assert table.column("valeur").to_pylist() == [25000.0, 25000.0]
+
+
+def test_csv_file_is_removed_when_the_export_fails(tmp_path):
+    source = tmp_path / "devis.ndjson"
+    source.write_text(json.dumps(QUOTE) + "\n{illisible\n", encoding="utf-8")
+    csv_path = tmp_path / "vehicules.csv"
+    with pytest.raises(ValueError):
+        main([str(source), "--csv", str(csv_path)])
+    assert not csv_path.exists()
+
+
+def test_csv_file_is_removed_when_the_parquet_writer_cannot_be_created(tmp_path, monkeypatch):
+    monkeypatch.setattr(export, "PARQUET_AVAILABLE", False)
+    source = tmp_path / "devis.ndjson"
+    source.write_text(json.dumps(QUOTE) + "\n", encoding="utf-8")
+    csv_path = tmp_path / "vehicules.csv"
+    assert main([str(source), "--csv", str(csv_path), "--parquet", str(tmp_path / "vehicules.parquet")]) == 2
+    assert not csv_path.exists()
+
+
+def test_csv_export(tmp_path):
+    source = tmp_path / "devis.ndjson"
+    source.write_text(json.dumps(QUOTE) + "\n", encoding="utf-8")
+    csv_path = tmp_path / "vehicules.csv"
+    assert main([str(source), "--csv", str(csv_path)]) == 0
+    header, row = csv_path.read_text(encoding="utf-8").splitlines()
+    assert "AB-123-CD" in row
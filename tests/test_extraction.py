@@ -0,0 +1,45 @@
+import io
+
+from pypdf import PdfWriter
+
+import extraction
+from extraction import PDF_MIME, PdfTextSource, extract_text, iter_text
+
+
+def blank_pdf(pages):
+    """PDF sans couche texte (comme un document numérisé)."""
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=595, height=842)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def test_full_text_extraction_closes_the_pdf(monkeypatch, tmp_path):
+    closed = []
+    monkeypatch.setattr(PdfTextSource, "close", lambda self: closed.append(self.data))
+    path = tmp_path / "scan.pdf"
+    path.write_bytes(blank_pdf(3))
+
+    assert extract_text(str(path), PDF_MIME) == ""
+    assert closed == [str(path)]
+
+
+def test_unread_fragments_close_the_pdf_when_discarded(monkeypatch):
+    closed = []
+    monkeypatch.setattr(PdfTextSource, "close", lambda self: closed.append(True))
+    fragments = iter_text(blank_pdf(3), PDF_MIME)
+    next(fragments)
+    fragments.close()
+    assert closed == [True]
+
+
+def test_head_of_a_scanned_pdf_stops_at_the_page_limit():
+    source = PdfTextSource(blank_pdf(50))
+    try:
+        assert source.head(10_000) == ""
+        assert len(source._pages) == extraction.PDF_HEAD_MAX_PAGES
+        assert not source.complete
+    finally:
+        source.close()
@@ -0,0 +1,75 @@
+from fleet import extract_fleet_table, iter_tables
+from tables import iter_compact_table
+
+
+def compact_lines(title, rows):
+    return "".join(iter_compact_table(title, lambda: iter(rows))).splitlines()
+
+
+def test_common_values_stay_aligned_when_trailing_cells_are_trimmed():
+    rows = [
+        ["Immatriculation", "Marque", "Modèle", "Valeur", "Usage"],
+        ["AB-123-CD", "Renault", "Master", 25000, "Livraison"],
+        ["AB-456-CD", "Peugeot", "Expert", 30000, "Livraison"],
+        ["AB-999-CD", "Ford", "Transit", None, "Livraison"],
+    ]
+    lines = compact_lines("Flotte", rows)
+    # La colonne Usage, constante, est sortie du tableau ; la dernière ligne perd sa cellule Valeur vide
+    assert any(line.startswith("Valeurs identiques") and "Usage=Livraison" in line for line in lines)
+    assert "AB-999-CD|Ford|Transit" in lines
+
+    (table,) = iter_tables("flotte.xlsx", lines)
+    vehicles = extract_fleet_table(table, None, [])
+
+    assert vehicles[-1] == {
+        "immatriculation": "AB-999-CD", "marque": "Ford", "modele": "Transit", "usage": "Livraison",
+    }
+    assert vehicles[0]["valeur"] == 25000
+    assert all(vehicle["usage"] == "Livraison" for vehicle in vehicles)
+
+
+def test_csv_table_is_parsed_with_typed_values():
+    lines = [
+        "N° Immat;Marque;Modèle;Date de mise en circulation;Valeur\n",
+        "ab123cd;Renault;Master;14/03/2019;25 000 €\n",
+        "TOTAL;;;;25 000 €\n",
+    ]
+    (table,) = iter_tables("flotte.csv", lines)
+    vehicles = extract_fleet_table(table, None, [])
+
+    assert vehicles == [{
+        "immatriculation": "AB-123-CD", "marque": "Renault", "modele": "Master",
+        "date_mise_circulation": "2019-03-14", "valeur": 25000,
+    }]
+
+
+def test_claims_sheet_is_not_a_fleet_table():
+    rows = [
+        ["Date", "Immatriculation", "Nature", "Responsabilité", "Montant"],
+        ["2023-01-12", "AB-123-CD", "Bris de glace", "Non", 800],
+    ]
+    (table,) = iter_tables("sinistres.xlsx", compact_lines("Sinistres", rows))
+    assert extract_fleet_table(table, None, []) is None
+
+
+def test_amounts_use_the_shared_parser():
+    lines = [
+        "Immatriculation;Marque;Valeur\n",
+        "AB-123-CD;Renault;25.000 €\n",
+        "AB-456-CD;Peugeot;25.000,50\n",
+        "AB-789-CD;Ford;non communiqué\n",
+    ]
+    (table,) = iter_tables("flotte.csv", lines)
+    values = [vehicle.get("valeur") for vehicle in extract_fleet_table(table, None, [])]
+    assert values == [25000, 25000.5, None]
+
+
+def test_short_and_excel_dates_are_parsed():
+    lines = [
+        "Immatriculation;Marque;Date de mise en circulation\n",
+        "AB-123-CD;Renault;03/19\n",
+        "AB-456-CD;Peugeot;43500\n",
+    ]
+    (table,) = iter_tables("flotte.csv", lines)
+    dates = [vehicle["date_mise_circulation"] for vehicle in extract_fleet_table(table, None, [])]
+    assert dates == ["2019-03", "2019-02-04"]
@@ -0,0 +1,21 @@
+import os
+import subprocess
+import sys
+
+from instrumentation import dossier_trace, export_trace
+
+
+def test_metrics_files_of_exited_processes_are_removed(tmp_path):
+    exited = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    stale = tmp_path / f"metrics_{exited.stdout.strip()}.prom"
+    stale.write_text("")
+    other = tmp_path / "metrics_global.prom"
+    other.write_text("")
+
+    with dossier_trace("dossier") as root:
+        pass
+    export_trace(root, trace_dir=str(tmp_path), metrics_file=str(tmp_path / "metrics_{pid}.prom"))
+
+    assert not stale.exists()
+    assert other.exists()
+    assert "processus=" in (tmp_path / f"metrics_{os.getpid()}.prom").read_text()
@@ -0,0 +1,48 @@
+import os
+import time
+
+from jobs import JOB_RETENTION_SECONDS, PENDING, JobStore
+from spool import IntakeFile
+
+
+def make_store(tmp_path):
+    return JobStore(path=str(tmp_path / "jobs.sqlite3"), directory=str(tmp_path / "jobs"))
+
+
+def submit_one(store):
+    return store.submit([IntakeFile("flotte.csv", "text/csv", data=b"Immatriculation\nAB-123-CD\n")])
+
+
+def test_stage_and_result_of_a_job_taken_over_by_another_worker_are_ignored(tmp_path):
+    store = make_store(tmp_path)
+    job_id = submit_one(store)
+    assert store.claim("ancien") == job_id
+    # Le job est repris par un autre traitement (signal de vie perdu)
+    store._connection().execute("UPDATE jobs SET statut = ?, proprietaire = NULL WHERE id = ?", (PENDING, job_id))
+    assert store.claim("nouveau") == job_id
+    store.set_stage(job_id, "nouveau", "smart_intake")
+
+    store.set_stage(job_id, "ancien", "rule_engine")
+    assert not store.finish(job_id, "ancien", result={"decision": "ignorée"})
+
+    job = store.get(job_id)
+    assert (job["etape"], job["proprietaire"], job["resultat"]) == ("smart_intake", "nouveau", None)
+
+
+def test_expired_jobs_and_orphaned_directories_are_purged(tmp_path):
+    store = make_store(tmp_path)
+    expired, pending = submit_one(store), submit_one(store)
+    assert store.claim("traitement") == expired
+    store.finish(expired, "traitement", result={})
+    old = time.time() - JOB_RETENTION_SECONDS - 60
+    store._connection().execute("UPDATE jobs SET fin = ? WHERE id = ?", (old, expired))
+    orphan = tmp_path / "jobs" / "orphelin"
+    orphan.mkdir()
+    for directory in (orphan, tmp_path / "jobs" / pending):
+        os.utime(directory, (old, old))
+
+    assert store.purge_expired() == 1
+    assert store.get(expired) is None
+    assert store.get(pending)["statut"] == PENDING
+    assert not orphan.exists()
+    assert (tmp_path / "jobs" / pending).is_dir()
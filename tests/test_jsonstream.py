@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from jsonstream import IncrementalJsonParser
+
+DOCUMENT = {
+    "nom_entreprise": "Transport \"Express\" SARL",
+    "nombre_vehicules": 2,
+    "liste_vehicules": [{"immatriculation": "AB-123-CD", "valeur": 25000}, {"immatriculation": "AB-456-CD", "notes": "[à vérifier], {x}"}],
+    "garanties_souhaitees": [],
+    "region": None,
+}
+
+
+@pytest.mark.parametrize("fragment_size", [1, 3, 16, 10_000])
+def test_events_match_the_complete_object(fragment_size):
+    text = json.dumps(DOCUMENT, ensure_ascii=False, indent=2)
+    parser = IncrementalJsonParser(stream_arrays=("liste_vehicules", "garanties_souhaitees"))
+    events = []
+    for start in range(0, len(text), fragment_size):
+        events.extend(parser.feed(text[start:start + fragment_size]))
+
+    assert parser.close() == DOCUMENT
+    assert [item for kind, key, item in events if kind == "element"] == DOCUMENT["liste_vehicules"]
+    assert [key for kind, key, _ in events if kind == "champ"] == list(DOCUMENT)
+
+
+def test_elements_are_reported_before_the_array_ends():
+    parser = IncrementalJsonParser(stream_arrays=("liste_vehicules",))
+    events = parser.feed('{"liste_vehicules": [{"immatriculation": "AB-123-CD"}, {"immat')
+    assert events == [("element", "liste_vehicules", {"immatriculation": "AB-123-CD"})]
+
+
+def test_incomplete_object_is_rejected():
+    parser = IncrementalJsonParser()
+    parser.feed('{"nom_entreprise": "Transport')
+    with pytest.raises(ValueError):
+        parser.close()
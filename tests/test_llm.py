@@ -0,0 +1,31 @@
+import time
+from types import SimpleNamespace
+
+from instrumentation import span
+from llm import chat_completion_stream
+
+
+class SlowStreamClient:
+    """Client dont la requête met `latency` secondes à être acceptée, puis répond en deux fragments."""
+
+    base_url = "https://api.openai.com/v1"
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        time.sleep(self.latency)
+        return iter([
+            SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None)
+            for text in ("Bon", "jour")
+        ])
+
+
+def test_time_to_first_fragment_includes_the_request():
+    deltas = []
+    with span("test") as root:
+        text = chat_completion_stream(SlowStreamClient(0.05), "appel", deltas.append, model="gpt-4o-mini", messages=[])
+    (call,) = root.children
+    assert text == "Bonjour" and deltas == ["Bon", "jour"]
+    assert call.attributes["premier_fragment_secondes"] >= 0.05
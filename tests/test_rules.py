@@ -0,0 +1,85 @@
+import datetime
+import math
+
+import pytest
+
+from rules import evaluate_dossier, parse_amount, parse_date, parse_year_fraction
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("25 000 €", 25000.0),
+    ("25.000 €", 25000.0),
+    ("25.000,50", 25000.5),
+    ("1.234.567", 1234567.0),
+    ("25,000", 25000.0),
+    ("25,000.50", 25000.5),
+    ("25000.50", 25000.5),
+    ("25,5", 25.5),
+    ("0.500", 0.5),
+    (25000, 25000.0),
+])
+def test_parse_amount(text, expected):
+    assert parse_amount(text) == expected
+
+
+@pytest.mark.parametrize("text", [None, "", "non communiqué", "1.2.3"])
+def test_parse_amount_unreadable(text):
+    assert math.isnan(parse_amount(text))
+
+
+def test_total_insured_value_with_french_thousands_separators():
+    data = {
+        "Liste des véhicules": [
+            {"immatriculation": "AB-123-CD", "valeur": "25.000 €", "date_mise_circulation": "2020-01-01"},
+            {"immatriculation": "AB-456-CD", "valeur": "1.234.567", "date_mise_circulation": "2020-01-01"},
+        ],
+    }
+    assert evaluate_dossier(data)["valeur_assuree_totale"] == 1259567.0
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2019-03-14", "2019-03-14"),
+    ("14/03/2019", "2019-03-14"),
+    ("14/03/19", "2019-03-14"),
+    ("03/2019", "2019-03"),
+    ("03/19", "2019-03"),
+    ("2019", "2019"),
+    (43500, "2019-02-04"),
+    ("43500", "2019-02-04"),
+    ("non communiqué", None),
+    (None, None),
+])
+def test_parse_date(value, expected):
+    assert parse_date(value) == expected
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("03/19", 2019 + 2 / 12),
+    (43500, 2019 + 1 / 12),
+    ("2019-03-14", 2019 + 2 / 12),
+    (2019, 2019.0),
+    ("mise en circulation le 15/03/2019", 2019 + 2 / 12),
+])
+def test_year_fraction_uses_the_shared_date_parser(value, expected):
+    assert parse_year_fraction(value) == pytest.approx(expected)
+
+
+def fleet_dossier(sector, region, claims, year=2021, sector_rate="12 %", vehicles=20):
+    return {
+        "Secteur d'activité": sector,
+        "Région": region,
+        "Taux de sinistralité du secteur": sector_rate,
+        "Historique de sinistralité": f"{claims} sinistres responsables sur les 36 derniers mois",
+        "Liste des véhicules": [{"date_mise_circulation": f"{year}-06-01", "valeur": 25000} for _ in range(vehicles)],
+    }
+
+
+@pytest.mark.parametrize("data, level, decision", [
+    (fleet_dossier("Conseil informatique", "Bretagne", 0, year=2024, sector_rate="4 %"), "Faible", "Favorable"),
+    (fleet_dossier("Transport routier de marchandises", "Île-de-France", 3), "Moyen", "Favorable"),
+    (fleet_dossier("Transport routier de marchandises", "Île-de-France", 15), "Élevé", "Favorable sous réserve"),
+    (fleet_dossier("Transport routier de marchandises", "Île-de-France", 30, year=2012), "Très élevé", "Défavorable"),
+])
+def test_default_rules_verdict_per_risk_level(data, level, decision):
+    analysis = evaluate_dossier(data, reference_date=datetime.date(2026, 1, 1))
+    assert (analysis["niveau_risque"], analysis["decision"]) == (level, decision)
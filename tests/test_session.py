@@ -0,0 +1,15 @@
+import os
+
+from session import DossierSession, _prune_sessions
+
+
+def test_oldest_sessions_are_pruned(tmp_path):
+    sessions = [DossierSession(directory=str(tmp_path)) for _ in range(3)]
+    for age, session in zip((300, 200, 100), sessions):
+        session.save()
+        os.utime(session.path, (os.path.getmtime(session.path) - age,) * 2)
+
+    _prune_sessions(str(tmp_path), max_files=2)
+
+    assert [os.path.exists(session.path) for session in sessions] == [False, True, True]
+    assert DossierSession.load(sessions[0].id, directory=str(tmp_path)).stages == {}
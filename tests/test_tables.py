@@ -0,0 +1,47 @@
+import datetime
+
+from tables import COMMON_VALUES_PREFIX, PREAMBLE_PREFIX, SHEET_END, SHEET_START, cell_to_text, iter_compact_table
+
+
+def compact(title, rows):
+    return "".join(iter_compact_table(title, lambda: iter(rows))).splitlines()
+
+
+def test_cell_to_text():
+    assert cell_to_text(None) == ""
+    assert cell_to_text(25000.0) == "25000"
+    assert cell_to_text(datetime.datetime(2019, 3, 14)) == "2019-03-14"
+    assert cell_to_text("a|b\n c") == "a/b c"
+
+
+def test_compact_table_moves_constant_columns_and_trims_rows():
+    rows = [
+        ["Flotte au 01/01/2024", None, None, None],
+        [None, None, None, None],
+        ["Immatriculation", "Marque", "Vide", "Usage", "Valeur"],
+        ["AB-123-CD", "Renault", None, "Livraison", 25000.0],
+        ["AB-456-CD", "Peugeot", None, "Livraison", 30000],
+        ["AB-789-CD", "Ford", None, "Livraison", None],
+    ]
+    assert compact("Flotte", rows) == [
+        SHEET_START.format("Flotte"),
+        "Immatriculation|Marque|Valeur",
+        f"{COMMON_VALUES_PREFIX} Usage=Livraison",
+        f"{PREAMBLE_PREFIX} Flotte au 01/01/2024",
+        "AB-123-CD|Renault|25000",
+        "AB-456-CD|Peugeot|30000",
+        "AB-789-CD|Ford",
+        SHEET_END.format("Flotte"),
+        "",
+    ]
+
+
+def test_short_tables_keep_constant_columns():
+    rows = [["Immatriculation", "Usage"], ["AB-123-CD", "Livraison"], ["AB-456-CD", "Livraison"]]
+    lines = compact("Flotte", rows)
+    assert "AB-123-CD|Livraison" in lines
+    assert not any(line.startswith(COMMON_VALUES_PREFIX) for line in lines)
+
+
+def test_empty_sheet():
+    assert compact("Vide", []) == [SHEET_START.format("Vide"), SHEET_END.format("Vide"), ""]